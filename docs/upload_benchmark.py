@@ -15,8 +15,13 @@ import matplotlib.pyplot as plt
 
 from telegram_upload.caption_formatter import FileSize
 from telegram_upload.client import TelegramManagerClient
+from telegram_upload.client.adaptive_semaphore import AdaptiveSemaphore
+from telegram_upload.client.part_buffers import PartBufferPool
+from telegram_upload.client.part_size import FixedPartSize, DEFAULT_PART_SIZE_POLICY, PART_SIZE_BENCHMARK_FILE
+from telegram_upload.client.upload_senders import UploadSenderPool
 from telegram_upload.config import default_config
 from telegram_upload.upload_files import NoLargeFiles
+from telegram_upload.utils import async_to_sync
 
 CHUNK = 1024 * 4
 REPEATS = 5
@@ -27,6 +32,7 @@ BENCHMARKS = {
     "full": (1024 * 1024 * 1024 * 2, 90, 5),
 }
 PARALLELS = range(1, 11)
+PART_SIZES = [32, 64, 128, 256, 512]
 DEFAULT_PARALLEL = 4
 RESULTS_FILE = 'upload_benchmark.json'
 
@@ -40,10 +46,12 @@ class BenchmarkResultBreakdown(TypedDict):
     times: List[float]
 
 
-class BenchmarkResult(TypedDict):
+class BenchmarkResult(TypedDict, total=False):
     """Benchmark result dict"""
     size: int
     parallel: int
+    connections: int
+    part_size: Optional[int]
     benchmark: BenchmarkResultBreakdown
 
 
@@ -109,19 +117,30 @@ class Benchmark:
 
 
 def benchmark_file_size(client: TelegramManagerClient, size: int, repeats: int = REPEATS, wait: int = 0,
-                        parallel: Optional[int] = None) -> BenchmarkResult:
-    """Benchmark the upload of a file of the specified size"""
-    # reset parallel upload blocks
+                        parallel: Optional[int] = None, connections: int = 1,
+                        part_size: Optional[int] = None) -> BenchmarkResult:
+    """Benchmark the upload of a file of the specified size. The part size is in KiB, by default
+    the part size of the file size in Telegram-upload."""
+    # reset parallel upload blocks and upload connections
     parallel = cast(int, parallel or DEFAULT_PARALLEL)
+    async_to_sync(client.upload_senders.close())
     client.parallel_upload_blocks = parallel
+    client.upload_connections = connections
     client.reconnecting_lock = asyncio.Lock()
-    client.upload_semaphore = asyncio.Semaphore(parallel)
+    # fixed limit to benchmark each parallel value
+    client.upload_semaphore = AdaptiveSemaphore(parallel * connections, parallel * connections)
+    client.upload_senders = UploadSenderPool(client, connections)
+    client.upload_buffers = PartBufferPool(parallel * connections + client.read_ahead_parts + 1)
+    client.part_size_policy = FixedPartSize(part_size) if part_size else DEFAULT_PART_SIZE_POLICY
+    # The part size used. The fixed part size is increased for the files with too many parts.
+    part_size = client.part_size_policy.get_upload_part_size(size)
     # create file
     path = create_file(size)
     # benchmark upload
     benchmark = Benchmark(lambda: upload_file(client, path), repeats, wait)
     benchmark()
-    click.echo(f"Size: {size} bytes  -  Parallel: {parallel}")
+    click.echo(f"Size: {size} bytes  -  Parallel: {parallel}  -  Connections: {connections}  -  "
+               f"Part size: {part_size} KiB")
     click.echo(f"Median: {benchmark.median} seconds")
     click.echo(f"Average: {benchmark.average} seconds")
     click.echo(f"Minimum: {benchmark.minimum} seconds")
@@ -133,6 +152,8 @@ def benchmark_file_size(client: TelegramManagerClient, size: int, repeats: int =
     return {
         "size": size,
         "parallel": parallel,
+        "connections": connections,
+        "part_size": part_size,
         "benchmark": {
             "minimum": benchmark.minimum,
             "maximum": benchmark.maximum,
@@ -199,8 +220,9 @@ def cli():
 @click.option('--repeats', '-r', default=None, type=int, help='Number of repeats')
 @click.option('--benchmark', '-b', default=None, type=click.Choice(list(BENCHMARKS.keys())), help='Benchmark name')
 @click.option('--parallel', '-p', default=None, type=int, help='Parallel parts uploaded')
+@click.option('--connections', '-c', default=1, type=int, help='Upload connections')
 @click.option('--results-file', '-f', default=RESULTS_FILE, type=str, help='JSON results file')
-def benchmark(repeats, benchmark, parallel, results_file):
+def benchmark(repeats, benchmark, parallel, connections, results_file):
     client = TelegramManagerClient(default_config())
     client.start()
     if benchmark:
@@ -214,12 +236,44 @@ def benchmark(repeats, benchmark, parallel, results_file):
     results = []
     for size, wait, def_repeats in benchmarks:
         for parallel in parallels:
-            benchmark_result = benchmark_file_size(client, size, repeats or def_repeats, wait, parallel)
+            benchmark_result = benchmark_file_size(client, size, repeats or def_repeats, wait, parallel, connections)
             results.append(benchmark_result)
     with open(results_file, 'w') as file:
         json.dump(results, file, indent=4)
 
 
+@cli.command('part-sizes')
+@click.option('--repeats', '-r', default=None, type=int, help='Number of repeats')
+@click.option('--benchmark', '-b', default=None, type=click.Choice(list(BENCHMARKS.keys())), help='Benchmark name')
+@click.option('--part-size', '-s', 'part_sizes', multiple=True, type=int,
+              help='Part size in KiB. This option can be used multiple times.')
+@click.option('--parallel', '-p', default=DEFAULT_PARALLEL, type=int, help='Parallel parts uploaded')
+@click.option('--connections', '-c', default=1, type=int, help='Upload connections')
+@click.option('--results-file', '-f', default=PART_SIZE_BENCHMARK_FILE, type=str, help='JSON results file')
+def part_sizes_benchmark(repeats, benchmark, part_sizes, parallel, connections, results_file):
+    """Measure the upload time of each part size. The results file can be used by the
+    ``--part-size benchmark`` option of telegram-upload."""
+    client = TelegramManagerClient(default_config())
+    client.start()
+    if benchmark:
+        benchmarks = [BENCHMARKS[benchmark]]
+    else:
+        benchmarks = list(BENCHMARKS.values())
+    results = []
+    for size, wait, def_repeats in benchmarks:
+        for part_size in part_sizes or PART_SIZES:
+            benchmark_result = benchmark_file_size(client, size, repeats or def_repeats, wait, parallel, connections,
+                                                   part_size)
+            results.append(benchmark_result)
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+    with open(results_file, 'w') as file:
+        json.dump(results, file, indent=4)
+    for size, grouped in groupby(results, lambda x: x["size"]):
+        best = min(grouped, key=lambda x: x["benchmark"]["median"])
+        click.echo(f"{FileSize(size).for_humans}: {best['part_size']} KiB "
+                   f"({FileSize(size / best['benchmark']['median']).for_humans}/s)")
+
+
 @cli.command()
 @click.option('--results-file', '-f', default=RESULTS_FILE, type=click.Path(exists=True, dir_okay=False),
               help='JSON results file')
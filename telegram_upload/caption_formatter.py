@@ -11,7 +11,7 @@ from typing import Any, Sequence, Mapping, Tuple, Optional
 
 import click
 
-from telegram_upload.video import video_metadata
+from telegram_upload.video import probe_media
 
 try:
     from typing import LiteralString
@@ -134,39 +134,26 @@ class FileSize:
 class FileMedia:
     def __init__(self, path: str):
         self.path = path
-        self.metadata = video_metadata(path)
-
-    @cached_property
-    def video_metadata(self) -> Any:
-        metadata = self.metadata
-        meta_groups = None
-        if hasattr(metadata, '_MultipleMetadata__groups'):
-            # Is mkv
-            meta_groups = metadata._MultipleMetadata__groups
-        if metadata is not None and not metadata.has('width') and meta_groups:
-            return meta_groups[next(filter(lambda x: x.startswith('video'), meta_groups._key_list))]
-        return metadata
+        self.probe = probe_media(path)
 
     @property
     def duration(self) -> Optional[Duration]:
-        if self.metadata and self.metadata.has('duration'):
-            return Duration(self.metadata.get('duration').seconds)
-
-    def _get_video_metadata(self, key: str) -> Optional[Any]:
-        if self.video_metadata and self.video_metadata.has(key):
-            return self.video_metadata.get(key)
+        if self.probe and self.probe.duration:
+            return Duration(self.probe.duration)
 
     def _get_metadata(self, key: str) -> Optional[Any]:
-        if self.metadata and self.metadata.has(key):
-            return self.metadata.get(key)
+        if self.probe:
+            return self.probe.tags.get(key)
 
     @property
     def width(self) -> Optional[int]:
-        return self._get_video_metadata('width')
+        if self.probe:
+            return self.probe.width
 
     @property
     def height(self) -> Optional[int]:
-        return self._get_video_metadata('height')
+        if self.probe:
+            return self.probe.height
 
     @property
     def title(self) -> Optional[str]:
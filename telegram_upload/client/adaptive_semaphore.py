@@ -0,0 +1,101 @@
+import asyncio
+import collections
+import time
+from typing import Optional
+
+
+INCREASE_LATENCY_TOLERANCE = 0.25
+DECREASE_FACTOR = 0.5
+LATENCY_EWMA_WEIGHT = 0.2
+
+
+class AdaptiveSemaphore:
+    """Semaphore with an adaptive number of permits (AIMD). The limit grows additively while the
+    latency of the requests does not get worse than the best latency observed, and it is reduced
+    multiplicatively on congestion (429 errors, connection errors or flood waits). After a decrease
+    the limit grows again with the following successful requests.
+    """
+    def __init__(self, value: int, minimum: int = 1, maximum: Optional[int] = None):
+        self.minimum = minimum
+        self.maximum = max(value, maximum or value)
+        self.limit = float(value)
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self.last_decrease = 0.0
+        self._waiters = collections.deque()
+
+    @property
+    def value(self) -> int:
+        """Number of permits currently available in total."""
+        return max(self.minimum, min(self.maximum, int(self.limit)))
+
+    def locked(self) -> bool:
+        return self.in_flight >= self.value
+
+    async def acquire(self) -> bool:
+        while self.locked():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The permit was handed to this task. Give it to another waiter.
+                    self._wake_up()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        free = self.value - self.in_flight
+        for waiter in list(self._waiters):
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def increase(self, latency: float) -> None:
+        """Register a successful request. The limit grows by one permit for each full window of
+        requests whose latency is close to the best latency observed.
+
+        :param latency: Seconds spent by the request.
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = (1 - LATENCY_EWMA_WEIGHT) * self.latency + LATENCY_EWMA_WEIGHT * latency
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+        if self.latency <= self.best_latency * (1 + INCREASE_LATENCY_TOLERANCE) and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake_up()
+
+    def decrease(self) -> bool:
+        """Register a congestion error. The limit is reduced once per round trip, so the errors of
+        the requests of the same window only reduce it once.
+
+        :return: True if the limit has been reduced.
+        """
+        now = time.monotonic()
+        if self.latency is not None and now - self.last_decrease < self.latency:
+            return False
+        self.last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * DECREASE_FACTOR)
+        # The latency before the congestion is not a valid reference anymore
+        self.best_latency = None
+        return True
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl import TLRequest
+
+
+def get_request_chat(request: TLRequest) -> Optional[int]:
+    """Id of the chat of the request. None if the request is not sent to a chat."""
+    peer = getattr(request, 'peer', None) or getattr(request, 'to_peer', None)
+    if peer is None:
+        return None
+    try:
+        return utils.get_peer_id(peer)
+    except (TypeError, ValueError):
+        return None
+
+
+class FloodWaitLimiter:
+    """Flood waits received from Telegram by request class (and chat), shared by all the clients
+    of the process. The requests of a class wait until its flood wait has finished, without
+    blocking the event loop or the requests of other classes. For example, a flood wait sending
+    a message to a chat does not stop the upload of the file parts.
+    """
+    def __init__(self):
+        # (constructor id, chat id or None) -> monotonic time when the flood wait finishes
+        self.waits: Dict[Tuple[int, Optional[int]], float] = {}
+
+    def get_remaining(self, request: TLRequest) -> float:
+        """Seconds until the request can be sent."""
+        chat = get_request_chat(request)
+        until = self.waits.get((request.CONSTRUCTOR_ID, None), 0.0)
+        if chat is not None:
+            until = max(until, self.waits.get((request.CONSTRUCTOR_ID, chat), 0.0))
+        return max(0.0, until - time.monotonic())
+
+    def record(self, request: TLRequest, error: FloodWaitError) -> None:
+        """Register the flood wait of a request. The requests of the same class to the same chat, or
+        all the requests of the class if the request is not sent to a chat, will wait for it.
+        """
+        now = time.monotonic()
+        self.waits = {key: until for key, until in self.waits.items() if until > now}
+        key = (request.CONSTRUCTOR_ID, get_request_chat(request))
+        self.waits[key] = max(self.waits.get(key, 0.0), now + error.seconds)
+
+    async def wait(self, request: TLRequest) -> None:
+        """Wait for the flood wait of the request class, if any."""
+        remaining = self.get_remaining(request)
+        while remaining > 0:
+            await asyncio.sleep(remaining)
+            remaining = self.get_remaining(request)
+
+
+FLOOD_LIMITER = FloodWaitLimiter()
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from typing import Callable, List, Optional, Set
+
+from telethon import helpers
+
+from telegram_upload.utils import get_environment_integer
+
+
+# Maximum number of message ids of a ForwardMessagesRequest or a DeleteMessagesRequest
+MAX_BATCH_MESSAGES = 100
+MESSAGE_BATCH_INTERVAL = get_environment_integer('TELEGRAM_UPLOAD_MESSAGE_BATCH_INTERVAL', 30)
+
+
+class MessageBatch:
+    """Messages collected to be forwarded or deleted with one request. The batch is sent when it has
+    the maximum number of messages of a request, when its first message has waited for the interval,
+    and when the caller flushes it (at the end of an album or of the files). The interval is timed
+    by the event loop, so it only expires while the loop runs (for example, during the next upload).
+    """
+    def __init__(self, send: Callable[[list], Optional[object]], size: int = MAX_BATCH_MESSAGES,
+                 interval: float = MESSAGE_BATCH_INTERVAL):
+        """
+        :param send: Function to send the messages. It can be a coroutine function.
+        :param size: Maximum number of messages of the batch.
+        :param interval: Maximum seconds to wait for more messages.
+        """
+        self.send = send
+        self.size = size
+        self.interval = interval
+        self.messages: List = []
+        self.started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_tasks: Set[asyncio.Task] = set()
+
+    async def add(self, message) -> None:
+        if not self.messages:
+            self.started = time.monotonic()
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._on_timer)
+        self.messages.append(message)
+        if len(self.messages) >= self.size or time.monotonic() - self.started >= self.interval:
+            await self._send()
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        task = asyncio.get_running_loop().create_task(self._send())
+        self._timer_tasks.add(task)
+        task.add_done_callback(self._timer_tasks.discard)
+
+    async def _send(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.messages:
+            return
+        messages, self.messages = self.messages, []
+        await helpers._maybe_await(self.send(messages))
+
+    async def flush(self) -> None:
+        """Send the messages of the batch, if any, and wait for the batches sent by the interval."""
+        await self._send()
+        if self._timer_tasks:
+            await asyncio.gather(*self._timer_tasks)
@@ -0,0 +1,309 @@
+import asyncio
+import collections
+import functools
+import mmap
+import os
+import struct
+from typing import Union, Tuple, Optional, Sequence, Set
+
+from telethon import helpers
+from telethon.tl import functions
+
+from telegram_upload.utils import get_environment_integer
+
+
+MAX_PART_SIZE = 512 * 1024
+READ_AHEAD_PARTS = get_environment_integer('TELEGRAM_UPLOAD_READ_AHEAD_PARTS', 2)
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def serialize_buffer(data: Buffer) -> tuple:
+    """Same as TLObject.serialize_bytes but for any bytes-like object, without copying the data.
+    The chunks returned must be joined by the caller.
+    """
+    if len(data) < 254:
+        padding = (len(data) + 1) % 4
+        header = bytes([len(data)])
+    else:
+        padding = len(data) % 4
+        header = bytes([254, len(data) % 256, (len(data) >> 8) % 256, (len(data) >> 16) % 256])
+    if padding != 0:
+        padding = 4 - padding
+    return header, data, bytes(padding)
+
+
+class BufferSaveFilePartRequest(functions.upload.SaveFilePartRequest):
+    """SaveFilePartRequest whose part is a view of a reusable buffer. The part is copied only
+    once, when the request is serialized to be sent.
+    """
+    def _bytes(self):
+        return b''.join((
+            struct.pack('<I', self.CONSTRUCTOR_ID),
+            struct.pack('<q', self.file_id),
+            struct.pack('<i', self.file_part),
+        ) + serialize_buffer(self.bytes))
+
+
+class BufferSaveBigFilePartRequest(functions.upload.SaveBigFilePartRequest):
+    """SaveBigFilePartRequest whose part is a view of a reusable buffer. The part is copied only
+    once, when the request is serialized to be sent.
+    """
+    def _bytes(self):
+        return b''.join((
+            struct.pack('<I', self.CONSTRUCTOR_ID),
+            struct.pack('<q', self.file_id),
+            struct.pack('<i', self.file_part),
+            struct.pack('<i', self.file_total_parts),
+        ) + serialize_buffer(self.bytes))
+
+
+class PartBufferPool:
+    """Bounded pool of preallocated buffers for the file parts. The buffers are created on demand
+    up to the size of the pool and reused afterwards, so the memory used by the parts is limited
+    to size × buffer_size.
+    """
+    def __init__(self, size: int, buffer_size: int = MAX_PART_SIZE):
+        self.size = size
+        self.buffer_size = buffer_size
+        self.created = 0
+        self._free = collections.deque()
+        self._waiters = collections.deque()
+
+    async def acquire(self) -> bytearray:
+        """Get a free buffer. Wait if all the buffers are in use."""
+        while not self._free and self.created >= self.size:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # This task was woken up for a free buffer. Wake up another waiter.
+                    self._wake_up()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        if self._free:
+            return self._free.pop()
+        self.created += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray) -> None:
+        """Return a buffer to the pool."""
+        self._free.append(buffer)
+        self._wake_up()
+
+    def discard(self, buffer: bytearray) -> None:
+        """Forget a buffer that cannot be reused (for example, a worker thread may still be
+        writing to it). A new buffer can be created in its place.
+        """
+        self.created -= 1
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+
+async def call_stream(fn, *args, threaded: bool = False, pending: Optional[Set[asyncio.Future]] = None):
+    """Call a read method of the stream. If threaded is True, the call is made in a worker
+    thread so the event loop is not blocked by the disk. Asynchronous streams are awaited
+    in the event loop.
+
+    :param pending: Set of the calls running in worker threads. The call is in the set until it
+        finishes, even if the caller is cancelled.
+    """
+    if threaded:
+        future = asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+        if pending is not None:
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+        # The worker thread cannot be stopped. The future is not cancelled, so it tells when the call ends.
+        result = await asyncio.shield(future)
+    else:
+        result = fn(*args)
+    return await helpers._maybe_await(result)
+
+
+async def readinto_part(stream, view: memoryview, threaded: bool = False,
+                        pending: Optional[Set[asyncio.Future]] = None) -> int:
+    """Fill the view with the next bytes of the stream. Short reads are retried until the view
+    is full or the end of the stream is reached.
+
+    :param pending: Set of the calls running in worker threads. See call_stream.
+    :return: Number of bytes read.
+    """
+    size = 0
+    while size < len(view):
+        try:
+            read = await call_stream(stream.readinto, view[size:], threaded=threaded, pending=pending)
+        except (AttributeError, NotImplementedError):
+            # The stream does not support readinto
+            data = await call_stream(stream.read, len(view) - size, threaded=threaded, pending=pending)
+            if not isinstance(data, bytes):
+                raise TypeError(
+                    'file descriptor returned {}, not bytes (you must '
+                    'open the file in bytes mode)'.format(type(data)))
+            read = len(data)
+            view[size:size + read] = data
+        if not read:
+            break
+        size += read
+    return size
+
+
+class PartReader:
+    """Read the parts of a stream for the upload. With a depth greater than zero, the next parts
+    are read ahead in a worker thread while the previous parts are being sent, so the latency of
+    the disk and the latency of the network overlap.
+    """
+    def __init__(self, stream, part_size: int, part_indexes: Sequence[int], buffers: PartBufferPool,
+                 depth: int = READ_AHEAD_PARTS):
+        self.stream = stream
+        self.part_size = part_size
+        self.part_indexes = part_indexes
+        self.buffers = buffers
+        self.depth = depth
+        self._indexes = iter(part_indexes)
+        self._stream_index = 0
+        self._queue = asyncio.Queue(maxsize=depth) if depth else None
+        self._task = None
+        # Reads and seeks running in worker threads
+        self._stream_calls: Set[asyncio.Future] = set()
+
+    async def _read(self, part_index: int, threaded: bool) -> Tuple[bytearray, memoryview]:
+        buffer = await self.buffers.acquire()
+        try:
+            if part_index != self._stream_index:
+                # Skip the parts that are not required
+                await call_stream(self.stream.seek, (part_index - self._stream_index) * self.part_size, os.SEEK_CUR,
+                                  threaded=threaded, pending=self._stream_calls)
+            self._stream_index = part_index + 1
+            view = memoryview(buffer)[:self.part_size]
+            read = await readinto_part(self.stream, view, threaded, self._stream_calls)
+        except asyncio.CancelledError:
+            try:
+                # The worker thread may still be writing to the buffer
+                await self._wait_stream_calls()
+            except asyncio.CancelledError:
+                self.buffers.discard(buffer)
+                raise
+            self.buffers.release(buffer)
+            raise
+        except BaseException:
+            self.buffers.release(buffer)
+            raise
+        return buffer, view[:read]
+
+    async def _read_ahead(self):
+        for part_index in self._indexes:
+            try:
+                item = await self._read(part_index, True)
+            except Exception as e:
+                await self._queue.put(e)
+                return
+            try:
+                await self._queue.put(item)
+            except asyncio.CancelledError:
+                self.buffers.release(item[0])
+                raise
+
+    async def _wait_stream_calls(self):
+        """Wait for the reads and seeks of the worker threads, which cannot be cancelled."""
+        if self._stream_calls:
+            await asyncio.wait(set(self._stream_calls))
+
+    def release(self, buffer: bytearray) -> None:
+        """Return the buffer of a part to the pool once it has been uploaded."""
+        self.buffers.release(buffer)
+
+    async def next(self) -> Tuple[bytearray, memoryview]:
+        """Next part of the stream. The buffer must be released using the release method.
+
+        :return: Buffer from the pool and view of the part in it.
+        """
+        if not self.depth:
+            return await self._read(next(self._indexes), False)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._read_ahead())
+        item = await self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def close(self):
+        """Stop reading ahead and return to the pool the parts read but not used. The position of
+        the stream is not changed after the reader is closed: the reads of the worker threads are
+        waited for.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self._wait_stream_calls()
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not isinstance(item, Exception):
+                self.buffers.release(item[0])
+
+    async def __aenter__(self) -> 'PartReader':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class MappedPartReader:
+    """Serve the parts of a memory-mapped file as slices of the mapping, without buffers. The
+    kernel is asked to read ahead the next parts of the file while the previous parts are sent.
+    """
+    def __init__(self, file, part_size: int, part_indexes: Sequence[int], depth: int = READ_AHEAD_PARTS):
+        self.file = file
+        self.part_size = part_size
+        self.part_indexes = part_indexes
+        self.depth = depth
+        self.view: Optional[memoryview] = None
+        self.start = 0
+        self._indexes = iter(part_indexes)
+
+    def _will_need(self, start: int, length: int) -> None:
+        mapping = self.view.obj
+        if not hasattr(mapping, 'madvise') or not length:
+            return
+        # The view starts at the same offset of the file in the mapping
+        start += len(mapping) - len(self.view)
+        if start >= len(mapping):
+            return
+        aligned = start - start % mmap.PAGESIZE
+        mapping.madvise(mmap.MADV_WILLNEED, aligned, min(len(mapping) - aligned, length + start - aligned))
+
+    def release(self, buffer: None) -> None:
+        """The parts do not use buffers from a pool."""
+
+    async def next(self) -> Tuple[None, memoryview]:
+        """Next part of the file. The file position is moved after the part.
+
+        :return: None (there is no buffer) and the view of the part in the mapping.
+        """
+        if self.view is None:
+            self.start = self.file.tell()
+            self.view = self.file.get_mapped_view()
+        position = next(self._indexes) * self.part_size
+        part = self.view[position:position + self.part_size]
+        self._will_need(position + self.part_size, self.part_size * self.depth)
+        self.file.seek(self.start + position + len(part))
+        return None, part
+
+    async def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+
+    async def __aenter__(self) -> 'MappedPartReader':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,144 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+from telegram_upload.config import CACHE_DIRECTORY
+from telegram_upload.exceptions import TelegramPartSizeError
+
+
+# Part sizes in KiB allowed by Telegram. The part sizes must be a power of 2. Telegram allows download
+# parts of 1 MiB, but Telethon splits the download requests in requests of up to 512 KiB.
+MAX_UPLOAD_PART_SIZE = 512
+MIN_DOWNLOAD_PART_SIZE = 4
+MAX_DOWNLOAD_PART_SIZE = 512
+# Maximum number of parts of an upload. The premium accounts can upload files of 8000 parts of 512 KiB.
+MAX_UPLOAD_PARTS = 4000
+# Part size of the downloads of unknown size
+UNKNOWN_SIZE_PART_SIZE = 64
+# The same tiers as Telethon: 128 KiB up to 100 MiB, 256 KiB up to 750 MiB and 512 KiB for larger files
+DEFAULT_TIERS = [(100 * 1024 * 1024, 128), (750 * 1024 * 1024, 256), (None, 512)]
+PART_SIZE_BENCHMARK_FILE = os.path.join(CACHE_DIRECTORY, 'part_size_benchmark.json')
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SIZE_PATTERN = re.compile(r'^(\d+)\s*([KMG]?)(?:i?B)?$', re.IGNORECASE)
+
+Tier = Tuple[Optional[int], int]
+
+
+def parse_size(value: str) -> int:
+    """Bytes of a size like 512, 100K, 100M or 2GiB."""
+    match = SIZE_PATTERN.match(value.strip())
+    if not match:
+        raise TelegramPartSizeError('Invalid size: {}'.format(value))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def check_part_size(part_size: int, maximum: int = MAX_UPLOAD_PART_SIZE) -> int:
+    """Check that the part size in KiB is a power of 2 up to maximum."""
+    if part_size < 1 or part_size > maximum or part_size & (part_size - 1):
+        raise TelegramPartSizeError('The part size must be a power of 2 up to {} KiB, not {}'.format(
+            maximum, part_size))
+    return part_size
+
+
+class PartSizePolicy:
+    """Size of the parts of the uploads and the downloads by file size. The part size is limited to
+    the sizes allowed by Telegram: up to 512 KiB for the uploads and from 4 KiB to 512 KiB for the
+    downloads. The upload part size is increased if the file would have more than MAX_UPLOAD_PARTS
+    parts.
+    """
+    def get_part_size(self, file_size: Optional[int]) -> int:
+        """Part size in KiB for a file of file_size bytes. The file size is None if it is unknown."""
+        raise NotImplementedError
+
+    def get_upload_part_size(self, file_size: int) -> int:
+        part_size = min(self.get_part_size(file_size), MAX_UPLOAD_PART_SIZE)
+        while part_size < MAX_UPLOAD_PART_SIZE and file_size > part_size * 1024 * MAX_UPLOAD_PARTS:
+            part_size *= 2
+        return part_size
+
+    def get_download_part_size(self, file_size: Optional[int]) -> int:
+        return max(MIN_DOWNLOAD_PART_SIZE, min(self.get_part_size(file_size), MAX_DOWNLOAD_PART_SIZE))
+
+
+class FixedPartSize(PartSizePolicy):
+    """The same part size for all the files."""
+    def __init__(self, part_size: int):
+        self.part_size = check_part_size(part_size)
+
+    def get_part_size(self, file_size: Optional[int]) -> int:
+        return self.part_size
+
+
+class TieredPartSize(PartSizePolicy):
+    """Part size by file size. The tiers are (maximum file size in bytes, part size in KiB) in ascending
+    order. The maximum of the last tier is None.
+    """
+    def __init__(self, tiers: List[Tier], unknown_size: int = UNKNOWN_SIZE_PART_SIZE):
+        if not tiers:
+            raise TelegramPartSizeError('At least one part size tier is required')
+        self.tiers = [(maximum, check_part_size(part_size)) for maximum, part_size in tiers]
+        self.unknown_size = unknown_size
+
+    def get_part_size(self, file_size: Optional[int]) -> int:
+        if file_size is None:
+            return self.unknown_size
+        for maximum, part_size in self.tiers:
+            if maximum is None or file_size <= maximum:
+                return part_size
+        return self.tiers[-1][1]
+
+    @classmethod
+    def from_benchmark(cls, results: List[dict]) -> 'TieredPartSize':
+        """Tiers with the part size of the lowest median time for each file size of the part size
+        benchmark. The files use the results of the smallest benchmarked size greater than or equal to
+        their size.
+
+        :param results: Results of the upload_benchmark.py part-sizes command.
+        """
+        times: Dict[int, Dict[int, float]] = {}
+        for result in results:
+            if result.get('part_size'):
+                times.setdefault(result['size'], {})[result['part_size']] = result['benchmark']['median']
+        tiers: List[Tier] = [(size, min(medians, key=medians.get)) for size, medians in sorted(times.items())]
+        if not tiers:
+            raise TelegramPartSizeError('There are no part size results in the benchmark')
+        tiers[-1] = (None, tiers[-1][1])
+        return cls(tiers)
+
+
+DEFAULT_PART_SIZE_POLICY = TieredPartSize(DEFAULT_TIERS)
+
+
+def get_part_size_policy(value: Union[str, int, None]) -> PartSizePolicy:
+    """Policy of a part size option or of the part_size key of the config file:
+
+    * ``auto``: the default tiers.
+    * A part size in KiB. For example ``512``.
+    * ``tiered:`` and the tiers separated by commas. For example ``tiered:20M=128,200M=256,512``.
+    * ``benchmark``: the best part sizes of the part size benchmark. The results file is
+      PART_SIZE_BENCHMARK_FILE or the file after the colon. For example ``benchmark:results.json``.
+    """
+    value = str(value or 'auto').strip()
+    name, _, argument = value.partition(':')
+    if name == 'auto':
+        return DEFAULT_PART_SIZE_POLICY
+    if name.isdigit():
+        return FixedPartSize(int(name))
+    if name == 'tiered':
+        tiers = []
+        for tier in argument.split(','):
+            maximum, _, part_size = tier.rpartition('=')
+            if not part_size.strip().isdigit():
+                raise TelegramPartSizeError('Invalid part size tier: {}'.format(tier))
+            tiers.append((parse_size(maximum) if maximum else None, int(part_size)))
+        tiers.sort(key=lambda tier: float('inf') if tier[0] is None else tier[0])
+        return TieredPartSize(tiers)
+    if name == 'benchmark':
+        path = os.path.expanduser(argument or PART_SIZE_BENCHMARK_FILE)
+        try:
+            with open(path) as file:
+                return TieredPartSize.from_benchmark(json.load(file))
+        except (OSError, ValueError) as e:
+            raise TelegramPartSizeError('The part size benchmark "{}" cannot be read: {}'.format(path, e))
+    raise TelegramPartSizeError('Invalid part size policy: {}'.format(value))
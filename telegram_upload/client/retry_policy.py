@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import random
+from typing import Dict, Optional
+
+from telethon.errors import RPCError, FloodWaitError, InvalidBufferError, UnauthorizedError, ForbiddenError
+
+from telegram_upload.utils import get_environment_integer
+
+
+TRANSPORT_ERROR = 'transport'
+TOO_MANY_REQUESTS = 'too_many_requests'
+FLOOD_WAIT = 'flood_wait'
+RPC_ERROR = 'rpc'
+
+MAX_RECONNECT_RETRIES = get_environment_integer('TELEGRAM_UPLOAD_MAX_RECONNECT_RETRIES', 5)
+MIN_RECONNECT_WAIT = get_environment_integer('TELEGRAM_UPLOAD_MIN_RECONNECT_WAIT', 2)
+MAX_TOO_MANY_REQUESTS_RETRIES = get_environment_integer('TELEGRAM_UPLOAD_MAX_TOO_MANY_REQUESTS_RETRIES', 10)
+MAX_RPC_RETRIES = get_environment_integer('TELEGRAM_UPLOAD_MAX_RPC_RETRIES', 3)
+MAX_RETRY_WAIT = get_environment_integer('TELEGRAM_UPLOAD_MAX_RETRY_WAIT', 60)
+UPLOAD_RETRY_BUDGET = get_environment_integer('TELEGRAM_UPLOAD_RETRY_BUDGET', 100)
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter. The wait of each attempt is a random value between the half
+    and the whole of base_wait × factor ^ attempt, limited to max_wait, so the parts that failed at
+    the same time are not retried at the same time.
+    """
+    def __init__(self, attempts: int, base_wait: float, max_wait: float = MAX_RETRY_WAIT, factor: float = 2.0):
+        self.attempts = attempts
+        self.base_wait = base_wait
+        self.max_wait = max_wait
+        self.factor = factor
+
+    def can_retry(self, attempt: int) -> bool:
+        """
+        :param attempt: Number of retries already made, starting at 0.
+        """
+        return attempt < self.attempts
+
+    def get_wait(self, attempt: int) -> float:
+        """Seconds to wait before the retry.
+
+        :param attempt: Number of retries already made, starting at 0.
+        """
+        wait = min(self.max_wait, self.base_wait * self.factor ** attempt)
+        return random.uniform(wait / 2, wait)
+
+
+RETRY_POLICIES = {
+    # Connection lost. Reconnect after the wait.
+    TRANSPORT_ERROR: RetryPolicy(MAX_RECONNECT_RETRIES, MIN_RECONNECT_WAIT),
+    # Telegram servers are overloaded. They are retried more times, with shorter waits.
+    TOO_MANY_REQUESTS: RetryPolicy(MAX_TOO_MANY_REQUESTS_RETRIES, 1),
+    # The wait is set by Telegram. The jitter is added to it.
+    FLOOD_WAIT: RetryPolicy(MAX_RECONNECT_RETRIES, 1),
+    RPC_ERROR: RetryPolicy(MAX_RPC_RETRIES, MIN_RECONNECT_WAIT),
+}
+
+
+def get_error_kind(error: BaseException) -> Optional[str]:
+    """Retry policy of an error. None if the error must not be retried."""
+    if isinstance(error, InvalidBufferError):
+        return TOO_MANY_REQUESTS if error.code == 429 else None
+    if isinstance(error, FloodWaitError):
+        return FLOOD_WAIT
+    if isinstance(error, (UnauthorizedError, ForbiddenError)):
+        return None
+    if isinstance(error, RPCError):
+        return RPC_ERROR
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return TRANSPORT_ERROR
+    return None
+
+
+class UploadRetries:
+    """Retry accounting of an upload. Each part is retried according to the policy of the error,
+    and all the parts of the upload share a retry budget, so a broken upload fails instead of
+    retrying every part. The failures by error kind are available for the caller after the upload.
+    """
+    def __init__(self, budget: int = UPLOAD_RETRY_BUDGET, policies: Optional[Dict[str, RetryPolicy]] = None):
+        self.budget = budget
+        self.policies = policies or RETRY_POLICIES
+        self.failures = collections.Counter()
+        self.retries = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.retries >= self.budget
+
+    def get_retry_wait(self, error: BaseException, attempts: collections.Counter) -> Optional[float]:
+        """Register the failure of a request and get the seconds to wait before retrying it.
+
+        :param error: Error raised by the request.
+        :param attempts: Retries already made for the request by error kind. It is updated.
+        :return: Seconds to wait. None if the request must not be retried.
+        """
+        kind = get_error_kind(error)
+        if kind is None:
+            return None
+        self.failures[kind] += 1
+        attempt = attempts[kind]
+        if not self.policies[kind].can_retry(attempt) or self.exhausted:
+            return None
+        attempts[kind] += 1
+        self.retries += 1
+        wait = self.policies[kind].get_wait(attempt)
+        if kind == FLOOD_WAIT:
+            wait += error.seconds
+        return wait
@@ -8,14 +8,16 @@ from typing import Iterable
 import typing
 
 from more_itertools import grouper
-from telethon import TelegramClient, utils, helpers
+from telethon import TelegramClient, helpers
 from telethon.client.downloads import MIN_CHUNK_SIZE
 from telethon.crypto import AES
 
+from telegram_upload.client.message_batch import MessageBatch
+from telegram_upload.client.part_size import DEFAULT_PART_SIZE_POLICY, PartSizePolicy
 from telegram_upload.client.progress_bar import get_progress_bar
 from telegram_upload.download_files import DownloadFile
 from telegram_upload.exceptions import TelegramUploadNoSpaceError
-from telegram_upload.utils import free_disk_usage, sizeof_fmt, get_environment_integer
+from telegram_upload.utils import free_disk_usage, sizeof_fmt, get_environment_integer, async_to_sync
 
 
 if sys.version_info < (3, 10):
@@ -26,6 +28,8 @@ PARALLEL_DOWNLOAD_BLOCKS = get_environment_integer('TELEGRAM_UPLOAD_PARALLEL_DOW
 
 
 class TelegramDownloadClient(TelegramClient):
+    part_size_policy: PartSizePolicy = DEFAULT_PART_SIZE_POLICY
+
     def find_files(self, entity):
         for message in self.iter_messages(entity):
             if message.document:
@@ -39,24 +43,29 @@ class TelegramDownloadClient(TelegramClient):
                 yield message
 
     def download_files(self, entity, download_files: Iterable[DownloadFile], delete_on_success: bool = False):
-        for download_file in download_files:
-            if download_file.size > free_disk_usage():
-                raise TelegramUploadNoSpaceError(
-                    'There is no disk space to download "{}". Space required: {}'.format(
-                        download_file.file_name, sizeof_fmt(download_file.size - free_disk_usage())
+        # The downloaded messages are deleted with one request for up to 100 messages
+        delete_batch = MessageBatch(lambda messages: self.delete_messages(entity, messages))
+        try:
+            for download_file in download_files:
+                if download_file.size > free_disk_usage():
+                    raise TelegramUploadNoSpaceError(
+                        'There is no disk space to download "{}". Space required: {}'.format(
+                            download_file.file_name, sizeof_fmt(download_file.size - free_disk_usage())
+                        )
                     )
-                )
-            progress, bar = get_progress_bar('Downloading', download_file.file_name, download_file.size)
-            file_name = download_file.file_name
-            try:
-                file_name = self.download_media(download_file.message, progress_callback=progress)
-                download_file.set_download_file_name(file_name)
-            finally:
-                bar.label = f'Downloaded  "{file_name}"'
-                bar.update(1, 1)
-                bar.render_finish()
-            if delete_on_success:
-                self.delete_messages(entity, [download_file.message])
+                progress, bar = get_progress_bar('Downloading', download_file.file_name, download_file.size)
+                file_name = download_file.file_name
+                try:
+                    file_name = self.download_media(download_file.message, progress_callback=progress)
+                    download_file.set_download_file_name(file_name)
+                finally:
+                    bar.label = f'Downloaded  "{file_name}"'
+                    bar.update(1, 1)
+                    bar.render_finish()
+                if delete_on_success:
+                    async_to_sync(delete_batch.add(download_file.message))
+        finally:
+            async_to_sync(delete_batch.flush())
 
     async def _download_file(
             self: 'TelegramClient',
@@ -71,10 +80,7 @@ class TelegramDownloadClient(TelegramClient):
             iv: bytes = None,
             msg_data: tuple = None) -> typing.Optional[bytes]:
         if not part_size_kb:
-            if not file_size:
-                part_size_kb = 64  # Reasonable default
-            else:
-                part_size_kb = utils.get_appropriated_part_size(file_size)
+            part_size_kb = self.part_size_policy.get_download_part_size(file_size or None)
 
         part_size = int(part_size_kb * 1024)
         if part_size % MIN_CHUNK_SIZE != 0:
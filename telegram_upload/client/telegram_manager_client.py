@@ -1,3 +1,4 @@
+import asyncio
 import getpass
 import json
 import os
@@ -13,6 +14,7 @@ from telethon.network import ConnectionTcpMTProxyRandomizedIntermediate
 from telethon.tl.types import DocumentAttributeFilename, User, InputPeerUser
 from telethon.version import __version__ as telethon_version
 
+from telegram_upload.client.part_size import get_part_size_policy
 from telegram_upload.client.telegram_download_client import TelegramDownloadClient
 from telegram_upload.client.telegram_upload_client import TelegramUploadClient
 from telegram_upload.config import SESSION_FILE
@@ -87,6 +89,8 @@ class TelegramManagerClient(TelegramUploadClient, TelegramDownloadClient):
         with open(config_file) as f:
             config = json.load(f)
         self.config_file = config_file
+        if config.get('part_size'):
+            self.part_size_policy = get_part_size_policy(config['part_size'])
         proxy = proxy if proxy is not None else get_proxy_environment_variable()
         proxy = parse_proxy_string(proxy)
         if proxy and proxy[0] == 'mtproxy':
@@ -112,6 +116,11 @@ class TelegramManagerClient(TelegramUploadClient, TelegramDownloadClient):
     def me(self) -> Union[User, InputPeerUser]:
         return self.get_me()
 
+    def load_account_limits(self) -> None:
+        if not asyncio.get_event_loop().is_running():
+            # get_me is synchronous out of the event loop only. The account is cached for the next calls.
+            self.me  # noqa
+
     @property
     def max_file_size(self):
         if hasattr(self.me, 'premium') and self.me.premium:
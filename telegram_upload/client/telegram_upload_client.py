@@ -1,40 +1,138 @@
 import asyncio
+import collections
+import functools
 import hashlib
 import os
+import re
 import time
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Set, Dict, Tuple, List, Iterator
 
 import click
 from telethon import TelegramClient, utils, helpers, custom
 from telethon.crypto import AES
-from telethon.errors import RPCError, FloodWaitError, InvalidBufferError
+from telethon.errors import RPCError, FloodWaitError, InvalidBufferError, FilePartsInvalidError, \
+    FilePartMissingError, FilePart0MissingError, FileReferenceExpiredError, FileReferenceInvalidError, \
+    FileReferenceEmptyError, MediaEmptyError
 from telethon.tl import types, functions, TLRequest
 from telethon.utils import pack_bot_file_id
 
+from telegram_upload.client.adaptive_semaphore import AdaptiveSemaphore
+from telegram_upload.client.flood_limiter import FLOOD_LIMITER
+from telegram_upload.client.message_batch import MessageBatch
+from telegram_upload.client.part_buffers import PartBufferPool, BufferSaveBigFilePartRequest, \
+    BufferSaveFilePartRequest, PartReader, MappedPartReader, READ_AHEAD_PARTS
+from telegram_upload.client.part_size import DEFAULT_PART_SIZE_POLICY, PartSizePolicy
 from telegram_upload.client.progress_bar import get_progress_bar
-from telegram_upload.exceptions import TelegramUploadDataLoss, MissingFileError
-from telegram_upload.upload_files import File
-from telegram_upload.utils import grouper, async_to_sync, get_environment_integer
+from telegram_upload.client.retry_policy import UploadRetries, get_error_kind, TRANSPORT_ERROR, \
+    TOO_MANY_REQUESTS, FLOOD_WAIT
+from telegram_upload.client.upload_senders import UploadSenderPool, UPLOAD_CONNECTIONS
+from telegram_upload.exceptions import TelegramUploadDataLoss, MissingFileError, TelegramUploadPartError, \
+    TelegramInvalidFile
+from telegram_upload.file_ids import UploadedFile, write_manifest
+from telegram_upload.upload_cache import UploadCache, get_content_hash
+from telegram_upload.upload_journal import UploadJournal, RESUME_UPLOADS
+from telegram_upload.upload_files import File, group_split_files, prepare_files, PREPARE_AHEAD_FILES
+from telegram_upload.utils import grouper, async_to_sync, get_environment_integer, size_grouper, \
+    iterate_in_executor
 
 PARALLEL_UPLOAD_BLOCKS = get_environment_integer('TELEGRAM_UPLOAD_PARALLEL_UPLOAD_BLOCKS', 4)
+MAX_PARALLEL_UPLOAD_BLOCKS = get_environment_integer('TELEGRAM_UPLOAD_MAX_PARALLEL_UPLOAD_BLOCKS', 10)
 ALBUM_FILES = 10
+# Larger documents are not grouped by --group-documents
+GROUP_DOCUMENTS_MAX_SIZE = get_environment_integer('TELEGRAM_UPLOAD_GROUP_DOCUMENTS_MAX_SIZE', 10 * 1024 * 1024)
+# Hashes in the captions of the documents, by length of the hex digest
+CAPTION_HASH_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+CAPTION_HASH_PATTERN = re.compile(r'\b([0-9a-fA-F]{64}|[0-9a-fA-F]{40}|[0-9a-fA-F]{32})\b')
 RETRIES = 3
-MAX_RECONNECT_RETRIES = get_environment_integer('TELEGRAM_UPLOAD_MAX_RECONNECT_RETRIES', 5)
 RECONNECT_TIMEOUT = get_environment_integer('TELEGRAM_UPLOAD_RECONNECT_TIMEOUT', 5)
-MIN_RECONNECT_WAIT = get_environment_integer('TELEGRAM_UPLOAD_MIN_RECONNECT_WAIT', 2)
+MAX_FLOOD_WAIT_RETRIES = get_environment_integer('TELEGRAM_UPLOAD_MAX_FLOOD_WAIT_RETRIES', 5)
+# Parts of a split file uploaded at the same time
+SPLIT_FILE_CONCURRENT_PARTS = get_environment_integer('TELEGRAM_UPLOAD_SPLIT_FILE_CONCURRENT_PARTS', 3)
+# The uploaded file cannot be used anymore. It must be uploaded again.
+UPLOAD_EXPIRED_ERRORS = (FilePartsInvalidError, FilePartMissingError, FilePart0MissingError)
+# The document of the upload cache cannot be sent anymore. The file must be uploaded.
+CACHED_DOCUMENT_ERRORS = (FileReferenceExpiredError, FileReferenceInvalidError, FileReferenceEmptyError,
+                          MediaEmptyError)
+# Requests retried by _send_file_part using its own retry policy
+FILE_PART_REQUESTS = (functions.upload.SaveFilePartRequest, functions.upload.SaveBigFilePartRequest)
 
 
 class TelegramUploadClient(TelegramClient):
     parallel_upload_blocks = PARALLEL_UPLOAD_BLOCKS
+    max_parallel_upload_blocks = MAX_PARALLEL_UPLOAD_BLOCKS
+    upload_connections = UPLOAD_CONNECTIONS
+    read_ahead_parts = READ_AHEAD_PARTS
+    resume_uploads = RESUME_UPLOADS
+    split_file_concurrent_parts = SPLIT_FILE_CONCURRENT_PARTS
+    prepare_ahead_files = PREPARE_AHEAD_FILES
+    part_size_policy: PartSizePolicy = DEFAULT_PART_SIZE_POLICY
+    flood_limiter = FLOOD_LIMITER
+    upload_cache: Optional[UploadCache] = None
+    # Manifest where the file ids of the files sent are saved
+    file_ids_manifest: Optional[str] = None
 
     def __init__(self, *args, **kwargs):
         self.reconnecting_lock = asyncio.Lock()
-        self.upload_semaphore = asyncio.Semaphore(self.parallel_upload_blocks)
+        self.upload_semaphore = AdaptiveSemaphore(self.parallel_upload_blocks * self.upload_connections,
+                                                  maximum=self.max_parallel_upload_blocks * self.upload_connections)
+        self.upload_senders = UploadSenderPool(self, self.upload_connections)
+        # One buffer for each part in flight, the parts read ahead and one more for the part being read
+        self.upload_buffers = PartBufferPool(self.upload_semaphore.maximum + self.read_ahead_parts + 1)
         super().__init__(*args, **kwargs)
+        # The flood waits are not slept by Telethon. They are shared using the flood limiter. See _call.
+        self.flood_sleep_threshold = 0
 
-    def forward_to(self, message, destinations):
-        for destination in destinations:
-            self.forward_messages(destination, [message])
+    @property
+    def upload_window(self) -> int:
+        """Maximum number of parts in flight for one upload. It follows the adaptive limit of the
+        upload semaphore.
+        """
+        return self.upload_semaphore.value
+
+    def load_account_limits(self) -> None:
+        """
+        Get the limits of the account used by the files (the maximum file size and caption length) before
+        the files are iterated in worker threads or in the event loop, where the account cannot be requested
+        synchronously. The limits are defined by the subclasses.
+        """
+
+    def get_chat_files_index(self, entity) -> Dict[Tuple[str, int], List[str]]:
+        """
+        Index of the documents of a chat by file name and size, with the captions of their messages. The
+        chat is scanned once, in pages of document messages. It must be called out of the event loop.
+        """
+        index = collections.defaultdict(list)
+        for message in self.iter_messages(entity, filter=types.InputMessagesFilterDocument):
+            if message.document:
+                index[(message.file.name, message.file.size)].append(message.message or '')
+        return index
+
+    def filter_existing_files(self, entity, files: Iterable[File]) -> Iterator[File]:
+        """
+        Skip the files already sent to the chat: there is a document with the same file name and size. If
+        the caption of the document has an MD5, SHA-1 or SHA-256 hex digest, the file must have the same hash.
+        The chat is scanned now, so the files returned can be iterated in the event loop (for example, by
+        the concurrent uploads and the albums).
+        """
+        return self._filter_existing_files(self.get_chat_files_index(entity), files)
+
+    def _filter_existing_files(self, index: Dict[Tuple[str, int], List[str]],
+                               files: Iterable[File]) -> Iterator[File]:
+        for file in files:
+            captions = index.get((file.file_name, file.file_size), [])
+            if any(self._match_caption_hash(file, caption) for caption in captions):
+                click.echo('Skipping "{}" (already in the chat)'.format(file.file_name))
+                continue
+            yield file
+
+    @staticmethod
+    def _match_caption_hash(file: File, caption: str) -> bool:
+        """The file has the hashes of the caption. True if the caption has no hashes."""
+        for digest in CAPTION_HASH_PATTERN.findall(caption):
+            algorithm = CAPTION_HASH_ALGORITHMS[len(digest)]
+            if get_content_hash(file.path, *file.get_pending_range(), algorithm=algorithm) != digest.lower():
+                return False
+        return True
 
     async def _send_album_media(self, entity, media):
         entity = await self.get_input_entity(entity)
@@ -47,27 +145,138 @@ class TelegramUploadClient(TelegramClient):
         return self._get_response_message(random_ids, result, entity)
 
     def send_files_as_album(self, entity, files, delete_on_success=False, print_file_id=False,
-                            forward=()):
-        for files_group in grouper(ALBUM_FILES, files):
-            media = self.send_files(entity, files_group, delete_on_success, print_file_id, forward, send_as_media=True)
-            async_to_sync(self._send_album_media(entity, media))
+                            forward=(), destinations=(), force_document: bool = False):
+        self.load_account_limits()
+        return async_to_sync(self._send_albums(entity, files, delete_on_success, print_file_id, forward,
+                                               destinations, force_document))
+
+    async def _send_albums(self, entity, files: Iterable[File], delete_on_success=False, print_file_id=False,
+                           forward=(), destinations=(), force_document: bool = False) -> list:
+        """
+        Send the files in albums of up to ALBUM_FILES files. The files of an album are uploaded at the
+        same time, and the upload of the files of the next album starts while the album is sent.
+
+        :param force_document: Send the files as documents, with their captions and attributes. The
+            documents larger than GROUP_DOCUMENTS_MAX_SIZE are sent alone.
+        :return: Messages sent to the chat.
+        """
+        if force_document:
+            groups = size_grouper(ALBUM_FILES, files, GROUP_DOCUMENTS_MAX_SIZE)
+        else:
+            groups = grouper(ALBUM_FILES, files)
+        sent_messages = []
+
+        def start_uploads(files_group):
+            if files_group is None:
+                return None
+            return files_group, [self.loop.create_task(self._upload_album_media(entity, file, force_document))
+                                 for file in files_group]
+
+        # The next groups are obtained in a worker thread. The files may be read to list or to skip them.
+        current = start_uploads(await self.loop.run_in_executor(None, next, groups, None))
+        try:
+            while current is not None:
+                files_group, uploads = current
+                media = await asyncio.gather(*uploads)
+                current = start_uploads(await self.loop.run_in_executor(None, next, groups, None))
+                for file, file_media in zip(files_group, media):
+                    self._process_sent_file(file, file_media, delete_on_success, print_file_id)
+                media = [file_media for file_media in media if file_media is not None]
+                if not media:
+                    continue
+                if destinations:
+                    messages = (await self._send_album_to_chats([entity, *destinations], media))[0]
+                else:
+                    messages = await self._send_album_media(entity, media)
+                messages = [message for message in messages or [] if message]
+                if forward and messages:
+                    # All the messages of the album are forwarded with one request for each chat
+                    await self._forward_to_destinations(messages, forward)
+                sent_messages.extend(messages)
+        finally:
+            if current is not None:
+                for upload_task in current[1]:
+                    upload_task.cancel()
+        return sent_messages
+
+    async def _upload_album_media(self, entity, file: File, force_document: bool = False,
+                                  retries=RETRIES) -> Optional[types.InputSingleMedia]:
+        """
+        Upload a file of an album and its media, without sending the message. The uploaded handle is
+        reused if the media has to be uploaded again.
+
+        :return: Media of the file. None if the file could not be uploaded.
+        """
+        position = file.tell()
+        thumb = None
+        if force_document:
+            # Only the documents are uploaded with a thumbnail, attributes and caption, as in the messages of a file
+            await self.loop.run_in_executor(None, file.prepare)
+            thumb = file.get_thumbnail()
+        try:
+            while True:
+                try:
+                    media = await self._send_media(entity, file, None, thumb=thumb, force_document=force_document)
+                except (TelegramUploadPartError, FloodWaitError) as e:
+                    click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. It will not be retried.',
+                               err=True)
+                    return None
+                except RPCError as e:
+                    if isinstance(e, UPLOAD_EXPIRED_ERRORS):
+                        file.set_upload_handle(None)
+                    if not retries:
+                        click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. '
+                                   f'It will not be retried.', err=True)
+                        return None
+                    click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. Retrying...', err=True)
+                    retries -= 1
+                    if file.get_upload_handle() is None:
+                        file.seek(position)
+                else:
+                    click.echo('Uploaded "{}"'.format(file.file_name))
+                    return media
+        finally:
+            file.remove_thumbnail(thumb)
+
+    async def _send_album_to_chats(self, entities: list, media: List[types.InputSingleMedia]) -> list:
+        """
+        Send the media of an album, uploaded once, to all the chats at the same time. Each chat receives
+        a copy of the media with new random ids.
+        """
+        return await asyncio.gather(*(
+            self._send_album_media(entity, [types.InputSingleMedia(m.media, message=m.message, entities=m.entities)
+                                            for m in media])
+            for entity in entities
+        ))
 
     def _send_file_message(self, entity, file, thumb, progress):
         message = self.send_file(entity, file, thumb=thumb,
                                  file_size=file.file_size if isinstance(file, File) else None,
                                  caption=file.file_caption, force_document=file.force_file,
                                  progress_callback=progress, attributes=file.file_attributes)
+        self._check_remote_size(file, message)
+        return message
+
+    @staticmethod
+    def _check_remote_size(file: File, message):
         if hasattr(message.media, 'document') and file.file_size != message.media.document.size:
+            # The uploaded file is wrong. Do not reuse it.
+            file.set_upload_handle(None)
             raise TelegramUploadDataLoss(
                 'Remote document size: {} bytes (local file size: {} bytes)'.format(
                     message.media.document.size, file.file_size))
-        return message
 
-    async def _send_media(self, entity, file: File, progress):
+    async def _send_media(self, entity, file: File, progress, thumb: Optional[str] = None,
+                          force_document: bool = False):
         entity = await self.get_input_entity(entity)
         supports_streaming = False  # TODO
-        fh, fm, _ = await self._file_to_media(
-            file, supports_streaming=file, progress_callback=progress)
+        if force_document:
+            fh, fm, _ = await self._file_to_media(
+                file, force_document=True, progress_callback=progress, attributes=file.file_attributes,
+                thumb=thumb)
+        else:
+            fh, fm, _ = await self._file_to_media(
+                file, supports_streaming=file, progress_callback=progress)
         if isinstance(fm, types.InputMediaUploadedPhoto):
             r = await self(functions.messages.UploadMediaRequest(
                 entity, media=fm
@@ -84,7 +293,7 @@ class TelegramUploadClient(TelegramClient):
 
         return types.InputSingleMedia(
             fm,
-            message=file.short_name,
+            message=file.file_caption if force_document else file.short_name,
             entities=None,
             # random_id is autogenerated
         )
@@ -92,6 +301,7 @@ class TelegramUploadClient(TelegramClient):
     def send_one_file(self, entity, file: File, send_as_media: bool = False, thumb: Optional[str] = None,
                       retries=RETRIES):
         message = None
+        position = file.tell()
         progress, bar = get_progress_bar('Uploading', file.file_name, file.file_size)
 
         try:
@@ -103,45 +313,329 @@ class TelegramUploadClient(TelegramClient):
                     message = self._send_file_message(entity, file, thumb, progress)
             finally:
                 bar.render_finish()
+        except TelegramUploadPartError as e:
+            # The parts have already been retried. Uploading the whole file again would not help.
+            click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. It will not be retried.', err=True)
         except FloodWaitError as e:
-            click.echo(f'{e}. Waiting for {e.seconds} seconds.', err=True)
-            time.sleep(e.seconds)
-            message = self.send_one_file(entity, file, send_as_media, thumb, retries)
+            # The request has already been sent again after the flood waits. See _call.
+            click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. It will not be retried.', err=True)
         except RPCError as e:
+            if isinstance(e, UPLOAD_EXPIRED_ERRORS):
+                file.set_upload_handle(None)
             if retries > 0:
                 click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. Retrying...', err=True)
+                if file.get_upload_handle() is None:
+                    # Upload the file again from the beginning. Otherwise, only the message is sent again.
+                    file.seek(position)
                 message = self.send_one_file(entity, file, send_as_media, thumb, retries - 1)
             else:
                 click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. It will not be retried.', err=True)
         return message
 
     def send_files(self, entity, files: Iterable[File], delete_on_success=False, print_file_id=False,
-                   forward=(), send_as_media: bool = False):
+                   forward=(), send_as_media: bool = False, concurrent_files: int = 1, destinations=()):
+        self.load_account_limits()
+        if concurrent_files > 1 and not send_as_media:
+            return async_to_sync(self._send_files_concurrently(
+                entity, files, concurrent_files, delete_on_success, print_file_id, forward, destinations
+            ))
         has_files = False
         messages = []
-        for file in files:
-            has_files = True
-            thumb = file.get_thumbnail()
+        forward_batch = MessageBatch(functools.partial(self._forward_to_destinations, destinations=forward))
+        try:
+            for files_group in group_split_files(prepare_files(files, self.prepare_ahead_files)):
+                has_files = True
+                if len(files_group) > 1 and self.split_file_concurrent_parts > 1 and not send_as_media:
+                    # The parts of a split file are uploaded at the same time. The messages are sent in order.
+                    async_to_sync(forward_batch.flush())
+                    parts_messages = async_to_sync(self._send_files_concurrently(
+                        entity, files_group, self.split_file_concurrent_parts, False, print_file_id, forward,
+                        destinations
+                    ))
+                    messages.extend(parts_messages)
+                    if delete_on_success and len(parts_messages) == len(files_group):
+                        # The file is deleted once all its parts have been sent
+                        click.echo('Deleting "{}"'.format(files_group[0].path))
+                        os.remove(files_group[0].path)
+                    continue
+                for file in files_group:
+                    message = None
+                    try:
+                        if self.upload_cache is not None and not send_as_media:
+                            message = self._send_cached_document(entity, file)
+                        if message is None:
+                            thumb = file.get_thumbnail()
+                            try:
+                                message = self.send_one_file(entity, file, send_as_media, thumb=thumb)
+                            finally:
+                                file.remove_thumbnail(thumb)
+                    finally:
+                        # The thumbnail prepared is not used if the document was already uploaded
+                        file.clear_prepared()
+                    self._process_sent_file(file, message, delete_on_success, print_file_id)
+                    if message and not send_as_media:
+                        # The media of the albums is sent (and forwarded) by send_files_as_album
+                        self._cache_sent_document(file, message)
+                        self._save_file_id(file, message)
+                        if destinations:
+                            async_to_sync(self._send_to_destinations(destinations, file, message))
+                        if forward:
+                            async_to_sync(forward_batch.add(message))
+                    if message:
+                        messages.append(message)
+        finally:
+            async_to_sync(forward_batch.flush())
+        if not has_files:
+            raise MissingFileError('Files do not exist.')
+        return messages
+
+    def _send_cached_document(self, entity, file: File):
+        """
+        Send the document of a previous upload with the same content as the file, instead of uploading
+        the file. None is returned if there is no document, or if it cannot be sent anymore.
+        """
+        document = self.upload_cache.get_document(file)
+        if document is None:
+            return None
+        try:
+            message = self.send_file(entity, document, caption=file.file_caption)
+        except CACHED_DOCUMENT_ERRORS:
+            self.upload_cache.remove_document(file)
+            return None
+        except RPCError as e:
+            click.echo(f'The file "{file.file_name}" could not be sent using the document already uploaded: {e}. '
+                       f'Uploading it.', err=True)
+            return None
+        click.echo('Sent "{}" (already uploaded)'.format(file.file_name))
+        return message
+
+    def _cache_sent_document(self, file: File, message):
+        """Register the document sent for the file in the upload cache, if it is enabled."""
+        if self.upload_cache is not None and isinstance(getattr(message.media, 'document', None), types.Document):
+            self.upload_cache.add_document(file, message.media.document)
+
+    async def _forward_to_destinations(self, messages: list, destinations: Iterable) -> None:
+        """Forward the messages to the chats at the same time, with one request for each chat."""
+        await asyncio.gather(*(self.forward_messages(destination, messages) for destination in destinations))
+
+    async def _send_to_destinations(self, destinations: Iterable, file: File, message) -> list:
+        """
+        Send the media of a message already sent to other chats at the same time, without uploading the
+        file again. The flood waits of each chat only delay the messages to that chat.
+
+        :param destinations: Other chats to send the file.
+        :param file: File sent in the message. Used for the caption.
+        :param message: Message with the file uploaded.
+        :return: Messages sent.
+        """
+        async def send_to(destination):
+            try:
+                return await self.send_file(destination, message.media, caption=file.file_caption)
+            except RPCError as e:
+                click.echo(f'The file "{file.file_name}" could not be sent to {destination}: {e}', err=True)
+
+        results = await asyncio.gather(*(send_to(destination) for destination in destinations))
+        return [result for result in results if result is not None]
+
+    def _save_file_id(self, file: File, message):
+        """Save the file id of the file sent in the file ids manifest, if it is enabled."""
+        if self.file_ids_manifest is not None and \
+                (hasattr(message.media, 'document') or hasattr(message.media, 'photo')):
+            write_manifest(self.file_ids_manifest, UploadedFile.from_message(file.file_name, message))
+
+    def send_uploaded_files(self, entities: Iterable, uploaded_files: Iterable[UploadedFile]):
+        """
+        Send files already uploaded, by file id, without uploading them again. The files are sent in order
+        to each chat, and the chats are sent at the same time.
+
+        :param entities: Chats to send the files.
+        :param uploaded_files: Files to send.
+        :return: Messages sent.
+        """
+        return async_to_sync(self._send_uploaded_files(list(entities), list(uploaded_files)))
+
+    async def _send_uploaded_files(self, entities: list, uploaded_files: List[UploadedFile]):
+        if not uploaded_files:
+            raise MissingFileError('Files do not exist.')
+        # The invalid file ids are reported before sending the files
+        media = []
+        for uploaded_file in uploaded_files:
+            try:
+                media.append((uploaded_file, uploaded_file.media))
+            except TelegramInvalidFile as e:
+                click.echo(f'The file "{uploaded_file.name}" could not be sent: {e}', err=True)
+
+        async def send_to(entity):
+            messages = []
+            for uploaded_file, uploaded_media in media:
+                try:
+                    message = await self.send_file(entity, uploaded_media, caption=uploaded_file.caption)
+                except RPCError as e:
+                    click.echo(f'The file "{uploaded_file.name}" could not be sent: {e}', err=True)
+                    continue
+                click.echo('Sent "{}"'.format(uploaded_file.name))
+                messages.append(message)
+            return messages
+
+        results = await asyncio.gather(*(send_to(entity) for entity in entities))
+        return [message for messages in results for message in messages]
+
+    @staticmethod
+    def _process_sent_file(file: File, message, delete_on_success=False, print_file_id=False):
+        if message is None:
+            click.echo('Failed to upload file "{}"'.format(file.file_name), err=True)
+        if message and print_file_id:
+            click.echo('Uploaded successfully "{}" (file_id {})'.format(file.file_name,
+                                                                        pack_bot_file_id(message.media)))
+        if message and delete_on_success:
+            click.echo('Deleting "{}"'.format(file))
+            os.remove(file.path)
+
+    async def _send_files_concurrently(self, entity, files: Iterable[File], concurrent_files: int,
+                                       delete_on_success=False, print_file_id=False, forward=(), destinations=()):
+        """
+        Upload up to concurrent_files files at the same time on the event loop. The messages are sent
+        to the chat in the original order of the files: the upload of the next files continues while
+        the message of the first file in the queue is sent.
+        """
+        uploads = collections.deque()
+        messages = []
+        has_files = False
+        # Futures of the upload handles by content key, used to upload once the files with the same content
+        batch = {}
+        forward_batch = MessageBatch(functools.partial(self._forward_to_destinations, destinations=forward))
+
+        async def send_next():
+            file, upload_task, prepare_task = uploads.popleft()
             try:
-                message = self.send_one_file(entity, file, send_as_media, thumb=thumb)
+                # The preparation continues in its worker thread if this task is cancelled
+                await asyncio.shield(prepare_task)
+                message = await self._send_uploaded_file(entity, file, upload_task)
             finally:
-                if thumb and not file.is_custom_thumbnail and os.path.lexists(thumb):
-                    os.remove(thumb)
-            if message is None:
-                click.echo('Failed to upload file "{}"'.format(file.file_name), err=True)
-            if message and print_file_id:
-                click.echo('Uploaded successfully "{}" (file_id {})'.format(file.file_name,
-                                                                            pack_bot_file_id(message.media)))
-            if message and delete_on_success:
-                click.echo('Deleting "{}"'.format(file))
-                os.remove(file.path)
+                # The thumbnail prepared is not used if the document was already uploaded or the upload failed
+                if prepare_task.done():
+                    file.clear_prepared()
+                else:
+                    prepare_task.add_done_callback(lambda _: file.clear_prepared())
+            self._process_sent_file(file, message, delete_on_success, print_file_id)
             if message:
-                self.forward_to(message, forward)
+                self._cache_sent_document(file, message)
+                self._save_file_id(file, message)
+                if destinations:
+                    await self._send_to_destinations(destinations, file, message)
+                if forward:
+                    await forward_batch.add(message)
                 messages.append(message)
+
+        try:
+            async for file in iterate_in_executor(files):
+                has_files = True
+                # The thumbnail, the attributes and the caption are prepared in a worker thread during the upload
+                uploads.append((file, self.loop.create_task(self._get_file_handle(file, batch)),
+                                self.loop.run_in_executor(None, file.prepare)))
+                if len(uploads) >= concurrent_files:
+                    await send_next()
+            while uploads:
+                await send_next()
+        finally:
+            for file, upload_task, prepare_task in uploads:
+                upload_task.cancel()
+                prepare_task.add_done_callback(lambda _, file=file: file.clear_prepared())
+            await forward_batch.flush()
         if not has_files:
             raise MissingFileError('Files do not exist.')
         return messages
 
+    async def _get_file_handle(self, file: File, batch: dict):
+        """
+        Get the handle to send the file. If the upload cache is enabled, the handle can be the document of
+        a previous upload with the same content, or the upload of a previous file of the batch with the
+        same content. Otherwise, the file is uploaded.
+
+        :param file: File to send.
+        :param batch: Futures of the handles of the previous files of the batch by content key.
+        :return: InputDocument, InputFile or InputFileBig handle. None if the file could not be uploaded.
+        """
+        if self.upload_cache is None:
+            return await self._upload_file_handle(file)
+        key = await self.loop.run_in_executor(None, self.upload_cache.get_file_key, file)
+        handle_future = batch.get(key)
+        if handle_future is not None:
+            await asyncio.wait([handle_future])
+            if not handle_future.cancelled():
+                return handle_future.result()
+            # The file with the same content has been cancelled or has failed. Upload this file.
+            return await self._upload_file_handle(file)
+        handle_future = batch[key] = self.loop.create_future()
+        try:
+            handle = self.upload_cache.get_document(file)
+            if handle is None:
+                handle = await self._upload_file_handle(file)
+        except BaseException:
+            handle_future.cancel()
+            raise
+        handle_future.set_result(handle)
+        return handle
+
+    async def _upload_file_handle(self, file: File) -> Optional['types.TypeInputFile']:
+        """
+        Upload the bytes of the file without sending it. The failed parts are retried by the upload,
+        so the file is not uploaded again if the upload fails.
+
+        :param file: File to upload.
+        :return: InputFile or InputFileBig handle. None if the file could not be uploaded.
+        """
+        try:
+            return await self.upload_file(file, file_size=file.file_size)
+        except (TelegramUploadPartError, RPCError) as e:
+            click.echo(f'The file "{file.file_name}" could not be uploaded: {e}. It will not be retried.', err=True)
+
+    async def _send_uploaded_file(self, entity, file: File, upload_task: 'asyncio.Future', retries=RETRIES):
+        """
+        Send the message of a file once its upload task is finished. The uploaded handle is reused
+        if the message has to be sent again.
+        """
+        handle = await upload_task
+        if handle is None:
+            return
+        thumb = None if isinstance(handle, types.InputDocument) else file.get_thumbnail()
+        try:
+            while True:
+                try:
+                    message = await self.send_file(entity, handle, thumb=thumb, caption=file.file_caption,
+                                                   force_document=file.force_file,
+                                                   attributes=file.file_attributes)
+                except RPCError as e:
+                    if isinstance(handle, types.InputDocument) and isinstance(e, CACHED_DOCUMENT_ERRORS):
+                        # The document of the upload cache cannot be sent anymore. Upload the file.
+                        self.upload_cache.remove_document(file)
+                        handle = await self._upload_file_handle(file)
+                        if handle is None:
+                            return
+                        thumb = file.get_thumbnail()
+                        continue
+                    if isinstance(e, UPLOAD_EXPIRED_ERRORS):
+                        file.set_upload_handle(None)
+                        click.echo(f'The file "{file.file_name}" could not be sent: {e}. '
+                                   f'It will not be retried.', err=True)
+                        return
+                    if not retries:
+                        click.echo(f'The file "{file.file_name}" could not be sent: {e}. '
+                                   f'It will not be retried.', err=True)
+                        return
+                    click.echo(f'The file "{file.file_name}" could not be sent: {e}. Retrying...', err=True)
+                    retries -= 1
+                else:
+                    break
+        finally:
+            file.remove_thumbnail(thumb)
+        self._check_remote_size(file, message)
+        if isinstance(handle, types.InputDocument):
+            click.echo('Sent "{}" (already uploaded)'.format(file.file_name))
+        else:
+            click.echo('Uploaded "{}"'.format(file.file_name))
+        return message
+
     async def upload_file(
             self: 'TelegramClient',
             file: 'hints.FileLike',
@@ -152,7 +646,8 @@ class TelegramUploadClient(TelegramClient):
             use_cache: type = None,
             key: bytes = None,
             iv: bytes = None,
-            progress_callback: 'hints.ProgressCallback' = None) -> 'types.TypeInputFile':
+            progress_callback: 'hints.ProgressCallback' = None,
+            retries: Optional[UploadRetries] = None) -> 'types.TypeInputFile':
         """
         Uploads a file to Telegram's servers, without sending it.
 
@@ -213,6 +708,11 @@ class TelegramUploadClient(TelegramClient):
                 within a file (e.g. ``2.5`` means it has sent 50% of the third
                 file, because it's between 2 and 3).
 
+            retries (`UploadRetries`, optional):
+                Retry budget and failure accounting of the upload. A new one
+                is created if not specified. The accounting of the last upload
+                of a `File` is available in its ``upload_retries`` attribute.
+
         Returns
             :tl:`InputFileBig` if the file size is larger than 10MB,
             `InputSizedFile <telethon.tl.custom.inputsizedfile.InputSizedFile>`
@@ -236,13 +736,16 @@ class TelegramUploadClient(TelegramClient):
         """
         if isinstance(file, (types.InputFile, types.InputFileBig)):
             return file  # Already uploaded
+        if isinstance(file, File) and file.get_upload_handle() is not None:
+            # The file has been uploaded recently, only the message has to be sent again
+            return file.get_upload_handle()
 
         async with helpers._FileStream(file, file_size=file_size) as stream:
             # Opening the stream will determine the correct file size
             file_size = stream.file_size
 
             if not part_size_kb:
-                part_size_kb = utils.get_appropriated_part_size(file_size)
+                part_size_kb = self.part_size_policy.get_upload_part_size(file_size)
 
             if part_size_kb > 512:
                 raise ValueError('The part size must be less or equal to 512KB')
@@ -272,66 +775,115 @@ class TelegramUploadClient(TelegramClient):
             self._log[__name__].info('Uploading file of %d bytes in %d chunks of %d',
                                     file_size, part_count, part_size)
 
-            pos = 0
-            for part_index in range(part_count):
-                # Read the file by in chunks of size part_size
-                part = await helpers._maybe_await(stream.read(part_size))
-
-                if not isinstance(part, bytes):
-                    raise TypeError(
-                        'file descriptor returned {}, not bytes (you must '
-                        'open the file in bytes mode)'.format(type(part)))
-
-                # `file_size` could be wrong in which case `part` may not be
-                # `part_size` before reaching the end.
-                if len(part) != part_size and part_index < part_count - 1:
-                    raise ValueError(
-                        'read less than {} before reaching the end; either '
-                        '`file_size` or `read` are wrong'.format(part_size))
-
-                pos += len(part)
-
-                # Encryption part if needed
-                if key and iv:
-                    part = AES.encrypt_ige(part, key, iv)
-
-                if not is_big:
-                    # Bit odd that MD5 is only needed for small files and not
-                    # big ones with more chance for corruption, but that's
-                    # what Telegram wants.
-                    hash_md5.update(part)
-
-                # The SavePartRequest is different depending on whether
-                # the file is too large or not (over or less than 10MB)
-                if is_big:
-                    request = functions.upload.SaveBigFilePartRequest(
-                        file_id, part_index, part_count, part)
-                else:
-                    request = functions.upload.SaveFilePartRequest(
-                        file_id, part_index, part)
-                await self.upload_semaphore.acquire()
-                self.loop.create_task(
-                    self._send_file_part(request, part_index, part_count, pos, file_size, progress_callback),
-                    name=f"telegram-upload-file-{part_index}"
-                )
-            # Wait for all tasks to finish
-            await asyncio.wait([
-                task for task in asyncio.all_tasks() if task.get_name().startswith(f"telegram-upload-file-")
-            ])
+            # Big files are resumable. The parts already uploaded in a previous upload of the same file
+            # are not sent again.
+            journal = None
+            part_indexes = range(part_count)
+            if is_big and isinstance(file, File) and self.resume_uploads:
+                journal = UploadJournal.open(file, part_size, part_count)
+                file_id = journal.file_id
+                part_indexes = journal.missing_parts
+            if journal and journal.parts:
+                click.echo(f'Resuming the upload of "{file_name}". {len(journal.parts)} of {part_count} parts '
+                           f'were already uploaded.', err=True)
+
+            if retries is None:
+                retries = UploadRetries()
+            if isinstance(file, File):
+                file.upload_retries = retries
+
+            if self.upload_connections > 1:
+                await self.upload_senders.start()
+
+            # Bytes already uploaded, used for the progress
+            pos = file_size - sum(min(part_size, file_size - part_index * part_size) for part_index in part_indexes)
+            pending = set()
+            if isinstance(file, File) and file.use_mmap:
+                reader = MappedPartReader(file, part_size, part_indexes, self.read_ahead_parts)
+            else:
+                reader = PartReader(stream, part_size, part_indexes, self.upload_buffers, self.read_ahead_parts)
+            try:
+                for part_index in part_indexes:
+                    # Read the file by in chunks of size part_size into a reusable buffer (or a slice of the
+                    # memory-mapped file). The buffer is returned to the pool when the part has been uploaded.
+                    buffer, part = await reader.next()
+                    try:
+                        # `file_size` could be wrong in which case `part` may not be
+                        # `part_size` before reaching the end.
+                        if len(part) != part_size and part_index < part_count - 1:
+                            raise ValueError(
+                                'read less than {} before reaching the end; either '
+                                '`file_size` or `read` are wrong'.format(part_size))
+
+                        pos += len(part)
+
+                        # Encryption part if needed
+                        if key and iv:
+                            part = AES.encrypt_ige(bytes(part), key, iv)
+
+                        if not is_big:
+                            # Bit odd that MD5 is only needed for small files and not
+                            # big ones with more chance for corruption, but that's
+                            # what Telegram wants.
+                            hash_md5.update(part)
+
+                        # The SavePartRequest is different depending on whether
+                        # the file is too large or not (over or less than 10MB)
+                        if is_big:
+                            request = BufferSaveBigFilePartRequest(
+                                file_id, part_index, part_count, part)
+                        else:
+                            request = BufferSaveFilePartRequest(
+                                file_id, part_index, part)
+                        if len(pending) >= self.upload_window:
+                            # The window is full. Wait for any part to finish before sending the next one
+                            pending = await self._wait_file_parts(pending, asyncio.FIRST_COMPLETED)
+                        task = self.loop.create_task(
+                            self._send_file_part(request, part_index, part_count, pos, file_size,
+                                                 progress_callback, retries),
+                            name=f"telegram-upload-file-{file_id}-{part_index}"
+                        )
+                    except BaseException:
+                        reader.release(buffer)
+                        raise
+                    task.add_done_callback(lambda _, buffer=buffer: reader.release(buffer))
+                    if journal:
+                        task.add_done_callback(functools.partial(self._journal_file_part, journal, part_index))
+                    pending.add(task)
+                # Wait for all the parts of this file to finish
+                pending = await self._wait_file_parts(pending, asyncio.ALL_COMPLETED)
+            finally:
+                # Do not leave parts in flight if the upload is aborted
+                for task in pending:
+                    task.cancel()
+                await reader.close()
+                if journal:
+                    journal.close()
+            if journal:
+                journal.remove()
         if is_big:
-            return types.InputFileBig(file_id, part_count, file_name)
+            handle = types.InputFileBig(file_id, part_count, file_name)
         else:
-            return custom.InputSizedFile(
+            handle = custom.InputSizedFile(
                 file_id, part_count, file_name, md5=hash_md5, size=file_size
             )
+        if isinstance(file, File):
+            file.set_upload_handle(handle)
+        if retries.retries:
+            self._log[__name__].info('Uploaded file with %d retries (%s)', retries.retries,
+                                     ', '.join(f'{kind}: {count}' for kind, count in retries.failures.items()))
+        return handle
 
     # endregion
 
     async def _send_file_part(self, request: TLRequest, part_index: int, part_count: int, pos: int, file_size: int,
-                              progress_callback: Optional['hints.ProgressCallback'] = None, retry: int = 0) -> None:
+                              progress_callback: Optional['hints.ProgressCallback'] = None,
+                              retries: Optional[UploadRetries] = None) -> None:
         """
-        Submit the file request part to Telegram. This method waits for the request to be executed, logs the upload,
-        and releases the semaphore to allow further uploading.
+        Submit the file request part to Telegram. This method waits for the request to be executed and logs the
+        upload. The upload semaphore is held only while the request is in flight, so it is released on errors too.
+        The latency of the request and the congestion errors are reported to the semaphore to adapt its limit.
+        Only the failed part is retried, using the retry policy of the error and the retry budget of the upload.
 
         :param request: SaveBigFilePartRequest or SaveFilePartRequest. This request will be awaited.
         :param part_index: Part index as integer. Used in logging.
@@ -339,46 +891,111 @@ class TelegramUploadClient(TelegramClient):
         :param pos: Number of part as integer. Used for progress bar.
         :param file_size: Total file size. Used for progress bar.
         :param progress_callback: Callback to use after submit the request. Optional.
+        :param retries: Retry accounting of the upload. Optional.
         :return: None
         """
-        result = None
-        try:
-            result = await self(request)
-        except InvalidBufferError as e:
-            if e.code == 429:
-                # Too many connections
-                click.echo(f'Too many connections to Telegram servers.', err=True)
-            else:
-                raise
-        except ConnectionError:
-            # Retry to send the file part
-            click.echo(f'Detected connection error. Retrying...', err=True)
-        else:
-            self.upload_semaphore.release()
-        if result is None and retry < MAX_RECONNECT_RETRIES:
-            # An error occurred, retry
-            await asyncio.sleep(max(MIN_RECONNECT_WAIT, retry * MIN_RECONNECT_WAIT))
-            await self.reconnect()
-            await self._send_file_part(
-                request, part_index, part_count, pos, file_size, progress_callback, retry + 1
-            )
-        elif result:
-            self._log[__name__].debug('Uploaded %d/%d',
-                                      part_index + 1, part_count)
-            if progress_callback:
-                await helpers._maybe_await(progress_callback(pos, file_size))
-        else:
+        retries = retries or UploadRetries()
+        attempts = collections.Counter()
+        while True:
+            # Do not hold a permit of the semaphore during a flood wait
+            await self.flood_limiter.wait(request)
+            sender = None
+            try:
+                async with self.upload_semaphore, self.upload_senders.borrow() as sender:
+                    start = time.monotonic()
+                    result = await self._call(sender, request)
+                    self.upload_semaphore.increase(time.monotonic() - start)
+                break
+            except (InvalidBufferError, ConnectionError, asyncio.TimeoutError, RPCError) as e:
+                kind = get_error_kind(e)
+                if kind is None:
+                    raise
+                wait = retries.get_retry_wait(e, attempts)
+                if kind == TOO_MANY_REQUESTS:
+                    click.echo(f'Too many connections to Telegram servers.', err=True)
+                elif kind == TRANSPORT_ERROR:
+                    click.echo(f'Detected connection error.', err=True)
+                elif kind == FLOOD_WAIT:
+                    click.echo(f'{e}.', err=True)
+                else:
+                    click.echo(f'Error uploading the file part {part_index}: {e}.', err=True)
+                if kind in (TOO_MANY_REQUESTS, TRANSPORT_ERROR, FLOOD_WAIT):
+                    self.upload_semaphore.decrease()
+                if wait is None:
+                    raise TelegramUploadPartError(
+                        f'The part {part_index} failed {sum(attempts.values()) + 1} times, '
+                        f'{retries.retries} retries in the upload (last error: {e})'
+                    ) from e
+                click.echo(f'Retrying the file part {part_index} in {wait:.1f} seconds...', err=True)
+                await asyncio.sleep(wait)
+                if kind == TRANSPORT_ERROR:
+                    if sender is not None:
+                        await self.upload_senders.drop(sender)
+                    await self.reconnect()
+        if not result:
             raise RuntimeError(
                 'Failed to upload file part {}.'.format(part_index))
+        self._log[__name__].debug('Uploaded %d/%d',
+                                  part_index + 1, part_count)
+        if progress_callback:
+            await helpers._maybe_await(progress_callback(pos, file_size))
+
+    @staticmethod
+    def _journal_file_part(journal: UploadJournal, part_index: int, task: asyncio.Task) -> None:
+        """Register in the journal a part uploaded successfully."""
+        if not task.cancelled() and task.exception() is None:
+            journal.add(part_index)
+
+    async def _wait_file_parts(self, tasks: Set[asyncio.Task], return_when: str) -> Set[asyncio.Task]:
+        """
+        Wait for the file part tasks of an upload. If any part has failed, the other parts of the same
+        upload are cancelled and the error is raised to the caller.
 
-    def decrease_upload_semaphore(self):
+        :param tasks: Pending tasks of the upload.
+        :param return_when: asyncio.FIRST_COMPLETED to refill the window or asyncio.ALL_COMPLETED to finish.
+        :return: Tasks still pending.
+        """
+        if not tasks:
+            return set()
+        done, pending = await asyncio.wait(tasks, return_when=return_when)
+        # The exceptions of all the failed parts are retrieved, although only the first one is raised
+        exceptions = [task.exception() for task in done if not task.cancelled()]
+        error = next((exception for exception in exceptions if exception is not None), None)
+        if error is not None:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise error
+        return pending
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
         """
-        Decreases the upload semaphore by one. This method is used to reduce the number of parallel uploads.
-        :return:
+        Send a request waiting first for the flood waits of its class. If Telegram returns a flood wait,
+        the wait is shared with the other requests of the same class and only this request is sent again
+        when it finishes, without blocking the event loop. The file parts are not sent again here, they
+        have their own retry policy. The flood_sleep_threshold of the client is 0, so Telethon does not
+        sleep the flood waits, and its own flood waits by request class (for all the chats) are discarded.
         """
-        if self.parallel_upload_blocks > 1:
-            self.parallel_upload_blocks -= 1
-            self.loop.create_task(self.upload_semaphore.acquire())
+        requests = request if utils.is_list_like(request) else [request]
+        retries = 0
+        while True:
+            for r in requests:
+                await self.flood_limiter.wait(r)
+            self._flood_waited_requests.clear()
+            try:
+                return await super()._call(sender, request, ordered=ordered)
+            except FloodWaitError as e:
+                self._flood_waited_requests.clear()
+                failed = e.request if isinstance(e.request, TLRequest) else requests[0]
+                self.flood_limiter.record(failed, e)
+                if isinstance(failed, FILE_PART_REQUESTS) or retries >= MAX_FLOOD_WAIT_RETRIES:
+                    raise
+                retries += 1
+                click.echo(f'{e}. Waiting for {e.seconds} seconds.', err=True)
+
+    async def _disconnect_coro(self):
+        await super()._disconnect_coro()
+        await self.upload_senders.close()
 
     async def reconnect(self):
         """
@@ -391,7 +1008,6 @@ class TelegramUploadClient(TelegramClient):
             # Reconnected in another task
             self.reconnecting_lock.release()
             return
-        self.decrease_upload_semaphore()
         try:
             click.echo(f'Reconnecting to Telegram servers...')
             await asyncio.wait_for(self.connect(), RECONNECT_TIMEOUT)
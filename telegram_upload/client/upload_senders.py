@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import contextlib
+import copy
+from typing import TYPE_CHECKING, AsyncIterator, List
+
+import click
+from telethon.network import MTProtoSender
+from telethon.tl import functions
+from telethon.tl.alltlobjects import LAYER
+
+from telegram_upload.utils import get_environment_integer
+
+if TYPE_CHECKING:
+    from telegram_upload.client.telegram_upload_client import TelegramUploadClient
+
+
+UPLOAD_CONNECTIONS = get_environment_integer('TELEGRAM_UPLOAD_CONNECTIONS', 1)
+
+
+class UploadSenderPool:
+    """Pool of MTProto senders used to upload the file parts. The first sender is always the main
+    sender of the client. The extra senders are new connections to the home DC of the session,
+    authorized with the same auth key, and they are created the first time a part is uploaded.
+    """
+    def __init__(self, client: 'TelegramUploadClient', connections: int = UPLOAD_CONNECTIONS):
+        self.client = client
+        self.connections = connections
+        self.extra_senders: List[MTProtoSender] = []
+        self.in_flight = collections.Counter()
+        self._started = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def senders(self) -> List[MTProtoSender]:
+        """Main sender and extra senders connected."""
+        return [self.client._sender] + self.extra_senders
+
+    async def _create_sender(self) -> MTProtoSender:
+        """Create a new connection to the home DC using the session auth key."""
+        session = self.client.session
+        sender = MTProtoSender(session.auth_key, loggers=self.client._log)
+        await sender.connect(self.client._connection(
+            session.server_address,
+            session.port,
+            session.dc_id,
+            loggers=self.client._log,
+            proxy=self.client._proxy,
+            local_addr=self.client._local_addr,
+        ))
+        # The init request of the client is shared. Use a copy for the new connection.
+        init_request = copy.copy(self.client._init_request)
+        init_request.query = functions.help.GetConfigRequest()
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, init_request))
+        return sender
+
+    async def start(self):
+        """Open the extra connections missing. If a connection cannot be opened, the upload continues
+        using the senders already available.
+        """
+        async with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.connections - 1 - len(self.extra_senders)):
+                try:
+                    self.extra_senders.append(await self._create_sender())
+                except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                    click.echo(f'Could not open an extra upload connection: {e}', err=True)
+                    break
+
+    @contextlib.asynccontextmanager
+    async def borrow(self) -> AsyncIterator[MTProtoSender]:
+        """Borrow the sender with less requests in flight."""
+        if self.connections > 1 and not self._started:
+            await self.start()
+        sender = min(self.senders, key=lambda x: self.in_flight[id(x)])
+        self.in_flight[id(sender)] += 1
+        try:
+            yield sender
+        finally:
+            self.in_flight[id(sender)] -= 1
+
+    async def drop(self, sender: MTProtoSender):
+        """Disconnect and forget an extra sender after a connection error, so no more parts are sent
+        to it. A new connection is opened in its place by the next borrow. The main sender is
+        reconnected by the client.
+        """
+        async with self._lock:
+            if sender not in self.extra_senders:
+                return
+            self.extra_senders.remove(sender)
+            self._started = False
+        await sender.disconnect()
+
+    async def close(self):
+        """Disconnect the extra senders."""
+        async with self._lock:
+            for sender in self.extra_senders:
+                await sender.disconnect()
+            self.extra_senders = []
+            self._started = False
@@ -6,6 +6,7 @@ import click
 CONFIG_DIRECTORY = os.environ.get('TELEGRAM_UPLOAD_CONFIG_DIRECTORY', '~/.config')
 CONFIG_FILE = os.path.expanduser('{}/telegram-upload.json'.format(CONFIG_DIRECTORY))
 SESSION_FILE = os.path.expanduser('{}/telegram-upload'.format(CONFIG_DIRECTORY))
+CACHE_DIRECTORY = os.path.expanduser(os.environ.get('TELEGRAM_UPLOAD_CACHE_DIRECTORY', '~/.cache/telegram-upload'))
 
 
 def prompt_config(config_file):
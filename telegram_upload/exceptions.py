@@ -62,6 +62,16 @@ class TelegramEnvironmentError(TelegramUploadError):
     error_code = 31
 
 
+class TelegramUploadPartError(TelegramUploadError):
+    body = 'A part of the file could not be uploaded'
+    error_code = 32
+
+
+class TelegramPartSizeError(TelegramUploadError):
+    body = 'Invalid part size'
+    error_code = 33
+
+
 def catch(fn):
     def wrap(*args, **kwargs):
         try:
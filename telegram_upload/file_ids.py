@@ -0,0 +1,72 @@
+import json
+import re
+from typing import Iterator, Optional, Union
+
+from telethon import utils
+from telethon.tl import types
+
+from telegram_upload.exceptions import TelegramInvalidFile
+
+
+# The file id printed by --print-file-id
+PRINTED_FILE_ID_PATTERN = re.compile(r'\(file_id (\S+)\)')
+
+
+class UploadedFile:
+    """File already uploaded to Telegram, identified by its file id. It can be sent again without
+    uploading it. The file reference is required by Telegram to send the documents of user
+    accounts, but the file ids do not include it.
+    """
+    def __init__(self, file_id: str, name: Optional[str] = None, caption: Optional[str] = None,
+                 file_reference: bytes = b''):
+        self.file_id = file_id
+        self.name = name or file_id
+        self.caption = caption
+        self.file_reference = file_reference
+
+    @property
+    def media(self) -> Union[types.Document, types.Photo]:
+        media = utils.resolve_bot_file_id(self.file_id)
+        if media is None:
+            raise TelegramInvalidFile('Invalid file id: {}'.format(self.file_id))
+        media.file_reference = self.file_reference
+        return media
+
+    @classmethod
+    def from_message(cls, name: str, message) -> 'UploadedFile':
+        media = message.media.document if hasattr(message.media, 'document') else message.media.photo
+        return cls(utils.pack_bot_file_id(message.media), name, message.message, media.file_reference)
+
+    @classmethod
+    def from_line(cls, line: str) -> Optional['UploadedFile']:
+        """Read a line of a manifest: a JSON object written by to_line, a line printed by --print-file-id
+        or a file id. None is returned for empty lines.
+        """
+        line = line.strip()
+        if not line:
+            return None
+        if line.startswith('{'):
+            data = json.loads(line)
+            return cls(data['file_id'], data.get('name'), data.get('caption'),
+                       bytes.fromhex(data.get('file_reference', '')))
+        match = PRINTED_FILE_ID_PATTERN.search(line)
+        return cls(match.group(1) if match else line)
+
+    def to_line(self) -> str:
+        return json.dumps({'file_id': self.file_id, 'name': self.name, 'caption': self.caption,
+                           'file_reference': self.file_reference.hex()})
+
+
+def read_manifest(path: str) -> Iterator[UploadedFile]:
+    """Files of a manifest of file ids, in order."""
+    with open(path) as file:
+        for line in file:
+            uploaded_file = UploadedFile.from_line(line)
+            if uploaded_file is not None:
+                yield uploaded_file
+
+
+def write_manifest(path: str, uploaded_file: UploadedFile) -> None:
+    """Append a file to a manifest of file ids."""
+    with open(path, 'a') as file:
+        file.write(uploaded_file.to_line() + '\n')
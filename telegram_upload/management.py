@@ -2,15 +2,19 @@
 
 """Console script for telegram-upload."""
 import os
+from typing import Iterable, List, Union
 
 import click
 from telethon.tl.types import User
 
 from telegram_upload.cli import show_checkboxlist, show_radiolist
 from telegram_upload.client import TelegramManagerClient, get_message_file_attribute
+from telegram_upload.client.part_size import get_part_size_policy
 from telegram_upload.config import default_config, CONFIG_FILE
 from telegram_upload.download_files import KeepDownloadSplitFiles, JoinDownloadSplitFiles
-from telegram_upload.exceptions import catch
+from telegram_upload.exceptions import catch, TelegramInvalidFile
+from telegram_upload.file_ids import UploadedFile, read_manifest
+from telegram_upload.upload_cache import UploadCache
 from telegram_upload.upload_files import NoDirectoriesFiles, RecursiveFiles, NoLargeFiles, SplitFiles, is_valid_file
 from telegram_upload.utils import async_to_sync, amap, sync_to_async_iterator
 
@@ -57,6 +61,12 @@ def get_file_display_name(message):
     return ' '.join(display_name_parts)
 
 
+def get_entities(entities: Iterable[Union[str, int]]) -> List[Union[str, int]]:
+    """Entities of the command line. The chat ids are converted to integers."""
+    return [int(entity) if isinstance(entity, str) and entity.lstrip("-+").isdigit() else entity
+            for entity in entities]
+
+
 async def interactive_select_files(client, entity: str):
     iterator = client.iter_files(entity)
     iterator = amap(lambda x: (x, get_file_display_name(x)), iterator,)
@@ -112,8 +122,9 @@ class MutuallyExclusiveOption(click.Option):
 
 @click.command()
 @click.argument('files', nargs=-1)
-@click.option('--to', default=None, help='Phone number, username, invite link or "me" (saved messages). '
-                                         'By default "me".')
+@click.option('--to', multiple=True, help='Phone number, username, invite link or "me" (saved messages). '
+                                          'By default "me". This option can be used multiple times: the files are '
+                                          'uploaded once and sent to all the chats.')
 @click.option('--config', default=None, help='Configuration file to use. By default "{}".'.format(CONFIG_FILE))
 @click.option('-d', '--delete-on-success', is_flag=True, help='Delete local file after successful upload.')
 @click.option('--print-file-id', is_flag=True, help='Print the id of the uploaded file after the upload.')
@@ -138,18 +149,65 @@ class MutuallyExclusiveOption(click.Option):
                    'for socks5 and mtproxy://secret@1.2.3.4:443 for mtproxy.')
 @click.option('-a', '--album', is_flag=True,
               help='Send video or photos as an album.')
+@click.option('--group-documents', is_flag=True,
+              help='Send the files as documents grouped in albums of up to 10 files, with one message for each '
+                   'group. Useful to upload many small files.')
 @click.option('-i', '--interactive', is_flag=True,
               help='Use interactive mode.')
 @click.option('--sort', is_flag=True,
               help='Sort files by name before upload it. Install the natsort Python package for natural sorting.')
+@click.option('--concurrent-files', default=1, type=click.IntRange(min=1),
+              help='Number of files uploaded at the same time. The messages are sent in the original order of the '
+                   'files. By default 1. Albums are not affected by this option.')
+@click.option('--dedup', is_flag=True,
+              help='Send the files already uploaded (with the same content) using the existing Telegram document '
+                   'instead of uploading them again. The uploaded documents are saved in a local cache. Albums are '
+                   'not affected by this option.')
+@click.option('--skip-existing', is_flag=True,
+              help='Do not upload the files already in the destination chat: a document with the same file name and '
+                   'size. If the caption of the document has a md5, sha1 or sha256 hash, the hash must be the same. '
+                   'Only the first --to chat is checked.')
+@click.option('--save-file-ids', default=None, type=click.Path(dir_okay=False),
+              help='Save the file ids of the uploaded files in this file (one JSON per line). The file can be used '
+                   'with --file-ids to send the files again without uploading them.')
+@click.option('--file-id', 'file_ids', multiple=True,
+              help='Send a file already uploaded using its file id, without uploading it again. This option can be '
+                   'used multiple times. The file ids do not include the file reference required by user accounts, '
+                   'so only bots can use this option. Use --file-ids with a file of --save-file-ids instead.')
+@click.option('--file-ids', 'file_ids_manifest', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Send the files already uploaded of a file created by --save-file-ids, or of a file with the '
+                   'output of --print-file-id, without uploading them again. Only bots can send the file ids of '
+                   '--print-file-id.')
+@click.option('--part-size', default=None,
+              help='Size of the parts of the uploads: "auto" (default), a size in KiB (a power of 2 up to 512), '
+                   '"tiered:<max file size>=<KiB>,...,<KiB>" or "benchmark[:<results file>]". The part size is '
+                   'increased if the file would have more than 4000 parts.')
 def upload(files, to, config, delete_on_success, print_file_id, force_file, forward, directories, large_files, caption,
-           no_thumbnail, thumbnail_file, proxy, album, interactive, sort):
+           no_thumbnail, thumbnail_file, proxy, album, group_documents, interactive, sort, concurrent_files, dedup,
+           skip_existing, save_file_ids, file_ids, file_ids_manifest, part_size):
     """Upload one or more files to Telegram using your personal account.
     The maximum file size is 2 GiB for free users and 4 GiB for premium accounts.
     By default, they will be saved in your saved messages.
     """
     client = TelegramManagerClient(config or default_config(), proxy=proxy)
+    if part_size:
+        client.part_size_policy = get_part_size_policy(part_size)
     client.start()
+    if dedup:
+        # The documents can only be sent again by the account that uploaded them
+        client.upload_cache = UploadCache(user_id=client.me.id)
+    if save_file_ids:
+        client.file_ids_manifest = save_file_ids
+    if file_ids or file_ids_manifest:
+        uploaded_files = [UploadedFile(file_id) for file_id in file_ids]
+        if file_ids_manifest:
+            uploaded_files.extend(read_manifest(file_ids_manifest))
+        bare_file_ids = [uploaded_file.file_id for uploaded_file in uploaded_files if not uploaded_file.file_reference]
+        if bare_file_ids and not client.me.bot:
+            raise TelegramInvalidFile('The file ids without a file reference can only be sent by bots: {}. Use a file '
+                                      'created by --save-file-ids instead.'.format(', '.join(bare_file_ids)))
+        client.send_uploaded_files(get_entities(to or ['me']), uploaded_files)
+        return
     if interactive and not files:
         click.echo('Select the local files to upload:')
         click.echo('[SPACE] Select file [ENTER] Next step')
@@ -157,12 +215,12 @@ def upload(files, to, config, delete_on_success, print_file_id, force_file, forw
     if interactive and not files:
         # No files selected. Exiting.
         return
-    if interactive and to is None:
+    if interactive and not to:
         click.echo('Select the recipient dialog of the files:')
         click.echo('[SPACE] Select dialog [ENTER] Next step')
-        to = async_to_sync(interactive_select_dialog(client))
-    elif to is None:
-        to = 'me'
+        to = [async_to_sync(interactive_select_dialog(client))]
+    elif not to:
+        to = ['me']
     files = filter(lambda file: is_valid_file(file, lambda message: click.echo(message, err=True)), files)
     files = DIRECTORY_MODES[directories](client, files)
     if directories == 'fail':
@@ -179,16 +237,19 @@ def upload(files, to, config, delete_on_success, print_file_id, force_file, forw
     if large_files == 'fail':
         # Validate now
         files = list(files)
-    if isinstance(to, str) and to.lstrip("-+").isdigit():
-        to = int(to)
+    to, *destinations = get_entities(to)
     if sort and natsorted:
         files = natsorted(files, key=lambda x: x.name)
     elif sort:
         files = sorted(files, key=lambda x: x.name)
-    if album:
-        client.send_files_as_album(to, files, delete_on_success, print_file_id, forward)
+    if skip_existing:
+        files = client.filter_existing_files(to, files)
+    if album or group_documents:
+        client.send_files_as_album(to, files, delete_on_success, print_file_id, forward, destinations=destinations,
+                                   force_document=group_documents)
     else:
-        client.send_files(to, files, delete_on_success, print_file_id, forward)
+        client.send_files(to, files, delete_on_success, print_file_id, forward, concurrent_files=concurrent_files,
+                          destinations=destinations)
 
 
 @click.command()
@@ -204,13 +265,19 @@ def upload(files, to, config, delete_on_success, print_file_id, force_file, forw
               help='Defines how to download large files split in Telegram. By default the files are not merged.')
 @click.option('-i', '--interactive', is_flag=True,
               help='Use interactive mode.')
-def download(from_, config, delete_on_success, proxy, split_files, interactive):
+@click.option('--part-size', default=None,
+              help='Size of the parts of the downloads: "auto" (default), a size in KiB (a power of 2 up to 512, '
+                   'the maximum size of the download requests), '
+                   '"tiered:<max file size>=<KiB>,...,<KiB>" or "benchmark[:<results file>]".')
+def download(from_, config, delete_on_success, proxy, split_files, interactive, part_size):
     """Download all the latest messages that are files in a chat, by default download
     from "saved messages". It is recommended to forward the files to download to
     "saved messages" and use parameter ``--delete-on-success``. Forwarded messages will
     be removed from the chat after downloading, such as a download queue.
     """
     client = TelegramManagerClient(config or default_config(), proxy=proxy)
+    if part_size:
+        client.part_size_policy = get_part_size_policy(part_size)
     client.start()
     if not interactive and not from_:
         from_ = 'me'
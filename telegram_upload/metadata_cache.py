@@ -0,0 +1,83 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from telegram_upload.config import CACHE_DIRECTORY
+
+
+METADATA_CACHE_FILE = os.path.join(CACHE_DIRECTORY, 'metadata.sqlite3')
+
+# Device, inode, size and modification time in nanoseconds of a file
+FileKey = Tuple[int, int, int, int]
+
+
+def get_file_key(stat: os.stat_result) -> FileKey:
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class MetadataCache:
+    """Local cache of the media information of the files, by device, inode, size and modification
+    time, so the files are not parsed again in the next runs. The values are stored in a SQLite
+    database. It can be used from several threads.
+    """
+    def __init__(self, path: str = METADATA_CACHE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS media ('
+            'dev INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'is_media INTEGER NOT NULL, duration INTEGER NOT NULL, width INTEGER, height INTEGER, '
+            'supports_streaming INTEGER NOT NULL, tags TEXT NOT NULL, created REAL NOT NULL, '
+            'read_size INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (dev, inode, size, mtime_ns))'
+        )
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(media)')]
+        if 'read_size' not in columns:
+            # Database of a previous version. Only the complete parses were saved.
+            self.connection.execute('ALTER TABLE media ADD COLUMN read_size INTEGER NOT NULL DEFAULT 0')
+        self.connection.commit()
+
+    def get(self, key: FileKey, read_size: int = 0) -> Optional[dict]:
+        """Media information of the file of the key: the arguments of MediaProbe. An empty dict if
+        the file is not a media file, and None if the file is not in the cache.
+
+        :param read_size: MiB that can be read from the file to parse it (0 for no limit). The values
+            of a parse stopped by a smaller read limit are not returned.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT is_media, duration, width, height, supports_streaming, tags, read_size FROM media '
+                'WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?', key
+            ).fetchone()
+        if row is None or (row[6] and (not read_size or row[6] < read_size)):
+            return None
+        if not row[0]:
+            return {}
+        return dict(duration=row[1], width=row[2], height=row[3], supports_streaming=bool(row[4]),
+                    **json.loads(row[5]))
+
+    def set(self, key: FileKey, values: Optional[dict], read_size: int = 0) -> None:
+        """Save the media information of the file of the key. Use None if the file is not a media file.
+
+        :param values: Duration, width, height, supports_streaming and the tags.
+        :param read_size: MiB read limit that stopped the parse of the file. 0 if the parse was complete.
+        """
+        values = dict(values or {})
+        row = (
+            bool(values), values.pop('duration', 0), values.pop('width', None), values.pop('height', None),
+            values.pop('supports_streaming', False), json.dumps(values, default=str), time.time(), read_size,
+        )
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO media (dev, inode, size, mtime_ns, is_media, duration, width, height, '
+                'supports_streaming, tags, created, read_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                tuple(key) + row
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
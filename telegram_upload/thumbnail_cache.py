@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+import uuid
+from typing import Callable, Optional
+
+from telegram_upload.config import CACHE_DIRECTORY
+from telegram_upload.metadata_cache import get_file_key
+
+
+THUMBNAIL_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'thumbnails')
+THUMBNAIL_EXTENSION = '.jpg'
+TEMPORARY_PREFIX = '.tmp-'
+
+
+class ThumbnailCache:
+    """Directory of the thumbnails generated for the files, by device, inode, size and modification
+    time of the file. The thumbnails are reused by the retries, the parts of the split files and the
+    next runs. The least recently used thumbnails are removed when the directory exceeds max_size.
+    The thumbnails of the cache must not be removed by the callers.
+    """
+    def __init__(self, directory: str = THUMBNAIL_CACHE_DIRECTORY, max_size: int = 100 * 1024 * 1024):
+        """
+        :param directory: Directory of the thumbnails.
+        :param max_size: Maximum size in bytes of the thumbnails of the directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get_path(self, file: str) -> str:
+        key = '-'.join(map(str, get_file_key(os.stat(file))))
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + THUMBNAIL_EXTENSION)
+
+    def is_cached(self, thumb: str) -> bool:
+        """The thumbnail is a file of the cache."""
+        return os.path.dirname(os.path.abspath(thumb)) == os.path.abspath(self.directory)
+
+    def get_thumbnail(self, file: str, create: Callable[[str, str], Optional[str]]) -> Optional[str]:
+        """Thumbnail of the file. It is created if it is not in the cache.
+
+        :param file: Path of the file.
+        :param create: Function to create the thumbnail of the file (first argument) in the path of the
+            output (second argument). It returns the path or None if the thumbnail cannot be created.
+        """
+        path = self.get_path(file)
+        try:
+            # The access time is not updated by all the filesystems. The modification time is used instead.
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        # ffmpeg does not overwrite the existing files
+        output = os.path.join(self.directory, TEMPORARY_PREFIX + uuid.uuid4().hex + THUMBNAIL_EXTENSION)
+        try:
+            if not create(file, output) or not os.path.isfile(output):
+                return None
+            os.replace(output, path)
+        finally:
+            if os.path.lexists(output):
+                os.remove(output)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used thumbnails until the size of the cache is up to max_size.
+
+        :param keep: Thumbnail not to remove. For example, the thumbnail just created.
+        """
+        with self.lock:
+            thumbnails = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(THUMBNAIL_EXTENSION) and not entry.name.startswith(TEMPORARY_PREFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    thumbnails.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in thumbnails)
+            for _, size, path in sorted(thumbnails):
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import sqlite3
+import time
+import weakref
+from typing import TYPE_CHECKING, Optional, Tuple, Dict
+
+from telethon.tl import types
+
+from telegram_upload.config import CACHE_DIRECTORY
+
+if TYPE_CHECKING:
+    from telegram_upload.upload_files import File
+
+
+UPLOAD_CACHE_FILE = os.path.join(CACHE_DIRECTORY, 'uploads.sqlite3')
+HASH_READ_SIZE = 1024 * 1024
+
+ContentKey = Tuple[str, int]
+
+
+def get_content_hash(path: str, start: int, length: int, algorithm: str = 'sha256') -> str:
+    """Hash (SHA-256 by default) of length bytes of the file starting at start."""
+    content_hash = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(HASH_READ_SIZE, length))
+            if not data:
+                break
+            content_hash.update(data)
+            length -= len(data)
+    return content_hash.hexdigest()
+
+
+class UploadCache:
+    """Local cache of the documents uploaded by account and content (SHA-256 and size). A file with
+    the same content as a document already uploaded by the account can be sent using the document,
+    without uploading it again. The documents are stored in a SQLite database.
+    """
+    def __init__(self, path: str = UPLOAD_CACHE_FILE, user_id: int = 0):
+        """
+        :param path: SQLite database of the documents.
+        :param user_id: Id of the account. The documents of the other accounts cannot be sent by it.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.user_id = user_id
+        self.connection = sqlite3.connect(path)
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(documents)')]
+        if columns and 'user_id' not in columns:
+            # Database of a previous version. The accounts of its documents are unknown.
+            self.connection.execute('DROP TABLE documents')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'user_id INTEGER NOT NULL, hash TEXT NOT NULL, size INTEGER NOT NULL, id INTEGER NOT NULL, '
+            'access_hash INTEGER NOT NULL, file_reference BLOB NOT NULL, created REAL NOT NULL, '
+            'PRIMARY KEY (user_id, hash, size))'
+        )
+        self.connection.commit()
+        # The content keys of the files of this run. The files with the same inode are not read again.
+        self._file_keys = weakref.WeakKeyDictionary()
+        self._inode_keys: Dict[tuple, ContentKey] = {}
+
+    def get_file_key(self, file: 'File') -> ContentKey:
+        """Content key (SHA-256 and size) of the bytes of the file pending to upload. It must be called
+        before the upload. It can be called from a worker thread.
+        """
+        key = self._file_keys.get(file)
+        if key is not None:
+            return key
+        start, length = file.get_pending_range()
+        stat = os.stat(file.path)
+        inode_key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, start, length)
+        key = self._inode_keys.get(inode_key)
+        if key is None:
+            key = (get_content_hash(file.path, start, length), length)
+            self._inode_keys[inode_key] = key
+        self._file_keys[file] = key
+        return key
+
+    def get_document(self, file: 'File') -> Optional[types.InputDocument]:
+        """Document uploaded with the same content as the file, if any."""
+        content_hash, size = self.get_file_key(file)
+        row = self.connection.execute(
+            'SELECT id, access_hash, file_reference FROM documents WHERE user_id = ? AND hash = ? AND size = ?',
+            (self.user_id, content_hash, size)
+        ).fetchone()
+        if row is None:
+            return None
+        return types.InputDocument(row[0], row[1], row[2])
+
+    def add_document(self, file: 'File', document: types.Document) -> None:
+        """Register the document sent for the file. The content key of the file must have been
+        calculated before its upload.
+        """
+        key = self._file_keys.get(file)
+        if key is None:
+            return
+        self.connection.execute(
+            'INSERT OR REPLACE INTO documents (user_id, hash, size, id, access_hash, file_reference, created) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.user_id,) + key + (document.id, document.access_hash, document.file_reference, time.time())
+        )
+        self.connection.commit()
+
+    def remove_document(self, file: 'File') -> None:
+        """Forget the document of the file content, for example if it can no longer be sent."""
+        key = self._file_keys.get(file)
+        if key is None:
+            return
+        self.connection.execute('DELETE FROM documents WHERE user_id = ? AND hash = ? AND size = ?',
+                                (self.user_id,) + key)
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
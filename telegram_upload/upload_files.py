@@ -1,25 +1,38 @@
+import collections
+import concurrent.futures
 import datetime
+import itertools
 import math
+import mmap
 import os
+import time
 
 
 import mimetypes
 from io import FileIO, SEEK_SET
-from typing import Union, TYPE_CHECKING
+from typing import Optional, Union, TYPE_CHECKING, Tuple, Iterable, Iterator
 
 import click
-from hachoir.metadata.metadata import RootMetadata
-from hachoir.metadata.video import MP4Metadata
 from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeFilename
 
 from telegram_upload.caption_formatter import CaptionFormatter, FilePath
 from telegram_upload.exceptions import TelegramInvalidFile, ThumbError
-from telegram_upload.utils import scantree, truncate
-from telegram_upload.video import get_video_thumb, video_metadata
+from telegram_upload.thumbnail_cache import ThumbnailCache
+from telegram_upload.utils import scantree, truncate, get_environment_integer
+from telegram_upload.video import get_video_thumb, probe_media
 
 mimetypes.init()
 
 
+USE_MMAP = bool(get_environment_integer('TELEGRAM_UPLOAD_MMAP', 0))
+# Telegram keeps the uploaded files less than a day
+UPLOAD_HANDLE_EXPIRATION = get_environment_integer('TELEGRAM_UPLOAD_HANDLE_EXPIRATION', 60 * 60 * 12)
+# Files prepared (thumbnail, attributes and caption) in worker threads while the current file is uploaded
+PREPARE_AHEAD_FILES = get_environment_integer('TELEGRAM_UPLOAD_PREPARE_AHEAD_FILES', 2)
+# Maximum size in MiB of the thumbnails cache. 0 disables the cache.
+THUMBNAIL_CACHE_SIZE = get_environment_integer('TELEGRAM_UPLOAD_THUMBNAIL_CACHE_SIZE', 100)
+
+
 if TYPE_CHECKING:
     from telegram_upload.client import TelegramManagerClient
 
@@ -39,40 +52,42 @@ def get_file_mime(file):
     return (mimetypes.guess_type(file)[0] or ('')).split('/')[0]
 
 
-def metadata_has(metadata: RootMetadata, key: str):
-    try:
-        return metadata.has(key)
-    except ValueError:
-        return False
-
-
 def get_file_attributes(file):
     attrs = []
     mime = get_file_mime(file)
     if mime == 'video':
-        metadata = video_metadata(file)
-        video_meta = metadata
-        meta_groups = None
-        if hasattr(metadata, '_MultipleMetadata__groups'):
-            # Is mkv
-            meta_groups = metadata._MultipleMetadata__groups
-        if metadata is not None and not metadata.has('width') and meta_groups:
-            video_meta = meta_groups[next(filter(lambda x: x.startswith('video'), meta_groups._key_list))]
-        if metadata is not None:
-            supports_streaming = isinstance(video_meta, MP4Metadata)
+        probe = probe_media(file)
+        if probe is not None:
             attrs.append(DocumentAttributeVideo(
-                (0, metadata.get('duration').seconds)[metadata_has(metadata, 'duration')],
-                (0, video_meta.get('width'))[metadata_has(video_meta, 'width')],
-                (0, video_meta.get('height'))[metadata_has(video_meta, 'height')],
+                probe.duration,
+                probe.width or 0,
+                probe.height or 0,
                 False,
-                supports_streaming,
+                probe.supports_streaming,
             ))
     return attrs
 
 
+_thumbnail_cache: Optional[ThumbnailCache] = None
+
+
+def get_thumbnail_cache() -> Optional[ThumbnailCache]:
+    """Cache of the thumbnails of the videos. None if it is disabled or it cannot be created."""
+    global _thumbnail_cache, THUMBNAIL_CACHE_SIZE
+    if _thumbnail_cache is None and THUMBNAIL_CACHE_SIZE > 0:
+        try:
+            _thumbnail_cache = ThumbnailCache(max_size=THUMBNAIL_CACHE_SIZE * 1024 * 1024)
+        except OSError:
+            THUMBNAIL_CACHE_SIZE = 0
+    return _thumbnail_cache
+
+
 def get_file_thumb(file):
     if get_file_mime(file) == 'video':
-        return get_video_thumb(file)
+        thumbnail_cache = get_thumbnail_cache()
+        if thumbnail_cache is None:
+            return get_video_thumb(file)
+        return thumbnail_cache.get_thumbnail(file, get_video_thumb)
 
 
 class UploadFilesBase:
@@ -89,7 +104,9 @@ class UploadFilesBase:
         raise NotImplementedError
 
     def __iter__(self):
-        self._iterator = self.get_iterator()
+        # The iteration continues if it has already started (for example, iter() is called by islice)
+        if self._iterator is None:
+            self._iterator = self.get_iterator()
         return self
 
     def __next__(self):
@@ -140,6 +157,12 @@ class NoLargeFiles(LargeFilesBase):
 
 class File(FileIO):
     force_file = False
+    use_mmap = USE_MMAP
+    # Values computed in advance by prepare()
+    _prepared_attributes = None
+    _prepared_caption = None
+    _prepared_thumbnail = None
+    _thumbnail_prepared = False
 
     def __init__(self, client: 'TelegramManagerClient', path: str, force_file: Union[bool, None] = None,
                  thumbnail: Union[str, bool, None] = None, caption: Union[str, None] = None):
@@ -149,6 +172,52 @@ class File(FileIO):
         self.force_file = self.force_file if force_file is None else force_file
         self._thumbnail = thumbnail
         self._caption = caption
+        self._mmaps = []
+        # Retry accounting of the last upload of the file
+        self.upload_retries = None
+        self._upload_handle = None
+        self._upload_handle_time = 0.0
+
+    def get_pending_range(self) -> Tuple[int, int]:
+        """Start and length of the bytes pending to read."""
+        start = self.tell()
+        return start, self.file_size - start
+
+    def get_mapped_view(self) -> memoryview:
+        """Map in memory the bytes pending to read. The pages are read by the kernel on demand,
+        so the parts can be served as slices of the view without copying them to a buffer.
+        The file position is not modified.
+        """
+        start, length = self.get_pending_range()
+        # The offset of the mapping must be a multiple of the allocation granularity
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(self.fileno(), length + start - offset, access=mmap.ACCESS_READ, offset=offset)
+        if hasattr(mapping, 'madvise'):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        self._mmaps.append(mapping)
+        return memoryview(mapping)[start - offset:]
+
+    def get_upload_handle(self):
+        """InputFile or InputFileBig of the last upload of the file, if it can still be used to send
+        the file without uploading it again.
+        """
+        if self._upload_handle is not None and \
+                time.monotonic() - self._upload_handle_time < UPLOAD_HANDLE_EXPIRATION:
+            return self._upload_handle
+
+    def set_upload_handle(self, handle) -> None:
+        """Remember the handle of the file uploaded. Use None to forget it."""
+        self._upload_handle = handle
+        self._upload_handle_time = time.monotonic()
+
+    def close(self) -> None:
+        for mapping in getattr(self, '_mmaps', []):
+            try:
+                mapping.close()
+            except BufferError:
+                # There are views of the mapping in use. It will be closed when they are released.
+                pass
+        super().close()
 
     @property
     def file_name(self):
@@ -166,12 +235,35 @@ class File(FileIO):
     def is_custom_thumbnail(self):
         return self._thumbnail is not False and self._thumbnail is not None
 
+    def prepare(self, thumbnail: bool = True) -> None:
+        """Compute the attributes, the caption and the thumbnail of the file in advance, so they are
+        not computed when the file is sent. It can be called from a worker thread.
+
+        :param thumbnail: Generate the thumbnail too. It is returned once by get_thumbnail.
+        """
+        if self._prepared_attributes is None:
+            self._prepared_attributes = self.file_attributes
+        if self._prepared_caption is None:
+            self._prepared_caption = self.file_caption
+        if thumbnail and not self._thumbnail_prepared:
+            self._prepared_thumbnail = self._create_thumbnail()
+            self._thumbnail_prepared = True
+
+    def clear_prepared(self) -> None:
+        """Discard the thumbnail prepared and not used."""
+        if self._prepared_thumbnail is not None:
+            self.remove_thumbnail(self._prepared_thumbnail)
+        self._prepared_thumbnail = None
+        self._thumbnail_prepared = False
+
     @property
     def file_caption(self) -> str:
         """Get file caption. If caption parameter is not set, return file name.
         If caption is set, format it with CaptionFormatter.
         Anyways, truncate caption to max_caption_length.
         """
+        if self._prepared_caption is not None:
+            return self._prepared_caption
         if self._caption is not None:
             formatter = CaptionFormatter()
             caption = formatter.format(self._caption, file=FilePath(self.path), now=datetime.datetime.now())
@@ -179,7 +271,27 @@ class File(FileIO):
             caption = self.short_name
         return truncate(caption, self.client.max_caption_length)
 
+    def remove_thumbnail(self, thumb: Optional[str]) -> None:
+        """Remove a thumbnail returned by get_thumbnail after using it. The custom thumbnails and the
+        thumbnails of the cache are not removed.
+        """
+        if not thumb or self.is_custom_thumbnail:
+            return
+        if _thumbnail_cache is not None and _thumbnail_cache.is_cached(thumb):
+            return
+        if os.path.lexists(thumb):
+            os.remove(thumb)
+
     def get_thumbnail(self):
+        if self._thumbnail_prepared:
+            # The caller removes the thumbnail after using it
+            thumb = self._prepared_thumbnail
+            self._prepared_thumbnail = None
+            self._thumbnail_prepared = False
+            return thumb
+        return self._create_thumbnail()
+
+    def _create_thumbnail(self):
         thumb = None
         if self._thumbnail is None and not self.force_file:
             try:
@@ -196,6 +308,8 @@ class File(FileIO):
 
     @property
     def file_attributes(self):
+        if self._prepared_attributes is not None:
+            return self._prepared_attributes
         if self.force_file:
             return [DocumentAttributeFilename(self.file_name)]
         else:
@@ -220,6 +334,14 @@ class SplitFile(File, FileIO):
         self.remaining_size -= size
         return super().read(size)
 
+    def readinto(self, buffer) -> int:
+        if not self.remaining_size:
+            return 0
+        view = memoryview(buffer)[:self.remaining_size]
+        size = super().readinto(view)
+        self.remaining_size -= size
+        return size
+
     def readall(self) -> bytes:
         return self.read()
 
@@ -231,10 +353,15 @@ class SplitFile(File, FileIO):
     def file_size(self):
         return self.max_read_size
 
+    def get_pending_range(self) -> Tuple[int, int]:
+        return self.tell(), self.remaining_size
+
     def seek(self, offset: int, whence: int = SEEK_SET, split_seek: bool = False) -> int:
+        previous = self.tell()
+        position = super().seek(offset, whence)
         if not split_seek:
-            self.remaining_size += self.tell() - offset
-        return super().seek(offset, whence)
+            self.remaining_size += previous - position
+        return position
 
     @property
     def short_name(self):
@@ -252,3 +379,46 @@ class SplitFiles(LargeFilesBase):
             splitted_file = SplitFile(self.client, file, size, '{}.{}'.format(file_name, str(part).zfill(zfill)))
             splitted_file.seek(self.client.max_file_size * part, split_seek=True)
             yield splitted_file
+
+
+def group_split_files(files: Iterable[File]) -> Iterator[Tuple[File, ...]]:
+    """Group the consecutive parts of the same split file. The other files are in a group alone."""
+    groups = itertools.groupby(files, key=lambda file: file.path if isinstance(file, SplitFile) else file)
+    for _, group in groups:
+        yield tuple(group)
+
+
+def prepare_files(files: Iterable[File], ahead: int = PREPARE_AHEAD_FILES, thumbnail: bool = True) -> Iterator[File]:
+    """Prepare the next files in worker threads while the current file is uploaded. The files are
+    yielded in their order once prepared. The thumbnails prepared for the files not yielded are removed.
+
+    :param files: Files to prepare.
+    :param ahead: Files prepared ahead of the file being uploaded. 0 disables the preparation.
+    :param thumbnail: Generate the thumbnails too.
+    """
+    if ahead < 1:
+        yield from files
+        return
+    files = iter(files)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(ahead, thread_name_prefix='telegram-upload-prepare') as executor:
+        try:
+            while True:
+                # The file to yield and the files ahead of it
+                while len(pending) <= ahead:
+                    file = next(files, None)
+                    if file is None:
+                        break
+                    future = executor.submit(file.prepare, thumbnail) if isinstance(file, File) else None
+                    pending.append((file, future))
+                if not pending:
+                    return
+                file, future = pending.popleft()
+                if future is not None:
+                    future.result()
+                yield file
+        finally:
+            for file, future in pending:
+                if future is not None and not future.cancel():
+                    concurrent.futures.wait([future])
+                    file.clear_prepared()
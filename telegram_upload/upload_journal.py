@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Optional, Set
+
+from telethon import helpers
+
+from telegram_upload.config import CACHE_DIRECTORY
+from telegram_upload.utils import get_environment_integer
+
+if TYPE_CHECKING:
+    from telegram_upload.upload_files import File
+
+
+UPLOAD_JOURNAL_DIRECTORY = os.path.join(CACHE_DIRECTORY, 'uploads')
+# Telegram keeps the uploaded parts less than a day
+UPLOAD_JOURNAL_EXPIRATION = get_environment_integer('TELEGRAM_UPLOAD_JOURNAL_EXPIRATION', 60 * 60 * 12)
+RESUME_UPLOADS = bool(get_environment_integer('TELEGRAM_UPLOAD_RESUME_UPLOADS', 1))
+
+
+def get_journal_key(file: 'File') -> str:
+    """Key of the journal of a file. It changes if the file is modified."""
+    stat = os.stat(file.path)
+    key = [os.path.realpath(file.path), stat.st_size, stat.st_mtime_ns, file.file_name, file.file_size]
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+class UploadJournal:
+    """On-disk journal of an upload. The first line contains the file id, the part size and the part
+    count of the upload, and a line is appended with the index of each part acknowledged by Telegram.
+    If the upload is interrupted, the next upload of the same file reuses the file id and sends only
+    the missing parts.
+    """
+    def __init__(self, path: str, file_id: int, part_size: int, part_count: int, created: float,
+                 parts: Optional[Set[int]] = None):
+        self.path = path
+        self.file_id = file_id
+        self.part_size = part_size
+        self.part_count = part_count
+        self.created = created
+        self.parts = parts or set()
+        self._file = None
+
+    @property
+    def header(self) -> dict:
+        return {'file_id': self.file_id, 'part_size': self.part_size, 'part_count': self.part_count,
+                'created': self.created}
+
+    @classmethod
+    def load(cls, path: str) -> Optional['UploadJournal']:
+        """Load a journal from disk. None is returned if the journal does not exist or it is invalid."""
+        try:
+            with open(path) as file:
+                header = json.loads(file.readline())
+                parts = {int(line) for line in file if line.strip().isdigit()}
+            return cls(path, header['file_id'], header['part_size'], header['part_count'], header['created'],
+                       parts)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @classmethod
+    def open(cls, file: 'File', part_size: int, part_count: int,
+             directory: Optional[str] = None) -> 'UploadJournal':
+        """Get the journal of a previous upload of the file if it can be resumed. Otherwise, a new
+        journal with a new file id is created.
+        """
+        directory = directory or UPLOAD_JOURNAL_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+        cls.clean(directory)
+        path = os.path.join(directory, '{}.journal'.format(get_journal_key(file)))
+        journal = cls.load(path)
+        if journal is None or journal.is_expired or (journal.part_size, journal.part_count) != (part_size, part_count):
+            journal = cls(path, helpers.generate_random_long(), part_size, part_count, time.time())
+            with open(path, 'w') as f:
+                f.write(json.dumps(journal.header) + '\n')
+        return journal
+
+    @classmethod
+    def clean(cls, directory: Optional[str] = None) -> None:
+        """Remove the journals of the uploads that can no longer be resumed."""
+        for entry in os.scandir(directory or UPLOAD_JOURNAL_DIRECTORY):
+            if entry.name.endswith('.journal') and \
+                    time.time() - entry.stat().st_mtime > UPLOAD_JOURNAL_EXPIRATION:
+                os.remove(entry.path)
+
+    @property
+    def is_expired(self) -> bool:
+        return time.time() - self.created > UPLOAD_JOURNAL_EXPIRATION
+
+    @property
+    def missing_parts(self):
+        """Indexes of the parts not acknowledged yet, in order."""
+        return [part_index for part_index in range(self.part_count) if part_index not in self.parts]
+
+    def add(self, part_index: int) -> None:
+        """Register a part acknowledged by Telegram."""
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self.parts.add(part_index)
+        self._file.write('{}\n'.format(part_index))
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """Remove the journal after the upload is completed."""
+        self.close()
+        if os.path.lexists(self.path):
+            os.remove(self.path)
@@ -23,6 +23,26 @@ def grouper(n, iterable):
         yield chunk
 
 
+def size_grouper(n, files, max_size):
+    """Group the files in chunks of up to n files, in order. The files larger than max_size
+    are in a chunk alone.
+    """
+    chunk = []
+    for file in files:
+        if file.file_size > max_size:
+            if chunk:
+                yield tuple(chunk)
+                chunk = []
+            yield (file,)
+            continue
+        chunk.append(file)
+        if len(chunk) >= n:
+            yield tuple(chunk)
+            chunk = []
+    if chunk:
+        yield tuple(chunk)
+
+
 def sizeof_fmt(num, suffix='B'):
     for unit in ['','Ki','Mi','Gi','Ti','Pi','Ei','Zi']:
         if abs(num) < 1024.0:
@@ -48,6 +68,20 @@ def async_to_sync(coro):
         return loop.run_until_complete(coro)
 
 
+async def iterate_in_executor(iterable):
+    """Iterate a blocking iterable in worker threads, so the event loop is not blocked while the next
+    item is obtained (for example, while the directories are listed or the files are hashed).
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
 async def aislice(iterator, limit):
     items = []
     i = 0
@@ -1,21 +1,212 @@
+import contextlib
+import functools
 import platform
 import re
+import sqlite3
 import subprocess
 import tempfile
+import threading
 import os
+from typing import Optional, Tuple
 
 from hachoir.metadata import extractMetadata
+from hachoir.metadata.metadata import RootMetadata
+from hachoir.metadata.video import MP4Metadata
 from hachoir.parser import createParser
 from hachoir.core import config as hachoir_config
+from hachoir.core.log import log as hachoir_log
 
 from telegram_upload.exceptions import ThumbVideoError
+from telegram_upload.metadata_cache import FileKey, MetadataCache, get_file_key
+from telegram_upload.utils import get_environment_integer
 
 
 hachoir_config.quiet = True
 
+# Media probes kept in memory, by file path, device, inode, size and modification time
+MEDIA_PROBE_CACHE_SIZE = get_environment_integer('TELEGRAM_UPLOAD_MEDIA_PROBE_CACHE_SIZE', 1024)
+# Save the media probes in the metadata cache, so the files are not parsed again in the next runs
+METADATA_CACHE = bool(get_environment_integer('TELEGRAM_UPLOAD_METADATA_CACHE', 1))
+# Maximum MiB read from a file to get its metadata. 0 disables the limit.
+METADATA_READ_SIZE = get_environment_integer('TELEGRAM_UPLOAD_METADATA_READ_SIZE', 16)
+MEDIA_TAGS = ('title', 'artist', 'album', 'producer')
 
-def video_metadata(file):
-    return extractMetadata(createParser(file))
+
+class MetadataReadLimitError(IOError):
+    pass
+
+
+class LimitedReader:
+    """Binary file that can only read up to limit bytes in total. The seeks are allowed, so the
+    parsers can read the headers at the start and the indexes at the end of the large files without
+    reading the rest of the file.
+    """
+    def __init__(self, file, limit: int):
+        self.file = file
+        self.name = file.name
+        self.limit = limit
+        self.read_bytes = 0
+        self.limit_reached = False
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or self.read_bytes + size > self.limit:
+            self.limit_reached = True
+            raise MetadataReadLimitError('The limit of {} bytes to read the metadata of {} has been '
+                                         'reached'.format(self.limit, self.name))
+        data = self.file.read(size)
+        self.read_bytes += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+_quiet_parses = 0
+_quiet_parses_lock = threading.Lock()
+# Value of hachoir_log.use_print before the first parse
+_hachoir_use_print = True
+
+
+@contextlib.contextmanager
+def quiet_hachoir_log():
+    """Do not show the errors of hachoir during the parse. The parse errors, such as the read limit
+    of the metadata, leave the fields missing. The previous setting is restored after the last parse.
+    """
+    global _quiet_parses, _hachoir_use_print
+    with _quiet_parses_lock:
+        if not _quiet_parses:
+            _hachoir_use_print = hachoir_log.use_print
+        _quiet_parses += 1
+        hachoir_log.use_print = False
+    try:
+        yield
+    finally:
+        with _quiet_parses_lock:
+            _quiet_parses -= 1
+            if not _quiet_parses:
+                hachoir_log.use_print = _hachoir_use_print
+
+
+def read_metadata(file, read_size: int = METADATA_READ_SIZE) -> Tuple[Optional[RootMetadata], bool]:
+    """Metadata of the media file and whether the whole metadata has been read. The parsing stops
+    after reading read_size MiB of the file (0 for no limit), and the metadata extracted until then
+    is returned. The metadata is None if the file is not a known media file.
+    """
+    if not read_size:
+        return extractMetadata(createParser(file)), True
+    with open(file, 'rb') as input_file, quiet_hachoir_log():
+        reader = LimitedReader(input_file, read_size * 1024 * 1024)
+        try:
+            parser = createParser(reader)
+        except MetadataReadLimitError:
+            return None, False
+        # The errors of the extraction, such as the read limit, are ignored by hachoir
+        metadata = parser and extractMetadata(parser)
+        return metadata, not reader.limit_reached
+
+
+def video_metadata(file, read_size: int = METADATA_READ_SIZE) -> Optional[RootMetadata]:
+    """Metadata of the media file. See read_metadata."""
+    return read_metadata(file, read_size)[0]
+
+
+def metadata_has(metadata: RootMetadata, key: str):
+    try:
+        return metadata.has(key)
+    except ValueError:
+        return False
+
+
+class MediaProbe:
+    """Media information of a file: the duration, the size of the video, the streaming support and
+    the tags used by the captions. It is obtained from a single parse of the file, and it is used by
+    the thumbnails, the video attributes and the captions.
+    """
+    def __init__(self, duration: int = 0, width: Optional[int] = None, height: Optional[int] = None,
+                 supports_streaming: bool = False, **tags: Optional[str]):
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.supports_streaming = supports_streaming
+        self.tags = {key: value for key, value in tags.items() if value is not None}
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[RootMetadata]) -> Optional['MediaProbe']:
+        if metadata is None:
+            return None
+        video_meta = metadata
+        meta_groups = getattr(metadata, '_MultipleMetadata__groups', None)
+        if not metadata_has(metadata, 'width') and meta_groups:
+            # Is mkv. The size is in the video stream.
+            video_key = next(filter(lambda x: x.startswith('video'), meta_groups._key_list), None)
+            if video_key is not None:
+                video_meta = meta_groups[video_key]
+        return cls(
+            metadata.get('duration').seconds if metadata_has(metadata, 'duration') else 0,
+            video_meta.get('width') if metadata_has(video_meta, 'width') else None,
+            video_meta.get('height') if metadata_has(video_meta, 'height') else None,
+            isinstance(video_meta, MP4Metadata),
+            **{key: metadata.get(key) for key in MEDIA_TAGS if metadata_has(metadata, key)}
+        )
+
+    def to_dict(self) -> dict:
+        return dict(duration=self.duration, width=self.width, height=self.height,
+                    supports_streaming=self.supports_streaming, **self.tags)
+
+
+_metadata_cache: Optional[MetadataCache] = None
+
+
+def get_metadata_cache() -> Optional[MetadataCache]:
+    """Metadata cache of the media probes. None if it is disabled or it cannot be opened."""
+    global _metadata_cache, METADATA_CACHE
+    if _metadata_cache is None and METADATA_CACHE:
+        try:
+            _metadata_cache = MetadataCache()
+        except (OSError, sqlite3.Error):
+            METADATA_CACHE = False
+    return _metadata_cache
+
+
+@functools.lru_cache(maxsize=MEDIA_PROBE_CACHE_SIZE)
+def _probe_media_file(file: str, key: FileKey) -> Optional[MediaProbe]:
+    metadata_cache = get_metadata_cache()
+    values = None
+    if metadata_cache is not None:
+        try:
+            values = metadata_cache.get(key, METADATA_READ_SIZE)
+        except (sqlite3.Error, ValueError):
+            pass
+    if values is not None:
+        return MediaProbe(**values) if values else None
+    metadata, complete = read_metadata(file, METADATA_READ_SIZE)
+    probe = MediaProbe.from_metadata(metadata)
+    if metadata_cache is not None:
+        try:
+            # The probes of the parses stopped by the read limit are saved with the limit. The file
+            # is parsed again if a greater limit is used later.
+            metadata_cache.set(key, probe and probe.to_dict(), 0 if complete else METADATA_READ_SIZE)
+        except sqlite3.Error:
+            pass
+    return probe
+
+
+def probe_media(file: str) -> Optional[MediaProbe]:
+    """Media information of the file. The file is parsed once while it is not modified: the probes
+    are kept in memory and in the metadata cache, by device, inode, size and modification time. None
+    if the file is not a known media file.
+    """
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return MediaProbe.from_metadata(video_metadata(file))
+    return _probe_media_file(os.path.abspath(file), get_file_key(stat))
 
 
 def call_ffmpeg(args):
@@ -45,11 +236,15 @@ def get_video_size(file):
 
 def get_video_thumb(file, output=None, size=200):
     output = output or tempfile.NamedTemporaryFile(suffix='.jpg').name
-    metadata = video_metadata(file)
-    if metadata is None:
+    probe = probe_media(file)
+    if probe is None:
         return
-    duration = metadata.get('duration').seconds if metadata.has('duration') else 0
-    ratio = get_video_size(file)
+    duration = probe.duration
+    if probe.width and probe.height:
+        ratio = [probe.width, probe.height]
+    else:
+        # The size is not in the metadata of the container. Get it using ffmpeg.
+        ratio = get_video_size(file)
     if ratio is None:
         raise ThumbVideoError('Video ratio is not available.')
     if ratio[0] / ratio[1] > 1:
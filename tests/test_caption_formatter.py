@@ -7,6 +7,7 @@ from click.testing import CliRunner
 
 from telegram_upload.caption_formatter import Duration, FileSize, FileMedia, FilePath, CHUNK_SIZE, CaptionFormatter, \
     test_caption_format
+from telegram_upload.video import MediaProbe
 
 
 class TestDuration(unittest.TestCase):
@@ -92,106 +93,38 @@ class TestFileSize(unittest.TestCase):
 class TestFileMedia(unittest.TestCase):
     """Test the FileMedia class."""
 
-    @patch("telegram_upload.caption_formatter.video_metadata")
-    def setUp(self, mock_video_metadata: MagicMock) -> None:
+    @patch("telegram_upload.caption_formatter.probe_media")
+    def setUp(self, mock_probe_media: MagicMock) -> None:
         """Set up the test case."""
+        mock_probe_media.return_value = MediaProbe(123, 1920, 1080, True, title="Title", artist="Artist")
         self.file_media = FileMedia("video.mkv")
-        self.mock_metadata = self.file_media.metadata
-
-    @unittest.skipIf(sys.version_info < (3, 8), "Unsupported in Python 3.7")
-    def test_video_metadata(self):
-        """Test the video_metadata attribute."""
-        with self.subTest("Test mkv video"):
-            self.mock_metadata.has.return_value = False
-            self.mock_metadata._MultipleMetadata__groups._key_list = ["video meta", "audio meta"]
-            video_metadata = self.file_media.video_metadata
-            self.assertEqual(self.mock_metadata._MultipleMetadata__groups.__getitem__.return_value, video_metadata)
-            self.mock_metadata._MultipleMetadata__groups.__getitem__.assert_called_once_with("video meta")
-        with self.subTest("Test other formats"):
-            del self.mock_metadata._MultipleMetadata__groups
-            del self.file_media.__dict__["video_metadata"]  # clear cache
-            self.assertEqual(self.mock_metadata, self.file_media.video_metadata)
+        mock_probe_media.assert_called_once_with("video.mkv")
 
     def test_duration(self):
         """Test the duration attribute."""
-        self.mock_metadata.has.return_value = True
-        self.mock_metadata.get.return_value.seconds = 123
         self.assertEqual(Duration(123).seconds, self.file_media.duration.seconds)
-        self.mock_metadata.has.assert_called_once_with("duration")
-        self.mock_metadata.get.assert_called_once_with("duration")
-
-    @patch.object(FileMedia, "video_metadata")
-    def test_get_video_metadata(self, mock_video_metadata: MagicMock):
-        """Test the _get_video_metadata method."""
-        with self.subTest("Test with video metadata"):
-            self.assertEqual(mock_video_metadata.get.return_value, self.file_media._get_video_metadata("width"))
-            mock_video_metadata.get.assert_called_once_with("width")
-            mock_video_metadata.has.assert_called_once_with("width")
-        mock_video_metadata.reset_mock()
-        with self.subTest("Test without video metadata field"):
-            mock_video_metadata.has.return_value = False
-            self.assertIsNone(self.file_media._get_video_metadata("width"))
-            mock_video_metadata.get.assert_not_called()
-            mock_video_metadata.has.assert_called_once_with("width")
-        mock_video_metadata.reset_mock()
-        with self.subTest("Test without video metadata"):
-            mock_video_metadata.__bool__.return_value = False
-            mock_video_metadata.get.assert_not_called()
-            mock_video_metadata.has.assert_not_called()
+
+    def test_size(self):
+        """Test the width and height attributes."""
+        self.assertEqual(1920, self.file_media.width)
+        self.assertEqual(1080, self.file_media.height)
 
     def test_metadata(self):
         """Test the _get_metadata method."""
         with self.subTest("Test with metadata"):
-            self.assertEqual(self.mock_metadata.get.return_value, self.file_media._get_metadata("title"))
-            self.mock_metadata.get.assert_called_once_with("title")
-            self.mock_metadata.has.assert_called_once_with("title")
-        self.mock_metadata.reset_mock()
+            self.assertEqual("Title", self.file_media.title)
+            self.assertEqual("Artist", self.file_media.artist)
         with self.subTest("Test without metadata field"):
-            self.mock_metadata.has.return_value = False
-            self.assertIsNone(self.file_media._get_metadata("title"))
-            self.mock_metadata.get.assert_not_called()
-            self.mock_metadata.has.assert_called_once_with("title")
-        self.mock_metadata.reset_mock()
-        with self.subTest("Test without metadata"):
-            self.mock_metadata.__bool__.return_value = False
-            self.mock_metadata.get.assert_not_called()
-            self.mock_metadata.has.assert_not_called()
-
-    @patch.object(FileMedia, "_get_video_metadata")
-    def test_width(self, mock_get_video_metadata: MagicMock):
-        """Test the width attribute."""
-        self.assertEqual(mock_get_video_metadata.return_value, self.file_media.width)
-        mock_get_video_metadata.assert_called_once_with("width")
-
-    @patch.object(FileMedia, "_get_video_metadata")
-    def test_height(self, mock_get_video_metadata: MagicMock):
-        """Test the height attribute."""
-        self.assertEqual(mock_get_video_metadata.return_value, self.file_media.height)
-        mock_get_video_metadata.assert_called_once_with("height")
-
-    @patch.object(FileMedia, "_get_metadata")
-    def test_title(self, mock_get_metadata: MagicMock):
-        """Test the title attribute."""
-        self.assertEqual(mock_get_metadata.return_value, self.file_media.title)
-        mock_get_metadata.assert_called_once_with("title")
-
-    @patch.object(FileMedia, "_get_metadata")
-    def test_artist(self, mock_get_metadata: MagicMock):
-        """Test the artist attribute."""
-        self.assertEqual(mock_get_metadata.return_value, self.file_media.artist)
-        mock_get_metadata.assert_called_once_with("artist")
-
-    @patch.object(FileMedia, "_get_metadata")
-    def test_album(self, mock_get_metadata: MagicMock):
-        """Test the album attribute."""
-        self.assertEqual(mock_get_metadata.return_value, self.file_media.album)
-        mock_get_metadata.assert_called_once_with("album")
-
-    @patch.object(FileMedia, "_get_metadata")
-    def test_producer(self, mock_get_metadata: MagicMock):
-        """Test the producer attribute."""
-        self.assertEqual(mock_get_metadata.return_value, self.file_media.producer)
-        mock_get_metadata.assert_called_once_with("producer")
+            self.assertIsNone(self.file_media.album)
+            self.assertIsNone(self.file_media.producer)
+
+    @patch("telegram_upload.caption_formatter.probe_media", return_value=None)
+    def test_not_media(self, mock_probe_media: MagicMock):
+        """Test a file without media information."""
+        file_media = FileMedia("file.txt")
+        self.assertIsNone(file_media.duration)
+        self.assertIsNone(file_media.width)
+        self.assertIsNone(file_media.title)
 
 
 class TestFilePath(unittest.TestCase):
@@ -0,0 +1,71 @@
+import asyncio
+
+from telegram_upload.client.adaptive_semaphore import AdaptiveSemaphore
+
+try:
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from async_case import IsolatedAsyncioTestCase
+
+
+class TestAdaptiveSemaphore(IsolatedAsyncioTestCase):
+    async def test_acquire_release(self):
+        semaphore = AdaptiveSemaphore(1)
+        await semaphore.acquire()
+        self.assertTrue(semaphore.locked())
+        task = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        semaphore.release()
+        await task
+        self.assertEqual(1, semaphore.in_flight)
+
+    async def test_cancel_waiter(self):
+        semaphore = AdaptiveSemaphore(1)
+        await semaphore.acquire()
+        task1 = asyncio.create_task(semaphore.acquire())
+        task2 = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        semaphore.release()
+        task1.cancel()
+        await task2
+        self.assertEqual(1, semaphore.in_flight)
+
+    def test_increase(self):
+        semaphore = AdaptiveSemaphore(2, maximum=4)
+        for _ in range(4):
+            semaphore.increase(1.0)
+        self.assertEqual(3, semaphore.value)
+        for _ in range(20):
+            semaphore.increase(1.0)
+        self.assertEqual(4, semaphore.value)
+
+    def test_no_increase_higher_latency(self):
+        semaphore = AdaptiveSemaphore(2, maximum=4)
+        semaphore.increase(1.0)
+        for _ in range(10):
+            semaphore.increase(5.0)
+        self.assertEqual(2, semaphore.value)
+
+    def test_decrease(self):
+        semaphore = AdaptiveSemaphore(8, maximum=8)
+        self.assertTrue(semaphore.decrease())
+        self.assertEqual(4, semaphore.value)
+        semaphore.latency = 60
+        with self.subTest("Test decrease once per round trip"):
+            self.assertFalse(semaphore.decrease())
+            self.assertEqual(4, semaphore.value)
+        semaphore.latency = 0
+        semaphore.decrease()
+        semaphore.decrease()
+        semaphore.decrease()
+        self.assertEqual(1, semaphore.value)
+
+    async def test_increase_wakes_up(self):
+        semaphore = AdaptiveSemaphore(1, maximum=2)
+        await semaphore.acquire()
+        task = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        semaphore.increase(1.0)
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(2, semaphore.in_flight)
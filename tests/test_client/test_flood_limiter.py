@@ -0,0 +1,60 @@
+import time
+import unittest
+
+from unittest.mock import patch
+
+from telethon.errors import FloodWaitError
+from telethon.tl import functions, types
+
+from telegram_upload.client.flood_limiter import FloodWaitLimiter, get_request_chat
+
+try:
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from async_case import IsolatedAsyncioTestCase
+
+
+def send_media_request(chat_id: int) -> functions.messages.SendMediaRequest:
+    return functions.messages.SendMediaRequest(types.InputPeerChat(chat_id), types.InputMediaEmpty(), '')
+
+
+class TestGetRequestChat(unittest.TestCase):
+    def test_chat(self):
+        self.assertEqual(-1, get_request_chat(send_media_request(1)))
+
+    def test_without_chat(self):
+        self.assertIsNone(get_request_chat(functions.upload.SaveFilePartRequest(1, 0, b'')))
+
+
+class TestFloodWaitLimiter(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.limiter = FloodWaitLimiter()
+
+    def test_chat_flood_wait(self):
+        self.limiter.record(send_media_request(1), FloodWaitError(None, 10))
+        self.assertGreater(self.limiter.get_remaining(send_media_request(1)), 9)
+        # Other chats and other request classes are not affected
+        self.assertEqual(0, self.limiter.get_remaining(send_media_request(2)))
+        self.assertEqual(0, self.limiter.get_remaining(functions.upload.SaveFilePartRequest(1, 0, b'')))
+
+    def test_class_flood_wait(self):
+        part = functions.upload.SaveFilePartRequest(1, 0, b'')
+        self.limiter.record(part, FloodWaitError(None, 10))
+        self.assertGreater(self.limiter.get_remaining(functions.upload.SaveFilePartRequest(2, 1, b'')), 9)
+        self.assertEqual(0, self.limiter.get_remaining(send_media_request(1)))
+
+    def test_longest_wait(self):
+        request = send_media_request(1)
+        self.limiter.record(request, FloodWaitError(None, 10))
+        self.limiter.record(request, FloodWaitError(None, 5))
+        self.assertGreater(self.limiter.get_remaining(request), 9)
+
+    async def test_wait(self):
+        request = send_media_request(1)
+        self.limiter.record(request, FloodWaitError(None, 10))
+        now = time.monotonic()
+        with patch('telegram_upload.client.flood_limiter.time.monotonic', side_effect=[now, now + 10]), \
+                patch('telegram_upload.client.flood_limiter.asyncio.sleep') as mock_sleep:
+            await self.limiter.wait(request)
+        mock_sleep.assert_awaited_once()
+        self.assertAlmostEqual(10, mock_sleep.await_args[0][0], delta=0.1)
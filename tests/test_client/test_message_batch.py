@@ -0,0 +1,52 @@
+import asyncio
+from unittest.mock import Mock, patch
+
+from telegram_upload.client.message_batch import MessageBatch
+
+try:
+    from unittest.mock import AsyncMock
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from asyncmock import AsyncMock
+    from async_case import IsolatedAsyncioTestCase
+
+
+class TestMessageBatch(IsolatedAsyncioTestCase):
+    async def test_size(self):
+        send = Mock()
+        batch = MessageBatch(send, size=2)
+        for message in range(5):
+            await batch.add(message)
+        self.assertEqual([[0, 1], [2, 3]], [args[0] for args, kwargs in send.call_args_list])
+        self.assertEqual([4], batch.messages)
+
+    @patch('telegram_upload.client.message_batch.time')
+    async def test_interval(self, mock_time: Mock):
+        # Only the time of the batch is patched, not the time of the event loop
+        mock_time.monotonic.side_effect = [0, 0, 10, 11]
+        send = AsyncMock()
+        batch = MessageBatch(send, interval=10)
+        await batch.add(0)
+        send.assert_not_called()
+        await batch.add(1)
+        send.assert_awaited_once_with([0, 1])
+        self.assertEqual([], batch.messages)
+
+    async def test_timer(self):
+        send = AsyncMock()
+        batch = MessageBatch(send, interval=0.01)
+        await batch.add(0)
+        await asyncio.sleep(0.05)
+        # The batch is sent without new messages
+        send.assert_awaited_once_with([0])
+        await batch.flush()
+        send.assert_awaited_once()
+
+    async def test_flush(self):
+        send = AsyncMock()
+        batch = MessageBatch(send)
+        await batch.flush()
+        send.assert_not_called()
+        await batch.add(0)
+        await batch.flush()
+        send.assert_awaited_once_with([0])
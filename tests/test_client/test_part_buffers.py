@@ -0,0 +1,137 @@
+import asyncio
+import io
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from telethon.tl import functions
+
+from telegram_upload.client.part_buffers import BufferSaveFilePartRequest, BufferSaveBigFilePartRequest, \
+    PartBufferPool, PartReader, readinto_part
+
+try:
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from async_case import IsolatedAsyncioTestCase
+
+
+class TestBufferRequests(unittest.TestCase):
+    def test_save_file_part(self):
+        for size in (0, 3, 253, 254, 1024):
+            with self.subTest(size=size):
+                data = bytes(range(256)) * 4
+                data = data[:size]
+                view = memoryview(bytearray(data))
+                self.assertEqual(bytes(functions.upload.SaveFilePartRequest(1, 2, data)),
+                                 bytes(BufferSaveFilePartRequest(1, 2, view)))
+
+    def test_save_big_file_part(self):
+        data = b'\x01' * 1025
+        self.assertEqual(bytes(functions.upload.SaveBigFilePartRequest(1, 2, 3, data)),
+                         bytes(BufferSaveBigFilePartRequest(1, 2, 3, memoryview(bytearray(data)))))
+
+
+class TestPartBufferPool(IsolatedAsyncioTestCase):
+    async def test_reuse(self):
+        pool = PartBufferPool(1, 16)
+        buffer = await pool.acquire()
+        self.assertEqual(16, len(buffer))
+        pool.release(buffer)
+        self.assertIs(buffer, await pool.acquire())
+        self.assertEqual(1, pool.created)
+
+    async def test_wait_free_buffer(self):
+        pool = PartBufferPool(1, 16)
+        buffer = await pool.acquire()
+        task = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        pool.release(buffer)
+        self.assertIs(buffer, await asyncio.wait_for(task, 1))
+
+
+class TestReadintoPart(IsolatedAsyncioTestCase):
+    async def test_short_reads(self):
+        data = b'0123456789'
+        stream = io.BytesIO(data)
+        original_readinto = stream.readinto
+        stream = MagicMock(readinto=lambda view: original_readinto(view[:3]))
+        view = memoryview(bytearray(8))
+        self.assertEqual(8, await readinto_part(stream, view))
+        self.assertEqual(data[:8], bytes(view))
+
+    async def test_end_of_stream(self):
+        view = memoryview(bytearray(8))
+        self.assertEqual(4, await readinto_part(io.BytesIO(b'0123'), view))
+        self.assertEqual(b'0123', bytes(view[:4]))
+
+    async def test_read_fallback(self):
+        stream = MagicMock(spec=['read'], **{'read.side_effect': [b'0123', b'']})
+        view = memoryview(bytearray(8))
+        self.assertEqual(4, await readinto_part(stream, view))
+        self.assertEqual(b'0123', bytes(view[:4]))
+
+
+class TestPartReader(IsolatedAsyncioTestCase):
+    async def test_read_ahead(self):
+        for depth in (0, 2):
+            with self.subTest(depth=depth):
+                pool = PartBufferPool(4, 4)
+                async with PartReader(io.BytesIO(b'0123456789'), 4, range(3), pool, depth) as reader:
+                    parts = []
+                    for _ in range(3):
+                        buffer, part = await reader.next()
+                        parts.append(bytes(part))
+                        pool.release(buffer)
+                self.assertEqual([b'0123', b'4567', b'89'], parts)
+
+    async def test_skip_parts(self):
+        for depth in (0, 2):
+            with self.subTest(depth=depth):
+                pool = PartBufferPool(4, 4)
+                async with PartReader(io.BytesIO(b'0123456789'), 4, [0, 2], pool, depth) as reader:
+                    parts = []
+                    for _ in range(2):
+                        buffer, part = await reader.next()
+                        parts.append(bytes(part))
+                        pool.release(buffer)
+                self.assertEqual([b'0123', b'89'], parts)
+
+    async def test_error(self):
+        stream = MagicMock(**{'readinto.side_effect': OSError})
+        async with PartReader(stream, 4, range(3), PartBufferPool(4, 4), 2) as reader:
+            with self.assertRaises(OSError):
+                await reader.next()
+
+    async def test_close_waits_worker_read(self):
+        # The stream is not read after the reader is closed
+        started = threading.Event()
+        finish = threading.Event()
+        stream = io.BytesIO(b'0123456789')
+
+        def readinto(view):
+            started.set()
+            finish.wait(5)
+            return io.BytesIO.readinto(stream, view)
+
+        stream.readinto = readinto
+        pool = PartBufferPool(4, 4)
+        reader = PartReader(stream, 4, range(3), pool, 1)
+        reader._task = asyncio.get_running_loop().create_task(reader._read_ahead())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        asyncio.get_running_loop().call_later(0.05, finish.set)
+        await reader.close()
+        self.assertTrue(finish.is_set())
+        position = stream.tell()
+        await asyncio.sleep(0.05)
+        self.assertEqual(position, stream.tell())
+        self.assertEqual(len(pool._free), pool.created)
+
+    async def test_close(self):
+        pool = PartBufferPool(4, 4)
+        reader = PartReader(io.BytesIO(b'0123456789'), 4, range(3), pool, 2)
+        buffer, part = await reader.next()
+        await asyncio.sleep(0.01)
+        await reader.close()
+        pool.release(buffer)
+        self.assertEqual(len(pool._free), pool.created)
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+
+from telegram_upload.client.part_size import FixedPartSize, TieredPartSize, get_part_size_policy, parse_size, \
+    DEFAULT_PART_SIZE_POLICY
+from telegram_upload.exceptions import TelegramPartSizeError
+
+
+MiB = 1024 * 1024
+
+
+def benchmark_result(size: int, part_size: int, median: float) -> dict:
+    return {'size': size, 'parallel': 4, 'connections': 1, 'part_size': part_size,
+            'benchmark': {'minimum': median, 'maximum': median, 'average': median, 'median': median,
+                          'times': [median]}}
+
+
+class TestParseSize(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(512, parse_size('512'))
+        self.assertEqual(100 * 1024, parse_size('100K'))
+        self.assertEqual(20 * MiB, parse_size('20MiB'))
+        self.assertEqual(2 * 1024 * MiB, parse_size('2g'))
+
+    def test_invalid(self):
+        with self.assertRaises(TelegramPartSizeError):
+            parse_size('foo')
+
+
+class TestPartSizePolicies(unittest.TestCase):
+    def test_default(self):
+        self.assertEqual(128, DEFAULT_PART_SIZE_POLICY.get_upload_part_size(100 * MiB))
+        self.assertEqual(256, DEFAULT_PART_SIZE_POLICY.get_upload_part_size(100 * MiB + 1))
+        self.assertEqual(512, DEFAULT_PART_SIZE_POLICY.get_upload_part_size(1024 * MiB))
+        self.assertEqual(64, DEFAULT_PART_SIZE_POLICY.get_download_part_size(None))
+
+    def test_fixed(self):
+        policy = FixedPartSize(512)
+        self.assertEqual(512, policy.get_upload_part_size(MiB))
+        self.assertEqual(512, policy.get_download_part_size(MiB))
+        self.assertEqual(512, policy.get_download_part_size(None))
+
+    def test_max_upload_parts(self):
+        # The part size is increased up to 4000 parts
+        policy = FixedPartSize(64)
+        self.assertEqual(64, policy.get_upload_part_size(250 * MiB))
+        self.assertEqual(512, policy.get_upload_part_size(1024 * MiB + 1))
+        self.assertEqual(256, policy.get_upload_part_size(1000 * MiB))
+        self.assertEqual(512, policy.get_upload_part_size(4000 * MiB))
+
+    def test_invalid_part_size(self):
+        for part_size in [0, 100, 1024]:
+            with self.subTest(part_size=part_size), self.assertRaises(TelegramPartSizeError):
+                FixedPartSize(part_size)
+
+    def test_from_benchmark(self):
+        policy = TieredPartSize.from_benchmark([
+            benchmark_result(20 * MiB, 128, 3.0), benchmark_result(20 * MiB, 512, 2.0),
+            benchmark_result(200 * MiB, 256, 10.0), benchmark_result(200 * MiB, 512, 12.0),
+            {'size': 1, 'parallel': 4, 'connections': 1, 'benchmark': {}},
+        ])
+        self.assertEqual([(20 * MiB, 512), (None, 256)], policy.tiers)
+
+    def test_from_benchmark_without_results(self):
+        with self.assertRaises(TelegramPartSizeError):
+            TieredPartSize.from_benchmark([])
+
+
+class TestGetPartSizePolicy(unittest.TestCase):
+    def test_auto(self):
+        self.assertIs(DEFAULT_PART_SIZE_POLICY, get_part_size_policy(None))
+        self.assertIs(DEFAULT_PART_SIZE_POLICY, get_part_size_policy('auto'))
+
+    def test_fixed(self):
+        self.assertEqual(256, get_part_size_policy(256).part_size)
+        self.assertEqual(512, get_part_size_policy('512').part_size)
+
+    def test_tiered(self):
+        policy = get_part_size_policy('tiered:512,20M=128,200M=256')
+        self.assertEqual([(20 * MiB, 128), (200 * MiB, 256), (None, 512)], policy.tiers)
+
+    def test_benchmark(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump([benchmark_result(20 * MiB, 128, 1.0), benchmark_result(20 * MiB, 256, 2.0)], file)
+        try:
+            policy = get_part_size_policy('benchmark:{}'.format(file.name))
+        finally:
+            os.remove(file.name)
+        self.assertEqual([(None, 128)], policy.tiers)
+
+    def test_invalid(self):
+        for value in ['foo', 'tiered:20M=foo', 'benchmark:/does/not/exist.json']:
+            with self.subTest(value=value), self.assertRaises(TelegramPartSizeError):
+                get_part_size_policy(value)
@@ -0,0 +1,68 @@
+import collections
+import unittest
+
+from telethon.errors import FloodWaitError, RPCError, InvalidBufferError, UnauthorizedError
+
+from telegram_upload.client.retry_policy import RetryPolicy, UploadRetries, get_error_kind, TRANSPORT_ERROR, \
+    TOO_MANY_REQUESTS, FLOOD_WAIT, RPC_ERROR
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_can_retry(self):
+        policy = RetryPolicy(2, 1)
+        self.assertTrue(policy.can_retry(1))
+        self.assertFalse(policy.can_retry(2))
+
+    def test_get_wait(self):
+        policy = RetryPolicy(10, 2, max_wait=10)
+        for attempt, maximum in [(0, 2), (1, 4), (2, 8), (3, 10), (8, 10)]:
+            with self.subTest(attempt=attempt):
+                wait = policy.get_wait(attempt)
+                self.assertGreaterEqual(wait, maximum / 2)
+                self.assertLessEqual(wait, maximum)
+
+
+class TestGetErrorKind(unittest.TestCase):
+    def test_kinds(self):
+        self.assertEqual(TRANSPORT_ERROR, get_error_kind(ConnectionError()))
+        self.assertEqual(TOO_MANY_REQUESTS, get_error_kind(InvalidBufferError(b'\x53\xfe\xff\xff')))
+        self.assertEqual(FLOOD_WAIT, get_error_kind(FloodWaitError(None, 3)))
+        self.assertEqual(RPC_ERROR, get_error_kind(RPCError(None, 'INTERNAL', 500)))
+
+    def test_not_retried(self):
+        self.assertIsNone(get_error_kind(ValueError()))
+        self.assertIsNone(get_error_kind(UnauthorizedError(None, 'AUTH_KEY_UNREGISTERED')))
+        self.assertIsNone(get_error_kind(InvalidBufferError(b'\x6c\xfe\xff\xff')))
+
+
+class TestUploadRetries(unittest.TestCase):
+    def setUp(self) -> None:
+        self.policies = {kind: RetryPolicy(2, 0) for kind in [TRANSPORT_ERROR, TOO_MANY_REQUESTS, FLOOD_WAIT,
+                                                               RPC_ERROR]}
+
+    def test_policy_attempts(self):
+        retries = UploadRetries(policies=self.policies)
+        attempts = collections.Counter()
+        self.assertEqual(0, retries.get_retry_wait(ConnectionError(), attempts))
+        self.assertEqual(0, retries.get_retry_wait(ConnectionError(), attempts))
+        self.assertIsNone(retries.get_retry_wait(ConnectionError(), attempts))
+        # Other kinds have their own attempts
+        self.assertEqual(0, retries.get_retry_wait(RPCError(None, 'INTERNAL', 500), attempts))
+        self.assertEqual({TRANSPORT_ERROR: 3, RPC_ERROR: 1}, retries.failures)
+        self.assertEqual(3, retries.retries)
+
+    def test_budget(self):
+        retries = UploadRetries(budget=2, policies=self.policies)
+        self.assertEqual(0, retries.get_retry_wait(ConnectionError(), collections.Counter()))
+        self.assertEqual(0, retries.get_retry_wait(ConnectionError(), collections.Counter()))
+        self.assertTrue(retries.exhausted)
+        self.assertIsNone(retries.get_retry_wait(ConnectionError(), collections.Counter()))
+
+    def test_flood_wait(self):
+        retries = UploadRetries(policies=self.policies)
+        self.assertEqual(7, retries.get_retry_wait(FloodWaitError(None, 7), collections.Counter()))
+
+    def test_not_retried(self):
+        retries = UploadRetries(policies=self.policies)
+        self.assertIsNone(retries.get_retry_wait(ValueError(), collections.Counter()))
+        self.assertEqual({}, retries.failures)
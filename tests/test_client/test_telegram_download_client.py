@@ -36,6 +36,13 @@ class TestTelegramDownloadClient(unittest.TestCase):
         m.size = 0
         self.client.download_files('foo', [m])
 
+    def test_download_files_delete_on_success(self):
+        files = [Mock(size=0), Mock(size=0)]
+        self.client.download_media = Mock()
+        self.client.delete_messages = Mock()
+        self.client.download_files('foo', files, delete_on_success=True)
+        self.client.delete_messages.assert_called_once_with('foo', [file.message for file in files])
+
     def test_no_space_error(self):
         m = Mock()
         m.document.attributes = [DocumentAttributeFilename('download.png')]
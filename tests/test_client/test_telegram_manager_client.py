@@ -1,4 +1,7 @@
+import asyncio
 import json
+import os
+import threading
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 
@@ -10,9 +13,16 @@ from telegram_upload.client.telegram_manager_client import phone_match, parse_pr
     BOT_USER_MAX_FILE_SIZE, PREMIUM_USER_MAX_FILE_SIZE, USER_MAX_CAPTION_LENGTH, PREMIUM_USER_MAX_CAPTION_LENGTH
 from telegram_upload.config import SESSION_FILE
 from telegram_upload.exceptions import TelegramProxyError
+from telegram_upload.upload_files import SplitFiles
+
+try:
+    from unittest.mock import AsyncMock
+except ImportError:
+    from asyncmock import AsyncMock
 
 
 CONFIG_DATA = {'api_hash': '', 'api_id': ''}
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'logo.png')
 
 
 class TestPhoneMatch(unittest.TestCase):
@@ -121,3 +131,36 @@ class TestTelegramManagerClient(unittest.TestCase):
         with self.subTest("Test premium user max caption length"):
             mock_me.premium = True
             self.assertEqual(TelegramManagerClient(MagicMock()).max_caption_length, PREMIUM_USER_MAX_CAPTION_LENGTH)
+
+    @patch('telegram_upload.client.telegram_manager_client.USER_MAX_FILE_SIZE', 60000)
+    def test_send_split_files(self):
+        # The account is requested before the split files are iterated in worker threads or in the event loop
+        def get_me():
+            if threading.current_thread() is not threading.main_thread() or asyncio.get_event_loop().is_running():
+                raise RuntimeError('The asyncio event loop must not change after connection')
+            return MagicMock(premium=False, bot=False)
+
+        with self.subTest("Test concurrent files"):
+            client = self.get_client(get_me)
+            messages = client.send_files('foo', SplitFiles(client, [LOGO_PATH]), concurrent_files=2)
+            self.assertEqual(2, len(messages))
+            self.assertEqual(['logo.png.00', 'logo.png.01'],
+                             [c.args[0].file_name for c in client.upload_file.await_args_list])
+        with self.subTest("Test album"), \
+                patch.object(TelegramManagerClient, '_upload_album_media') as mock_upload_album_media, \
+                patch.object(TelegramManagerClient, '_send_album_media') as mock_send_album_media:
+            client = self.get_client(get_me)
+            mock_upload_album_media.side_effect = lambda entity, file, force_document: file.file_name
+            client.send_files_as_album('foo', SplitFiles(client, [LOGO_PATH]))
+            mock_send_album_media.assert_called_once_with('foo', ['logo.png.00', 'logo.png.01'])
+
+    @staticmethod
+    def get_client(get_me) -> TelegramManagerClient:
+        with patch('builtins.open', mock_open(read_data=json.dumps(CONFIG_DATA))), \
+                patch('telegram_upload.client.telegram_upload_client.TelegramClient.__init__', return_value=None):
+            client = TelegramManagerClient(MagicMock())
+        client.get_me = MagicMock(side_effect=get_me)
+        client.upload_file = AsyncMock()
+        client.send_file = AsyncMock()
+        client._check_remote_size = MagicMock()
+        return client
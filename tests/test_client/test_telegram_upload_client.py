@@ -1,16 +1,26 @@
+import asyncio
+import gc
+import hashlib
 import json
 import os
 import sys
+import tempfile
 import unittest
 
 from unittest.mock import patch, mock_open, Mock, MagicMock, call
 
-from telethon import types
-from telethon.errors import FloodWaitError, RPCError
+from telethon import types, functions
+from telethon.errors import FloodWaitError, RPCError, FileReferenceExpiredError
+from telethon.sessions import MemorySession
 
+from telegram_upload.client.adaptive_semaphore import AdaptiveSemaphore
+from telegram_upload.client.flood_limiter import FloodWaitLimiter
+from telegram_upload.client.retry_policy import UploadRetries, RetryPolicy, TRANSPORT_ERROR, RPC_ERROR
 from telegram_upload.client.telegram_upload_client import TelegramUploadClient
-from telegram_upload.exceptions import TelegramUploadDataLoss, MissingFileError
-from telegram_upload.upload_files import File
+from telegram_upload.client.upload_senders import UploadSenderPool
+from telegram_upload.exceptions import TelegramUploadDataLoss, MissingFileError, TelegramUploadPartError
+from telegram_upload.file_ids import UploadedFile
+from telegram_upload.upload_files import File, SplitFile
 
 
 try:
@@ -37,18 +47,58 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
     def setUp(self, m1) -> None:
         self.upload_file_path = os.path.abspath(os.path.join(directory, 'logo.png'))
         self.client = TelegramUploadClient(Mock(), Mock(), Mock())
+        self.client._flood_waited_requests = {}
         self.client.send_file = Mock()
         self.client.send_file.return_value.media.document.size = os.path.getsize(self.upload_file_path)
 
-    @patch("telegram_upload.client.telegram_upload_client.TelegramUploadClient.forward_messages")
-    def test_forward_to(self, mock_forward_messages: MagicMock):
-        mock_message = MagicMock()
-        mock_destinations = [MagicMock(), MagicMock()]
-        self.client.forward_to(mock_message, mock_destinations)
-        mock_forward_messages.assert_has_calls([
-            call(mock_destinations[0], [mock_message]),
-            call(mock_destinations[1], [mock_message]),
-        ])
+    def test_filter_existing_files(self):
+        with open(self.upload_file_path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        file_size = os.path.getsize(self.upload_file_path)
+
+        def message(name, size, caption=''):
+            return MagicMock(file=MagicMock(size=size), message=caption, **{'file.name': name})
+
+        files = [File(MagicMock(), self.upload_file_path), File(MagicMock(), __file__)]
+        for subtest, messages, expected in [
+            ("Test same name and size", [message('logo.png', file_size)], [files[1]]),
+            ("Test other size", [message('logo.png', file_size + 1)], files),
+            ("Test same hash", [message('logo.png', file_size, f'logo {digest}')], [files[1]]),
+            ("Test other hash", [message('logo.png', file_size, f'logo {"0" * 32}')], files),
+        ]:
+            with self.subTest(subtest):
+                self.client.iter_messages = MagicMock(return_value=messages)
+                self.assertEqual(expected, list(self.client.filter_existing_files('foo', files)))
+                self.client.iter_messages.assert_called_once_with('foo', filter=types.InputMessagesFilterDocument)
+        for file in files:
+            file.close()
+
+    def test_filter_existing_files_event_loop(self):
+        # The chat is scanned before the files are iterated in the event loop
+        file_size = os.path.getsize(self.upload_file_path)
+
+        def iter_messages(entity, **kwargs):
+            if asyncio.get_event_loop().is_running():
+                raise RuntimeError('You must use "async for" if the event loop is running')
+            return [MagicMock(file=MagicMock(size=file_size), message='', **{'file.name': 'logo.png'})]
+
+        self.client.iter_messages = MagicMock(side_effect=iter_messages)
+        self.client._check_remote_size = MagicMock()
+        with self.subTest("Test concurrent files"):
+            files = [File(MagicMock(max_caption_length=200), path) for path in [self.upload_file_path, __file__]]
+            self.client.upload_file = AsyncMock()
+            self.client.send_file = AsyncMock()
+            messages = self.client.send_files('foo', self.client.filter_existing_files('foo', files),
+                                              concurrent_files=2)
+            self.assertEqual(1, len(messages))
+            self.assertEqual([files[1]], [c.args[0] for c in self.client.upload_file.await_args_list])
+        with self.subTest("Test album"), \
+                patch.object(TelegramUploadClient, '_upload_album_media') as mock_upload_album_media, \
+                patch.object(TelegramUploadClient, '_send_album_media') as mock_send_album_media:
+            files = [File(MagicMock(max_caption_length=200), path) for path in [self.upload_file_path, __file__]]
+            mock_upload_album_media.side_effect = lambda entity, file, force_document: file
+            self.client.send_files_as_album('foo', self.client.filter_existing_files('foo', files))
+            mock_send_album_media.assert_called_once_with('foo', [files[1]])
 
     async def test_send_album_media(self):
         self.client.get_input_entity = AsyncMock()
@@ -64,17 +114,81 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
             self.client.get_input_entity.return_value,
         )
 
-    @patch('telegram_upload.client.telegram_upload_client.TelegramUploadClient.send_files')
+    @patch('telegram_upload.client.telegram_upload_client.TelegramUploadClient._upload_album_media')
     @patch('telegram_upload.client.telegram_upload_client.TelegramUploadClient._send_album_media')
     @unittest.skipIf(sys.version_info < (3, 8), "TypeError: An asyncio.Future, a coroutine or an awaitable is required")
-    def test_send_files_as_album(self, mock_send_album_media: MagicMock, mock_send_files: MagicMock):
+    def test_send_files_as_album(self, mock_send_album_media: MagicMock, mock_upload_album_media: MagicMock):
         entity = "entity"
         mock_files = [MagicMock(), MagicMock()]
+        mock_upload_album_media.side_effect = lambda entity, file, force_document: file.media
         self.client.send_files_as_album(entity, mock_files)
-        mock_send_files.assert_called_once_with(
-            entity, tuple(mock_files), False, False, (), send_as_media=True
+        mock_upload_album_media.assert_has_calls([call(entity, mock_files[0], False),
+                                                   call(entity, mock_files[1], False)])
+        mock_send_album_media.assert_called_once_with(entity, [file.media for file in mock_files])
+
+    @patch('telegram_upload.client.telegram_upload_client.ALBUM_FILES', 2)
+    async def test_send_albums_overlap(self):
+        events = []
+        album_sent = asyncio.Event()
+
+        async def upload_album_media(entity, file, force_document):
+            events.append(('upload', file))
+            if file in (3, 4):
+                # The uploads of the next album start before the first album is sent
+                self.assertFalse(album_sent.is_set())
+            return file
+
+        async def send_album_media(entity, media):
+            events.append(('send', media))
+            await asyncio.sleep(0)
+            album_sent.set()
+            return media
+
+        self.client._upload_album_media = upload_album_media
+        self.client._send_album_media = send_album_media
+        self.client._process_sent_file = MagicMock()
+        messages = await self.client._send_albums('foo', [1, 2, 3, 4, 5])
+        self.assertEqual([1, 2, 3, 4, 5], messages)
+        self.assertEqual([('send', [1, 2]), ('send', [3, 4]), ('send', [5])],
+                         [event for event in events if event[0] == 'send'])
+        self.assertEqual(5, len([event for event in events if event[0] == 'upload']))
+
+    @patch('telegram_upload.client.telegram_upload_client.GROUP_DOCUMENTS_MAX_SIZE', 100)
+    async def test_send_albums_documents(self):
+        files = [MagicMock(file_size=10), MagicMock(file_size=200), MagicMock(file_size=10), MagicMock(file_size=10)]
+        self.client._upload_album_media = AsyncMock(side_effect=lambda entity, file, force_document: file)
+        self.client._send_album_media = AsyncMock(side_effect=lambda entity, media: media)
+        self.client._process_sent_file = MagicMock()
+        await self.client._send_albums('foo', files, force_document=True)
+        self.assertEqual([call('foo', [files[0]]), call('foo', [files[1]]), call('foo', files[2:])],
+                         self.client._send_album_media.await_args_list)
+        self.assertTrue(all(c.args[2] for c in self.client._upload_album_media.await_args_list))
+
+    async def test_send_media_document(self):
+        file = File(MagicMock(max_caption_length=200), self.upload_file_path, caption='logo caption')
+        self.client.get_input_entity = AsyncMock()
+        self.client._file_to_media = AsyncMock(return_value=(None, types.InputMediaUploadedDocument(
+            types.InputFile(1, 1, 'logo.png', ''), 'image/png', []), False))
+        self.client._call = AsyncMock()
+        self.client._sender = MagicMock()
+        with patch('telegram_upload.client.telegram_upload_client.utils') as mock_utils:
+            media = await self.client._send_media('foo', file, None, thumb='thumb.jpg', force_document=True)
+        self.assertEqual('logo caption', media.message)
+        self.assertEqual(mock_utils.get_input_media.return_value, media.media)
+        self.client._file_to_media.assert_awaited_once_with(
+            file, force_document=True, progress_callback=None, attributes=file.file_attributes, thumb='thumb.jpg',
         )
-        mock_send_album_media.assert_called_once_with(entity, mock_send_files.return_value)
+        file.close()
+
+    async def test_upload_album_media_retry(self):
+        file = File(MagicMock(max_caption_length=200), self.upload_file_path)
+        media = MagicMock()
+        self.client._send_media = AsyncMock(side_effect=[RPCError(None, 'error'), media])
+        self.assertEqual(media, await self.client._upload_album_media('foo', file))
+        self.assertEqual(2, self.client._send_media.await_count)
+        self.client._send_media = AsyncMock(side_effect=TelegramUploadPartError('error'))
+        self.assertIsNone(await self.client._upload_album_media('foo', file))
+        file.close()
 
     @patch('telegram_upload.management.default_config')
     def test_missing_file(self, m1):
@@ -91,16 +205,15 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
                 progress_callback=AnyArg(), attributes=[]
             )
         original_send_file_message = self.client._send_file_message
-        with self.subTest("Test send one file with one flood retry"), patch('time.sleep') as mock_sleep:
-            wait = 1
-
+        with self.subTest("Test send one file with flood error"), patch('time.sleep') as mock_sleep:
+            # The flood waits are waited by the request, the file is not uploaded again
             self.client._send_file_message = MagicMock()
-            self.client._send_file_message.side_effect = [FloodWaitError(None, wait), original_send_file_message]
+            self.client._send_file_message.side_effect = [FloodWaitError(None, 1), original_send_file_message]
             entity = 'foo'
             file = File(MagicMock(), self.upload_file_path)
-            self.client.send_one_file(entity, file, False, None)
-            self.client._send_file_message.assert_has_calls([call(entity, file, None, AnyArg())] * 2)
-            mock_sleep.assert_called_once_with(wait)
+            self.assertIsNone(self.client.send_one_file(entity, file, False, None))
+            self.client._send_file_message.assert_called_once_with(entity, file, None, AnyArg())
+            mock_sleep.assert_not_called()
         with self.subTest("Test send one file with rpcError"):
             self.client._send_file_message = MagicMock()
             self.client._send_file_message.side_effect = [RPCError(None, "")] * 4
@@ -121,8 +234,7 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
             )
         with self.subTest("Test send files with thumb"), \
                 patch.object(File, "get_thumbnail", return_value="thumb.jpg"), \
-                patch('telegram_upload.client.telegram_upload_client.os') as mock_os:
-            mock_os.path.lexists.return_value = True
+                patch.object(File, "remove_thumbnail") as mock_remove_thumbnail:
             entity = 'foo'
             file = File(MagicMock(max_caption_length=200), self.upload_file_path)
             self.client.send_files(entity, [file])
@@ -131,7 +243,7 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
                 caption=os.path.basename(self.upload_file_path).split('.')[0], force_document=False,
                 progress_callback=AnyArg(), attributes=[],
             )
-            mock_os.remove.assert_called_once_with("thumb.jpg")
+            mock_remove_thumbnail.assert_called_once_with("thumb.jpg")
         with self.subTest("Test send files with delete mode"), patch('os.remove') as mock_remove:
             file = File(MagicMock(max_caption_length=200), self.upload_file_path)
             self.client.send_files(entity, [file], delete_on_success=True)
@@ -141,6 +253,28 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
                 progress_callback=AnyArg(), attributes=[],
             )
             mock_remove.assert_called_once_with(self.upload_file_path)
+        with self.subTest("Test send files with forward"):
+            files = [File(MagicMock(max_caption_length=200), self.upload_file_path) for _ in range(2)]
+            self.client.forward_messages = AsyncMock()
+            messages = self.client.send_files(entity, files, forward=['bar', 'spam'])
+            self.assertEqual(2, len(messages))
+            self.client.forward_messages.assert_has_awaits([call('bar', messages), call('spam', messages)])
+            self.assertEqual(2, self.client.forward_messages.await_count)
+
+    def test_send_files_split_parts(self):
+        this_file = os.path.abspath(__file__)
+        parts = [SplitFile(MagicMock(max_caption_length=200), this_file, 100, 'test.py.{:02}'.format(part))
+                 for part in range(2)]
+        messages = [MagicMock(), MagicMock()]
+        self.client._send_files_concurrently = AsyncMock(return_value=messages)
+        with patch('telegram_upload.client.telegram_upload_client.os.remove') as mock_remove:
+            self.assertEqual(messages, self.client.send_files('foo', parts, delete_on_success=True))
+        self.client._send_files_concurrently.assert_awaited_once_with(
+            'foo', tuple(parts), self.client.split_file_concurrent_parts, False, False, (), ()
+        )
+        mock_remove.assert_called_once_with(this_file)
+        for part in parts:
+            part.close()
 
     def test_send_files_data_loss(self):
         mock_client = MagicMock(max_caption_length=200)
@@ -169,3 +303,356 @@ class TestTelegramUploadClient(IsolatedAsyncioTestCase):
                    side_effect=lambda obj, target: isinstance_result.get(target, isinstance(obj, target))), \
                 self.subTest("Test Document"):
             await self.client._send_media(entity, file, mock_progress)
+
+    async def test_upload_file_window(self):
+        in_flight = []
+        max_in_flight = []
+
+        parts = {}
+
+        async def call(sender, request, **kwargs):
+            parts[request.file_part] = bytes(request.bytes)
+            in_flight.append(request)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.001)
+            in_flight.remove(request)
+            return True
+
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=call)
+        self.client.upload_semaphore = AdaptiveSemaphore(2)
+        file_size = os.path.getsize(self.upload_file_path)
+        input_file = await self.client.upload_file(self.upload_file_path, part_size_kb=1)
+        self.assertEqual((file_size + 1023) // 1024, input_file.parts)
+        self.assertEqual(input_file.parts, self.client._call.await_count)
+        self.assertEqual(2, max(max_in_flight))
+        with open(self.upload_file_path, 'rb') as file:
+            self.assertEqual(file.read(), b''.join(parts[i] for i in range(input_file.parts)))
+
+    async def test_upload_file_mmap(self):
+        parts = {}
+
+        async def call(sender, request, **kwargs):
+            parts[request.file_part] = bytes(request.bytes)
+            return True
+
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=call)
+        file = File(MagicMock(), self.upload_file_path)
+        file.use_mmap = True
+        input_file = await self.client.upload_file(file, part_size_kb=32, file_size=file.file_size)
+        with open(self.upload_file_path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(parts[i] for i in range(input_file.parts)))
+        self.assertEqual(file.file_size, file.tell())
+        file.close()
+
+    async def test_upload_file_part_error(self):
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            await self.client.upload_file(self.upload_file_path, part_size_kb=1)
+
+    async def test_upload_file_handle_reused(self):
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(return_value=True)
+        file = File(MagicMock(), self.upload_file_path)
+        handle = await self.client.upload_file(file, part_size_kb=32, file_size=file.file_size)
+        calls = self.client._call.await_count
+        self.assertIs(handle, await self.client.upload_file(file, part_size_kb=32, file_size=file.file_size))
+        self.assertEqual(calls, self.client._call.await_count)
+        with self.subTest("Test data loss"):
+            message = MagicMock()
+            message.media.document.size = 0
+            with self.assertRaises(TelegramUploadDataLoss):
+                self.client._check_remote_size(file, message)
+            self.assertIsNone(file.get_upload_handle())
+        file.close()
+
+    async def test_upload_file_part_retry(self):
+        failed = set()
+
+        async def call(sender, request, **kwargs):
+            if request.file_part == 1 and 1 not in failed:
+                failed.add(1)
+                raise ConnectionError
+            return True
+
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=call)
+        self.client.reconnect = AsyncMock()
+        retries = UploadRetries(policies={TRANSPORT_ERROR: RetryPolicy(1, 0)})
+        input_file = await self.client.upload_file(self.upload_file_path, part_size_kb=1, retries=retries)
+        # Only the failed part is sent again
+        self.assertEqual(input_file.parts + 1, self.client._call.await_count)
+        self.assertEqual({TRANSPORT_ERROR: 1}, retries.failures)
+        self.client.reconnect.assert_awaited_once()
+
+    async def test_upload_file_part_extra_sender_error(self):
+        # The extra sender of the connection error is dropped from the pool
+        extra_sender = MagicMock(**{'disconnect': AsyncMock()})
+
+        async def call(sender, request, **kwargs):
+            if sender is extra_sender:
+                raise ConnectionError
+            await asyncio.sleep(0.001)
+            return True
+
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=call)
+        self.client.reconnect = AsyncMock()
+        self.client.upload_senders = UploadSenderPool(self.client, 2)
+        retries = UploadRetries(policies={TRANSPORT_ERROR: RetryPolicy(1, 0)})
+        with patch.object(UploadSenderPool, '_create_sender', AsyncMock(side_effect=[extra_sender, ConnectionError])):
+            await self.client.upload_file(self.upload_file_path, part_size_kb=1, retries=retries)
+        extra_sender.disconnect.assert_awaited_once()
+        self.assertEqual([self.client._sender], self.client.upload_senders.senders)
+
+    async def test_upload_file_part_retries_exhausted(self):
+        self.client._log = MagicMock()
+        self.client._sender = MagicMock()
+        self.client._call = AsyncMock(side_effect=RPCError(None, 'INTERNAL', 500))
+        retries = UploadRetries(budget=2, policies={RPC_ERROR: RetryPolicy(5, 0)})
+        with self.assertRaises(TelegramUploadPartError):
+            await self.client.upload_file(self.upload_file_path, part_size_kb=1, retries=retries)
+        self.assertEqual(2, retries.retries)
+
+    def test_one_file_part_error(self):
+        self.client._send_file_message = MagicMock(side_effect=TelegramUploadPartError())
+        file = File(MagicMock(), self.upload_file_path)
+        self.assertIsNone(self.client.send_one_file('foo', file, False, None))
+        self.client._send_file_message.assert_called_once()
+
+    async def test_wait_file_parts_errors(self):
+        # The exceptions of all the failed parts are retrieved and the other parts are cancelled
+        async def fail():
+            raise ValueError
+
+        exception_handler = MagicMock()
+        asyncio.get_running_loop().set_exception_handler(exception_handler)
+        tasks = {asyncio.ensure_future(fail()) for _ in range(2)}
+        pending = asyncio.ensure_future(asyncio.sleep(10))
+        await asyncio.sleep(0)
+        with self.assertRaises(ValueError):
+            await self.client._wait_file_parts(tasks | {pending}, asyncio.FIRST_COMPLETED)
+        self.assertTrue(pending.cancelled())
+        del tasks
+        gc.collect()
+        exception_handler.assert_not_called()
+
+    @patch('telegram_upload.client.telegram_upload_client.TelegramClient._call')
+    async def test_call_flood_wait(self, mock_call: MagicMock):
+        self.client.flood_limiter = FloodWaitLimiter()
+        request = functions.messages.SendMediaRequest(types.InputPeerChat(1), types.InputMediaEmpty(), '')
+        mock_call.side_effect = [FloodWaitError(request, 0), 'result']
+        self.assertEqual('result', await self.client._call(MagicMock(), request))
+        self.assertEqual(2, mock_call.await_count)
+        mock_call.assert_awaited_with(AnyArg(), request, ordered=False)
+
+    @patch('telegram_upload.client.telegram_upload_client.TelegramClient._call')
+    async def test_call_flood_wait_file_part(self, mock_call: MagicMock):
+        self.client.flood_limiter = FloodWaitLimiter()
+        request = functions.upload.SaveFilePartRequest(1, 0, b'')
+        mock_call.side_effect = FloodWaitError(request, 10)
+        with self.assertRaises(FloodWaitError):
+            await self.client._call(MagicMock(), request)
+        mock_call.assert_awaited_once()
+        self.assertGreater(self.client.flood_limiter.get_remaining(request), 0)
+
+    async def test_send_files_concurrently(self):
+        files = [File(MagicMock(max_caption_length=200), self.upload_file_path) for _ in range(3)]
+        delays = {id(files[0]): 0.02, id(files[1]): 0.01, id(files[2]): 0}
+
+        async def upload_file(file, **kwargs):
+            await asyncio.sleep(delays[id(file)])
+            return file
+
+        self.client.upload_file = AsyncMock(side_effect=upload_file)
+        self.client.send_file = AsyncMock(side_effect=lambda entity, handle, **kwargs: handle)
+        self.client._check_remote_size = MagicMock()
+        messages = await self.client.send_files('foo', files, concurrent_files=2)
+        self.assertEqual(files, messages)
+        self.assertEqual(files, [c.args[1] for c in self.client.send_file.await_args_list])
+
+    def test_send_files_cached_document(self):
+        document = types.InputDocument(1, 2, b'ref')
+        self.client.upload_cache = MagicMock()
+        self.client.upload_cache.get_document.return_value = document
+        file = File(MagicMock(max_caption_length=200), self.upload_file_path)
+        with self.subTest("Test send cached document"):
+            self.client.send_files('foo', [file])
+            self.client.send_file.assert_called_once_with('foo', document, caption='logo')
+        with self.subTest("Test expired cached document"):
+            self.client.send_file.reset_mock()
+            self.client.send_file.side_effect = [FileReferenceExpiredError(None), self.client.send_file.return_value]
+            self.client.send_files('foo', [file])
+            self.client.upload_cache.remove_document.assert_called_once_with(file)
+            self.assertEqual(file, self.client.send_file.call_args[0][1])
+        with self.subTest("Test cached document error"):
+            # Other errors are reported and the file is uploaded
+            self.client.upload_cache.remove_document.reset_mock()
+            self.client.send_file.reset_mock()
+            self.client.send_file.side_effect = [RPCError(None, 'CHAT_WRITE_FORBIDDEN', 403),
+                                                 self.client.send_file.return_value]
+            self.assertEqual(1, len(self.client.send_files('foo', [file])))
+            self.client.upload_cache.remove_document.assert_not_called()
+            self.assertEqual(file, self.client.send_file.call_args[0][1])
+        file.close()
+
+    def test_send_files_cached_document_thumbnail(self):
+        # The thumbnails prepared for the documents already uploaded are removed
+        document = types.InputDocument(1, 2, b'ref')
+        self.client.upload_cache = MagicMock()
+        self.client.upload_cache.get_document.return_value = document
+        self.client.upload_cache.get_file_key.return_value = ('hash', 1)
+        self.client._check_remote_size = MagicMock()
+        for subtest, concurrent_files in [("Test sequential", 1), ("Test concurrent files", 2)]:
+            with self.subTest(subtest), tempfile.TemporaryDirectory() as directory:
+                thumb = os.path.join(directory, 'thumb.jpg')
+                open(thumb, 'w').close()
+                file = File(MagicMock(max_caption_length=200), self.upload_file_path)
+                with patch.object(file, '_create_thumbnail', return_value=thumb):
+                    file.prepare()
+                    if concurrent_files > 1:
+                        self.client.send_file = AsyncMock()
+                    self.client.send_files('foo', [file], concurrent_files=concurrent_files)
+                self.assertEqual(document, self.client.send_file.call_args[0][1])
+                self.assertFalse(os.path.exists(thumb))
+                file.close()
+
+    async def test_get_file_handle_cancelled(self):
+        files = [File(MagicMock(max_caption_length=200), self.upload_file_path) for _ in range(2)]
+        self.client.upload_cache = MagicMock()
+        self.client.upload_cache.get_file_key.return_value = ('hash', 1)
+        self.client.upload_cache.get_document.return_value = None
+        upload_started = asyncio.Event()
+
+        async def upload_file(file, **kwargs):
+            if file is files[0]:
+                upload_started.set()
+                await asyncio.sleep(10)
+            return 'handle'
+
+        self.client.upload_file = AsyncMock(side_effect=upload_file)
+        batch = {}
+        first = asyncio.get_running_loop().create_task(self.client._get_file_handle(files[0], batch))
+        await upload_started.wait()
+        second = asyncio.get_running_loop().create_task(self.client._get_file_handle(files[1], batch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        # The file with the same content is uploaded by itself
+        self.assertEqual('handle', await second)
+        self.assertEqual(2, self.client.upload_file.await_count)
+        for file in files:
+            file.close()
+
+    async def test_send_files_concurrently_same_content(self):
+        files = [File(MagicMock(max_caption_length=200), self.upload_file_path) for _ in range(2)]
+        self.client.upload_cache = MagicMock()
+        self.client.upload_cache.get_file_key.return_value = ('hash', 1)
+        self.client.upload_cache.get_document.return_value = None
+        self.client.upload_file = AsyncMock()
+        self.client.send_file = AsyncMock()
+        self.client._check_remote_size = MagicMock()
+        messages = await self.client.send_files('foo', files, concurrent_files=2)
+        self.assertEqual(2, len(messages))
+        # The content is uploaded once
+        self.client.upload_file.assert_awaited_once()
+        self.assertEqual([self.client.upload_file.return_value] * 2,
+                         [c.args[1] for c in self.client.send_file.await_args_list])
+
+    async def test_send_files_concurrently_destinations(self):
+        file = File(MagicMock(max_caption_length=200), self.upload_file_path)
+        message = MagicMock()
+        self.client.upload_file = AsyncMock()
+        self.client.send_file = AsyncMock(side_effect=[message, 'bar', RPCError(None, 'CHAT_WRITE_FORBIDDEN', 403)])
+        self.client._check_remote_size = MagicMock()
+        messages = await self.client.send_files('foo', [file], concurrent_files=2, destinations=['bar', 'spam'])
+        self.assertEqual([message], messages)
+        self.client.upload_file.assert_awaited_once()
+        self.client.send_file.assert_has_awaits([
+            call('bar', message.media, caption='logo'), call('spam', message.media, caption='logo'),
+        ])
+
+    async def test_send_album_to_chats(self):
+        self.client._send_album_media = AsyncMock()
+        media = [types.InputSingleMedia(types.InputMediaEmpty(), 'a')]
+        await self.client._send_album_to_chats(['foo', 'bar'], media)
+        self.assertEqual(['foo', 'bar'], [c.args[0] for c in self.client._send_album_media.await_args_list])
+        random_ids = [c.args[1][0].random_id for c in self.client._send_album_media.await_args_list]
+        self.assertNotEqual(random_ids[0], random_ids[1])
+
+    async def test_send_uploaded_files(self):
+        uploaded_files = [MagicMock(caption='a'), MagicMock(caption='b')]
+        self.client.send_file = AsyncMock(side_effect=[RPCError(None, 'MEDIA_EMPTY', 400), 'a1', 'b1', 'b2'])
+        messages = await self.client._send_uploaded_files(['chat1', 'chat2'], uploaded_files)
+        self.assertEqual(['a1', 'b1', 'b2'], sorted(messages))
+        self.assertEqual(4, self.client.send_file.await_count)
+        self.client.send_file.assert_any_await('chat2', uploaded_files[1].media, caption='b')
+        with self.assertRaises(MissingFileError):
+            await self.client._send_uploaded_files(['chat1'], [])
+
+    async def test_send_uploaded_files_invalid_file_id(self):
+        # The invalid file ids do not stop the other files
+        uploaded_files = [UploadedFile('invalid'), MagicMock(caption='b')]
+        self.client.send_file = AsyncMock(return_value='b1')
+        self.assertEqual(['b1'], await self.client._send_uploaded_files(['chat1'], uploaded_files))
+        self.client.send_file.assert_awaited_once_with('chat1', uploaded_files[1].media, caption='b')
+
+    async def test_send_files_concurrently_flood_wait(self):
+        file = File(MagicMock(max_caption_length=200), self.upload_file_path)
+        self.client.upload_file = AsyncMock()
+        self.client.send_file = AsyncMock(side_effect=[FloodWaitError(None, 0), MagicMock()])
+        self.client._check_remote_size = MagicMock()
+        messages = await self.client.send_files('foo', [file], concurrent_files=2)
+        self.assertEqual(1, len(messages))
+        self.client.upload_file.assert_awaited_once()
+        self.assertEqual(2, self.client.send_file.await_count)
+
+
+class TestTelegramUploadClientCall(IsolatedAsyncioTestCase):
+    """The flood waits returned by the server, through the Telethon _call."""
+    def setUp(self) -> None:
+        self.client = TelegramUploadClient(MemorySession(), 1, 'hash')
+        self.client.flood_limiter = FloodWaitLimiter()
+        self.sender = MagicMock()
+        self.sent = []
+
+    def set_results(self, *results):
+        results = list(results)
+
+        async def send(request, ordered=False):
+            self.sent.append(request)
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.sender.send.side_effect = send
+
+    async def test_flood_wait_not_slept(self):
+        # The flood waits below the flood_sleep_threshold of Telethon are not slept by Telethon
+        request = functions.upload.SaveFilePartRequest(1, 0, b'')
+        self.set_results(FloodWaitError(request, capture=30))
+        with self.assertRaises(FloodWaitError):
+            await asyncio.wait_for(self.client._call(self.sender, request), 1)
+        self.assertGreater(self.client.flood_limiter.get_remaining(request), 20)
+
+    async def test_flood_wait_other_chat(self):
+        # The flood wait of a chat does not stop the requests of the same class to other chats
+        request = functions.messages.SendMediaRequest(types.InputPeerChat(1), types.InputMediaEmpty(), '')
+        other_request = functions.messages.SendMediaRequest(types.InputPeerChat(2), types.InputMediaEmpty(), '')
+        self.set_results(FloodWaitError(request, capture=58), 'result')
+        task = asyncio.ensure_future(self.client._call(self.sender, request))
+        await asyncio.sleep(0.01)
+        try:
+            self.assertEqual('result', await asyncio.wait_for(self.client._call(self.sender, other_request), 1))
+            self.assertEqual([request, other_request], self.sent)
+            self.assertFalse(task.done())
+        finally:
+            task.cancel()
@@ -0,0 +1,61 @@
+from unittest.mock import MagicMock, patch
+
+from telegram_upload.client.upload_senders import UploadSenderPool
+
+try:
+    from unittest.mock import AsyncMock
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from asyncmock import AsyncMock
+    from async_case import IsolatedAsyncioTestCase
+
+
+class TestUploadSenderPool(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.extra_senders = [MagicMock(), MagicMock()]
+
+    async def test_borrow_main_sender(self):
+        pool = UploadSenderPool(self.client, 1)
+        with patch.object(UploadSenderPool, '_create_sender') as mock_create_sender:
+            async with pool.borrow() as sender:
+                self.assertIs(self.client._sender, sender)
+            mock_create_sender.assert_not_called()
+
+    async def test_borrow_less_loaded(self):
+        pool = UploadSenderPool(self.client, 3)
+        with patch.object(UploadSenderPool, '_create_sender', AsyncMock(side_effect=self.extra_senders)):
+            async with pool.borrow() as sender1, pool.borrow() as sender2, pool.borrow() as sender3:
+                self.assertEqual([self.client._sender] + self.extra_senders, [sender1, sender2, sender3])
+            async with pool.borrow() as sender:
+                self.assertIs(self.client._sender, sender)
+
+    async def test_start_error(self):
+        pool = UploadSenderPool(self.client, 3)
+        with patch.object(UploadSenderPool, '_create_sender',
+                          AsyncMock(side_effect=[self.extra_senders[0], ConnectionError])):
+            await pool.start()
+        self.assertEqual([self.client._sender, self.extra_senders[0]], pool.senders)
+
+    async def test_close(self):
+        pool = UploadSenderPool(self.client, 2)
+        sender = MagicMock(**{'disconnect': AsyncMock()})
+        with patch.object(UploadSenderPool, '_create_sender', AsyncMock(return_value=sender)):
+            await pool.start()
+        await pool.close()
+        sender.disconnect.assert_awaited_once()
+        self.assertEqual([self.client._sender], pool.senders)
+
+    async def test_drop(self):
+        pool = UploadSenderPool(self.client, 3)
+        senders = [MagicMock(**{'disconnect': AsyncMock()}) for _ in range(3)]
+        with patch.object(UploadSenderPool, '_create_sender', AsyncMock(side_effect=senders)):
+            await pool.start()
+            await pool.drop(senders[0])
+            await pool.drop(self.client._sender)
+            senders[0].disconnect.assert_awaited_once()
+            self.assertEqual([self.client._sender, senders[1]], pool.senders)
+            # The connection dropped is opened again
+            async with pool.borrow():
+                pass
+        self.assertEqual([self.client._sender, senders[1], senders[2]], pool.senders)
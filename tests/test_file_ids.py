@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from telethon import utils
+from telethon.tl import types
+
+from telegram_upload.exceptions import TelegramInvalidFile
+from telegram_upload.file_ids import UploadedFile, read_manifest, write_manifest
+
+
+DOCUMENT = types.Document(id=123, access_hash=456, file_reference=b'ref', date=None, mime_type='text/plain',
+                          size=10, dc_id=2, attributes=[])
+FILE_ID = utils.pack_bot_file_id(DOCUMENT)
+
+
+class TestUploadedFile(unittest.TestCase):
+    def test_media(self):
+        media = UploadedFile(FILE_ID, file_reference=b'ref').media
+        self.assertEqual((123, 456, b'ref'), (media.id, media.access_hash, media.file_reference))
+
+    def test_invalid_file_id(self):
+        with self.assertRaises(TelegramInvalidFile):
+            UploadedFile('invalid').media
+
+    def test_from_message(self):
+        message = MagicMock(media=types.MessageMediaDocument(document=DOCUMENT), message='caption')
+        uploaded_file = UploadedFile.from_message('test.txt', message)
+        self.assertEqual((FILE_ID, 'test.txt', 'caption', b'ref'),
+                         (uploaded_file.file_id, uploaded_file.name, uploaded_file.caption,
+                          uploaded_file.file_reference))
+
+    def test_from_line(self):
+        for subtest, line in [
+            ("Test file id", FILE_ID),
+            ("Test printed file id", f'Uploaded successfully "test.txt" (file_id {FILE_ID})\n'),
+            ("Test JSON", UploadedFile(FILE_ID, 'test.txt', file_reference=b'ref').to_line()),
+        ]:
+            with self.subTest(subtest):
+                self.assertEqual(FILE_ID, UploadedFile.from_line(line).file_id)
+        self.assertIsNone(UploadedFile.from_line('\n'))
+
+    def test_manifest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'manifest.jsonl')
+            write_manifest(path, UploadedFile(FILE_ID, 'a.txt', 'caption', b'ref'))
+            write_manifest(path, UploadedFile(FILE_ID, 'b.txt'))
+            uploaded_files = list(read_manifest(path))
+        self.assertEqual(['a.txt', 'b.txt'], [uploaded_file.name for uploaded_file in uploaded_files])
+        self.assertEqual((b'ref', 'caption'), (uploaded_files[0].file_reference, uploaded_files[0].caption))
@@ -1,25 +1,23 @@
 import os
+import tempfile
 import unittest
 from unittest.mock import patch, Mock, MagicMock
 
 from telegram_upload.client.telegram_manager_client import USER_MAX_FILE_SIZE
 from telegram_upload.exceptions import TelegramInvalidFile
+from telegram_upload.thumbnail_cache import ThumbnailCache
 from telegram_upload.upload_files import get_file_attributes, RecursiveFiles, NoDirectoriesFiles, NoLargeFiles, \
-    SplitFiles, SplitFile
+    SplitFiles, SplitFile, File, UPLOAD_HANDLE_EXPIRATION, group_split_files, prepare_files
+from telegram_upload.utils import grouper
+from telegram_upload.video import MediaProbe
 
 
 class TestGetFileAttributes(unittest.TestCase):
     def test_not_video(self):
         self.assertEqual(get_file_attributes('foo.png'), [])
 
-    @patch('telegram_upload.upload_files.video_metadata')
-    def test_video(self, m_video_metadata):
-        m_video_metadata.return_value.has.return_value = True
-        duration = Mock()
-        duration.seconds = 1000
-        m_video_metadata.return_value.get.side_effect = [
-            duration, 1920, 1080
-        ]
+    @patch('telegram_upload.upload_files.probe_media', return_value=MediaProbe(1000, 1920, 1080))
+    def test_video(self, m_probe_media):
         attrs = get_file_attributes('foo.mp4')
         self.assertEqual(attrs[0].w, 1920)
         self.assertEqual(attrs[0].h, 1080)
@@ -83,6 +81,44 @@ class TestSplitFile(unittest.TestCase):
         file0.close()
         file1.close()
 
+    def test_readinto(self):
+        this_file = os.path.abspath(__file__)
+        size = os.path.getsize(this_file)
+        file1 = SplitFile(MagicMock(), this_file, 100, 'test.py.01')
+        file1.seek(size - 100, split_seek=True)
+        buffer = bytearray(150)
+        self.assertEqual(100, file1.readinto(buffer))
+        self.assertEqual(0, file1.readinto(buffer))
+        with open(this_file, 'rb') as f:
+            self.assertEqual(f.read()[-100:], bytes(buffer[:100]))
+        file1.close()
+
+
+class TestMappedView(unittest.TestCase):
+    def test_file(self):
+        this_file = os.path.abspath(__file__)
+        file = File(MagicMock(), this_file)
+        file.seek(10)
+        with open(this_file, 'rb') as f:
+            content = f.read()
+        view = file.get_mapped_view()
+        self.assertEqual(content[10:], bytes(view))
+        self.assertEqual(10, file.tell())
+        view.release()
+        file.close()
+
+    def test_split_file(self):
+        this_file = os.path.abspath(__file__)
+        size = os.path.getsize(this_file)
+        file = SplitFile(MagicMock(), this_file, 100, 'test.py.01')
+        file.seek(size - 150, split_seek=True)
+        with open(this_file, 'rb') as f:
+            content = f.read()
+        view = file.get_mapped_view()
+        self.assertEqual(content[-150:-50], bytes(view))
+        view.release()
+        file.close()
+
 
 class TestSplitFiles(unittest.TestCase):
     @patch('telegram_upload.upload_files.os.path.getsize', return_value=USER_MAX_FILE_SIZE - 1)
@@ -99,3 +135,109 @@ class TestSplitFiles(unittest.TestCase):
         self.assertEqual(len(files), 2)
         self.assertEqual(m_init.call_args_list[0][0], (mock_client, 'foo', USER_MAX_FILE_SIZE, 'foo.00'))
         self.assertEqual(m_init.call_args_list[1][0], (mock_client, 'foo', 1000, 'foo.01'))
+
+    @patch('telegram_upload.upload_files.os.path.getsize', return_value=USER_MAX_FILE_SIZE + 1000)
+    @patch('telegram_upload.upload_files.SplitFile.__init__', return_value=None)
+    @patch('telegram_upload.upload_files.SplitFile.seek')
+    def test_grouper(self, m_getsize, m_init, m_seek):
+        # The parts are not lost when the iteration is continued in chunks, as in the albums
+        groups = list(grouper(1, SplitFiles(MagicMock(max_file_size=USER_MAX_FILE_SIZE), ['foo'])))
+        self.assertEqual(2, len(groups))
+        self.assertEqual(['foo.00', 'foo.01'], [call[0][3] for call in m_init.call_args_list])
+
+
+class TestGroupSplitFiles(unittest.TestCase):
+    def test_group_split_files(self):
+        this_file = os.path.abspath(__file__)
+        files = [
+            File(MagicMock(), this_file),
+            SplitFile(MagicMock(), this_file, 100, 'test.py.00'),
+            SplitFile(MagicMock(), this_file, 100, 'test.py.01'),
+            File(MagicMock(), this_file),
+        ]
+        self.assertEqual([(files[0],), tuple(files[1:3]), (files[3],)], list(group_split_files(files)))
+        for file in files:
+            file.close()
+
+
+class TestPrepare(unittest.TestCase):
+    def setUp(self) -> None:
+        self.file = File(MagicMock(max_caption_length=200), __file__)
+
+    def tearDown(self) -> None:
+        self.file.close()
+
+    @patch('telegram_upload.upload_files.get_file_thumb', return_value='thumb.jpg')
+    @patch('telegram_upload.upload_files.get_file_attributes', return_value=[])
+    def test_prepare(self, mock_get_file_attributes: Mock, mock_get_file_thumb: Mock):
+        self.file.prepare()
+        self.file.prepare()
+        self.assertEqual([], self.file.file_attributes)
+        self.assertEqual('test_files', self.file.file_caption)
+        mock_get_file_attributes.assert_called_once()
+        mock_get_file_thumb.assert_called_once()
+        # The prepared thumbnail is returned once. It is removed by the caller.
+        self.assertEqual('thumb.jpg', self.file.get_thumbnail())
+        self.assertEqual('thumb.jpg', self.file.get_thumbnail())
+        self.assertEqual(2, mock_get_file_thumb.call_count)
+
+    @patch('telegram_upload.upload_files.os.remove')
+    @patch('telegram_upload.upload_files.get_file_thumb', return_value=__file__)
+    def test_clear_prepared(self, mock_get_file_thumb: Mock, mock_remove: Mock):
+        self.file.prepare()
+        self.file.clear_prepared()
+        mock_remove.assert_called_once_with(__file__)
+
+    def test_remove_cached_thumbnail(self):
+        with tempfile.TemporaryDirectory() as directory:
+            thumb = os.path.join(directory, 'thumb.jpg')
+            open(thumb, 'w').close()
+            with patch('telegram_upload.upload_files._thumbnail_cache', ThumbnailCache(directory)):
+                self.file.remove_thumbnail(thumb)
+            self.assertTrue(os.path.lexists(thumb))
+            self.file.remove_thumbnail(thumb)
+            self.assertFalse(os.path.lexists(thumb))
+
+
+class TestPrepareFiles(unittest.TestCase):
+    def test_prepare_files(self):
+        files = [MagicMock(spec=File) for _ in range(4)]
+        self.assertEqual(files, list(prepare_files(files, 2, thumbnail=False)))
+        for file in files:
+            file.prepare.assert_called_once_with(False)
+
+    def test_close(self):
+        files = [MagicMock(spec=File) for _ in range(4)]
+        iterator = prepare_files(files, 2)
+        self.assertIs(files[0], next(iterator))
+        iterator.close()
+        # The files prepared ahead are discarded
+        for file in files[1:3]:
+            file.clear_prepared.assert_called_once_with()
+        files[3].prepare.assert_not_called()
+
+    def test_disabled(self):
+        files = [MagicMock(spec=File)]
+        self.assertEqual(files, list(prepare_files(files, 0)))
+        files[0].prepare.assert_not_called()
+
+
+class TestUploadHandle(unittest.TestCase):
+    def setUp(self) -> None:
+        self.file = File(Mock(), __file__)
+
+    def tearDown(self) -> None:
+        self.file.close()
+
+    def test_handle(self):
+        handle = Mock()
+        self.assertIsNone(self.file.get_upload_handle())
+        self.file.set_upload_handle(handle)
+        self.assertIs(handle, self.file.get_upload_handle())
+
+    @patch('telegram_upload.upload_files.time.monotonic')
+    def test_expired(self, mock_monotonic: Mock):
+        mock_monotonic.return_value = 0
+        self.file.set_upload_handle(Mock())
+        mock_monotonic.return_value = UPLOAD_HANDLE_EXPIRATION
+        self.assertIsNone(self.file.get_upload_handle())
@@ -8,6 +8,7 @@ from ._compat import patch
 
 from click.testing import CliRunner
 
+from telegram_upload.exceptions import TelegramInvalidFile
 from telegram_upload.management import upload, download, get_file_display_name
 
 directory = os.path.dirname(os.path.abspath(__file__))
@@ -41,6 +42,77 @@ class TestUpload(unittest.TestCase):
         mock_client.assert_called_once()
         mock_client.return_value.send_files.assert_called_once()
 
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    def test_upload_destinations(self, mock_client: MagicMock, _: MagicMock):
+        mock_client.return_value.max_caption_length = 200
+        mock_client.return_value.max_file_size = 1024 * 1024 * 1024
+        test_file = os.path.join(directory, 'test_management.py')
+        runner = CliRunner()
+        result = runner.invoke(upload, [test_file, '--to', 'foo', '--to', '1234', '--to', 'bar'])
+        self.assertEqual(result.exit_code, 0)
+        args, kwargs = mock_client.return_value.send_files.call_args
+        self.assertEqual('foo', args[0])
+        self.assertEqual([1234, 'bar'], kwargs['destinations'])
+
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    def test_upload_group_documents(self, mock_client: MagicMock, _: MagicMock):
+        mock_client.return_value.max_caption_length = 200
+        mock_client.return_value.max_file_size = 1024 * 1024 * 1024
+        test_file = os.path.join(directory, 'test_management.py')
+        runner = CliRunner()
+        result = runner.invoke(upload, [test_file, '--group-documents'])
+        self.assertEqual(result.exit_code, 0)
+        mock_client.return_value.send_files.assert_not_called()
+        self.assertTrue(mock_client.return_value.send_files_as_album.call_args[1]['force_document'])
+
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    def test_upload_part_size(self, mock_client: MagicMock, _: MagicMock):
+        mock_client.return_value.max_caption_length = 200
+        mock_client.return_value.max_file_size = 1024 * 1024 * 1024
+        test_file = os.path.join(directory, 'test_management.py')
+        runner = CliRunner()
+        result = runner.invoke(upload, [test_file, '--part-size', '256'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(256, mock_client.return_value.part_size_policy.part_size)
+
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    def test_upload_file_ids(self, mock_client: MagicMock, _: MagicMock):
+        runner = CliRunner()
+        result = runner.invoke(upload, ['--file-id', 'foo', '--file-id', 'bar', '--to', '1234'])
+        self.assertEqual(result.exit_code, 0)
+        mock_client.return_value.send_files.assert_not_called()
+        entities, uploaded_files = mock_client.return_value.send_uploaded_files.call_args[0]
+        self.assertEqual([1234], entities)
+        self.assertEqual(['foo', 'bar'], [uploaded_file.file_id for uploaded_file in uploaded_files])
+
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    def test_upload_file_ids_user(self, mock_client: MagicMock, _: MagicMock):
+        # The file ids without a file reference cannot be sent by the users
+        mock_client.return_value.me.bot = False
+        runner = CliRunner()
+        result = runner.invoke(upload, ['--file-id', 'foo', '--to', '1234'])
+        self.assertIsInstance(result.exception, TelegramInvalidFile)
+        mock_client.return_value.send_uploaded_files.assert_not_called()
+
+    @patch('telegram_upload.management.default_config')
+    @patch('telegram_upload.management.TelegramManagerClient')
+    @patch('telegram_upload.management.UploadCache')
+    def test_upload_dedup(self, mock_upload_cache: MagicMock, mock_client: MagicMock, _: MagicMock):
+        # The documents of the upload cache are kept by account
+        mock_client.return_value.max_caption_length = 200
+        mock_client.return_value.max_file_size = 1024 * 1024 * 1024
+        mock_client.return_value.me.id = 1234
+        runner = CliRunner()
+        result = runner.invoke(upload, [os.path.join(directory, 'test_management.py'), '--dedup'])
+        self.assertEqual(result.exit_code, 0)
+        mock_upload_cache.assert_called_once_with(user_id=1234)
+        self.assertEqual(mock_upload_cache.return_value, mock_client.return_value.upload_cache)
+
     @patch('telegram_upload.management.default_config')
     @patch('telegram_upload.management.TelegramManagerClient')
     def test_exclusive(self, m1, m2):
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from telegram_upload.metadata_cache import MetadataCache, get_file_key
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = MetadataCache(os.path.join(self.directory.name, 'metadata.sqlite3'))
+        self.key = get_file_key(os.stat(__file__))
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_media(self):
+        values = dict(duration=10, width=1920, height=1080, supports_streaming=True, title='Title')
+        self.cache.set(self.key, values)
+        self.assertEqual(values, self.cache.get(self.key))
+
+    def test_not_media(self):
+        self.cache.set(self.key, None)
+        self.assertEqual({}, self.cache.get(self.key))
+
+    def test_read_size(self):
+        self.cache.set(self.key, dict(duration=10), 16)
+        self.assertEqual(10, self.cache.get(self.key, 16)['duration'])
+        self.assertEqual(10, self.cache.get(self.key, 8)['duration'])
+        # Greater or no read limits parse the file again
+        self.assertIsNone(self.cache.get(self.key, 32))
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_previous_version(self):
+        # The databases without read sizes are migrated. Their values were complete.
+        self.cache.close()
+        os.remove(self.cache.path)
+        connection = sqlite3.connect(self.cache.path)
+        connection.execute(
+            'CREATE TABLE media ('
+            'dev INTEGER NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'is_media INTEGER NOT NULL, duration INTEGER NOT NULL, width INTEGER, height INTEGER, '
+            'supports_streaming INTEGER NOT NULL, tags TEXT NOT NULL, created REAL NOT NULL, '
+            'PRIMARY KEY (dev, inode, size, mtime_ns))'
+        )
+        connection.execute('INSERT INTO media VALUES (?, ?, ?, ?, 1, 10, NULL, NULL, 0, \'{}\', 0)', self.key)
+        connection.commit()
+        connection.close()
+        self.cache = MetadataCache(self.cache.path)
+        self.assertEqual(10, self.cache.get(self.key, 16)['duration'])
+
+    def test_modified(self):
+        self.cache.set(self.key, dict(duration=10))
+        dev, inode, size, mtime_ns = self.key
+        self.assertIsNone(self.cache.get((dev, inode, size, mtime_ns + 1)))
+
+    def test_persistent(self):
+        self.cache.set(self.key, dict(duration=10))
+        self.cache.close()
+        self.cache = MetadataCache(self.cache.path)
+        self.assertEqual(10, self.cache.get(self.key)['duration'])
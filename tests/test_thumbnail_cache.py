@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from telegram_upload.thumbnail_cache import ThumbnailCache
+
+
+def create_thumbnail(file: str, output: str, size: int = 10) -> str:
+    with open(output, 'wb') as thumb:
+        thumb.write(b'\xff' * size)
+    return output
+
+
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ThumbnailCache(os.path.join(self.directory.name, 'thumbnails'), max_size=25)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_get_thumbnail(self):
+        create = Mock(side_effect=create_thumbnail)
+        thumb = self.cache.get_thumbnail(__file__, create)
+        self.assertEqual(thumb, self.cache.get_thumbnail(__file__, create))
+        create.assert_called_once()
+        self.assertTrue(self.cache.is_cached(thumb))
+        self.assertEqual([os.path.basename(thumb)], os.listdir(self.cache.directory))
+
+    def test_not_created(self):
+        self.assertIsNone(self.cache.get_thumbnail(__file__, Mock(return_value=None)))
+        self.assertEqual([], os.listdir(self.cache.directory))
+
+    def test_modified(self):
+        path = os.path.join(self.directory.name, 'video.mp4')
+        with open(path, 'w') as file:
+            file.write('video')
+        thumb = self.cache.get_thumbnail(path, create_thumbnail)
+        with open(path, 'w') as file:
+            file.write('modified video')
+        self.assertNotEqual(thumb, self.cache.get_thumbnail(path, create_thumbnail))
+
+    def test_evict(self):
+        thumbs = []
+        for index in range(3):
+            path = os.path.join(self.directory.name, 'video{}.mp4'.format(index))
+            with open(path, 'w') as file:
+                file.write('video')
+            thumbs.append(self.cache.get_thumbnail(path, create_thumbnail))
+            os.utime(thumbs[-1], (index, index))
+        # The least recently used thumbnail is removed
+        self.assertEqual(sorted(map(os.path.basename, thumbs[1:])), sorted(os.listdir(self.cache.directory)))
+
+    def test_evict_keep(self):
+        thumb = self.cache.get_thumbnail(__file__, lambda file, output: create_thumbnail(file, output, 30))
+        self.assertTrue(os.path.lexists(thumb))
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from telethon.tl import types
+
+from telegram_upload.upload_cache import UploadCache, get_content_hash
+from telegram_upload.upload_files import File, SplitFile
+
+
+class TestGetContentHash(unittest.TestCase):
+    def test_range(self):
+        with open(__file__, 'rb') as file:
+            data = file.read()
+        self.assertEqual(hashlib.sha256(data[10:110]).hexdigest(), get_content_hash(__file__, 10, 100))
+
+
+class TestUploadCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = UploadCache(os.path.join(self.directory.name, 'uploads.sqlite3'))
+        self.file = File(MagicMock(), __file__)
+
+    def tearDown(self) -> None:
+        self.file.close()
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_file_key(self):
+        with open(__file__, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        self.assertEqual((content_hash, self.file.file_size), self.cache.get_file_key(self.file))
+
+    def test_same_inode(self):
+        other = File(MagicMock(), __file__)
+        self.cache.get_file_key(self.file)
+        with patch('telegram_upload.upload_cache.get_content_hash') as mock_get_content_hash:
+            self.assertEqual(self.cache.get_file_key(self.file), self.cache.get_file_key(other))
+        mock_get_content_hash.assert_not_called()
+        other.close()
+
+    def test_split_file(self):
+        file = SplitFile(MagicMock(), __file__, 100, 'test.00')
+        file.seek(10, split_seek=True)
+        self.assertEqual((get_content_hash(__file__, 10, 100), 100), self.cache.get_file_key(file))
+        file.close()
+
+    def test_document(self):
+        self.assertIsNone(self.cache.get_document(self.file))
+        self.cache.add_document(self.file, types.Document(1, 2, b'ref', None, 'text/plain', 10, 0, []))
+        self.assertEqual(types.InputDocument(1, 2, b'ref'), self.cache.get_document(self.file))
+        self.cache.remove_document(self.file)
+        self.assertIsNone(self.cache.get_document(self.file))
+
+    def test_persistent(self):
+        self.cache.get_file_key(self.file)
+        self.cache.add_document(self.file, types.Document(1, 2, b'ref', None, 'text/plain', 10, 0, []))
+        cache = UploadCache(self.cache.path)
+        self.assertEqual(types.InputDocument(1, 2, b'ref'), cache.get_document(self.file))
+        cache.close()
+
+    def test_other_account(self):
+        self.cache.get_file_key(self.file)
+        self.cache.add_document(self.file, types.Document(1, 2, b'ref', None, 'text/plain', 10, 0, []))
+        cache = UploadCache(self.cache.path, user_id=1)
+        cache.get_file_key(self.file)
+        self.assertIsNone(cache.get_document(self.file))
+        cache.close()
+
+    def test_previous_version(self):
+        # The documents of the databases without accounts are discarded
+        self.cache.close()
+        os.remove(self.cache.path)
+        connection = sqlite3.connect(self.cache.path)
+        connection.execute(
+            'CREATE TABLE documents ('
+            'hash TEXT NOT NULL, size INTEGER NOT NULL, id INTEGER NOT NULL, access_hash INTEGER NOT NULL, '
+            'file_reference BLOB NOT NULL, created REAL NOT NULL, PRIMARY KEY (hash, size))'
+        )
+        connection.execute('INSERT INTO documents VALUES (?, ?, 1, 2, ?, 0)',
+                           self.cache.get_file_key(self.file) + (b'ref',))
+        connection.commit()
+        connection.close()
+        self.cache = UploadCache(self.cache.path)
+        self.assertIsNone(self.cache.get_document(self.file))
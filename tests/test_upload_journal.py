@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from telegram_upload.upload_files import File
+from telegram_upload.upload_journal import UploadJournal, get_journal_key
+
+
+class TestUploadJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = File(MagicMock(), os.path.abspath(__file__))
+
+    def tearDown(self) -> None:
+        self.file.close()
+        self.directory.cleanup()
+
+    def test_new_journal(self):
+        journal = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        self.assertEqual(set(), journal.parts)
+        self.assertEqual(list(range(10)), journal.missing_parts)
+        self.assertTrue(os.path.lexists(journal.path))
+
+    def test_resume(self):
+        journal = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        journal.add(0)
+        journal.add(3)
+        journal.close()
+        resumed = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        self.assertEqual(journal.file_id, resumed.file_id)
+        self.assertEqual([1, 2, 4, 5, 6, 7, 8, 9], resumed.missing_parts)
+
+    def test_other_part_size(self):
+        journal = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        journal.add(0)
+        journal.close()
+        other = UploadJournal.open(self.file, 2048, 5, self.directory.name)
+        self.assertNotEqual(journal.file_id, other.file_id)
+        self.assertEqual(set(), other.parts)
+
+    def test_expired(self):
+        journal = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        journal.add(0)
+        journal.close()
+        with patch('telegram_upload.upload_journal.time.time', return_value=time.time() + 60 * 60 * 24):
+            other = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        self.assertNotEqual(journal.file_id, other.file_id)
+
+    def test_remove(self):
+        journal = UploadJournal.open(self.file, 1024, 10, self.directory.name)
+        journal.add(0)
+        journal.remove()
+        self.assertFalse(os.path.lexists(journal.path))
+
+    def test_key(self):
+        with patch('telegram_upload.upload_journal.os.stat') as mock_stat:
+            mock_stat.return_value.st_size = 1
+            mock_stat.return_value.st_mtime_ns = 1
+            key = get_journal_key(self.file)
+            mock_stat.return_value.st_mtime_ns = 2
+            self.assertNotEqual(key, get_journal_key(self.file))
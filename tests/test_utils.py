@@ -1,7 +1,13 @@
+import threading
 import unittest
 from unittest.mock import patch, Mock
 
-from telegram_upload.utils import sizeof_fmt, scantree
+from telegram_upload.utils import sizeof_fmt, scantree, size_grouper, iterate_in_executor
+
+try:
+    from unittest import IsolatedAsyncioTestCase
+except ImportError:
+    from async_case import IsolatedAsyncioTestCase
 
 
 class TestSizeOfFmt(unittest.TestCase):
@@ -15,6 +21,24 @@ class TestSizeOfFmt(unittest.TestCase):
         self.assertEqual(sizeof_fmt((1024 ** 2) * 3), '3.0MiB')
 
 
+class TestSizeGrouper(unittest.TestCase):
+    def test_size_grouper(self):
+        files = [Mock(file_size=size) for size in [1, 1, 1, 5, 1]]
+        self.assertEqual([tuple(files[:2]), (files[2],), (files[3],), (files[4],)],
+                         list(size_grouper(2, files, 4)))
+
+
+class TestIterateInExecutor(IsolatedAsyncioTestCase):
+    async def test_iterate(self):
+        def items():
+            for item in [0, None, 2]:
+                yield item, threading.current_thread()
+
+        results = [item async for item in iterate_in_executor(items())]
+        self.assertEqual([0, None, 2], [item for item, thread in results])
+        self.assertNotIn(threading.main_thread(), [thread for item, thread in results])
+
+
 class TestScanTree(unittest.TestCase):
     @patch('telegram_upload.utils.scandir', return_value=[])
     def test_empty_directory(self, m):
@@ -1,8 +1,19 @@
+import io
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
+
+from hachoir.core.log import log as hachoir_log
 
 from telegram_upload.exceptions import ThumbVideoError
-from telegram_upload.video import call_ffmpeg, get_video_size, get_video_thumb
+from telegram_upload.metadata_cache import MetadataCache
+from telegram_upload.video import call_ffmpeg, get_video_size, get_video_thumb, MediaProbe, probe_media, \
+    _probe_media_file, video_metadata, read_metadata, LimitedReader, MetadataReadLimitError, quiet_hachoir_log, \
+    METADATA_READ_SIZE
+
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logo.png')
 
 
 class TestcallFfmpeg(unittest.TestCase):
@@ -12,6 +23,49 @@ class TestcallFfmpeg(unittest.TestCase):
             call_ffmpeg([])
 
 
+class TestVideoMetadata(unittest.TestCase):
+    def test_read_size(self):
+        self.assertEqual(1000, video_metadata(LOGO_PATH, 1).get('width'))
+
+    def test_no_read_size(self):
+        self.assertEqual(1000, video_metadata(LOGO_PATH, 0).get('width'))
+
+    def test_not_media(self):
+        self.assertIsNone(video_metadata(__file__, 1))
+
+    def test_complete(self):
+        self.assertTrue(read_metadata(LOGO_PATH, 1)[1])
+
+    @patch('telegram_upload.video.LimitedReader')
+    def test_read_limit(self, m):
+        # The fields are missing when the limit is reached. The hachoir errors are not shown.
+        with open(LOGO_PATH, 'rb') as file:
+            m.return_value = LimitedReader(file, 10)
+            with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                self.assertEqual((None, False), read_metadata(LOGO_PATH, 1))
+        self.assertEqual('', stderr.getvalue())
+        self.assertTrue(hachoir_log.use_print)
+
+    def test_quiet_log_restored(self):
+        # The previous setting of the hachoir log is restored
+        self.addCleanup(setattr, hachoir_log, 'use_print', hachoir_log.use_print)
+        hachoir_log.use_print = False
+        with quiet_hachoir_log():
+            pass
+        self.assertFalse(hachoir_log.use_print)
+
+
+class TestLimitedReader(unittest.TestCase):
+    def test_limit(self):
+        with open(__file__, 'rb') as file:
+            reader = LimitedReader(file, 10)
+            self.assertEqual(b'import', reader.read(6))
+            reader.seek(-4, os.SEEK_END)
+            self.assertEqual(4, len(reader.read(4)))
+            with self.assertRaises(MetadataReadLimitError):
+                reader.read(1)
+
+
 class TestGetVideoSize(unittest.TestCase):
     @patch('telegram_upload.video.call_ffmpeg')
     def test_size(self, m):
@@ -25,13 +79,106 @@ class TestGetVideoSize(unittest.TestCase):
 
 
 class TestGetVideoThumb(unittest.TestCase):
-    @patch('telegram_upload.video.video_metadata')
-    @patch('telegram_upload.video.get_video_size', return_value=[1920, 1080])
+    @patch('telegram_upload.video.probe_media', return_value=MediaProbe(10, 1920, 1080))
+    @patch('telegram_upload.video.get_video_size')
     @patch('telegram_upload.video.call_ffmpeg')
     def test_video_thumb(self, m1, m2, m3):
         get_video_thumb('foo')
+        # The size of the probe is used
+        m2.assert_not_called()
+        self.assertIn('scale=200:-1', m1.call_args[0][0])
+
+    @patch('telegram_upload.video.probe_media', return_value=MediaProbe(10))
+    @patch('telegram_upload.video.get_video_size', return_value=[1080, 1920])
+    @patch('telegram_upload.video.call_ffmpeg')
+    def test_video_size_fallback(self, m1, m2, m3):
+        get_video_thumb('foo')
+        m2.assert_called_once_with('foo')
+        self.assertIn('scale=-1:200', m1.call_args[0][0])
 
-    @patch('telegram_upload.video.video_metadata')
-    def test_no_ratio(self, m):
+    @patch('telegram_upload.video.probe_media', return_value=MediaProbe())
+    @patch('telegram_upload.video.get_video_size', return_value=None)
+    def test_no_ratio(self, m1, m2):
         with self.assertRaises(ThumbVideoError):
             get_video_thumb('foo')
+
+
+class TestMediaProbe(unittest.TestCase):
+    def test_from_metadata(self):
+        metadata = MagicMock()
+        del metadata._MultipleMetadata__groups
+        metadata.has.return_value = True
+        metadata.get.side_effect = lambda key: {'duration': MagicMock(seconds=123), 'width': 1920,
+                                                'height': 1080}.get(key, key.capitalize())
+        probe = MediaProbe.from_metadata(metadata)
+        self.assertEqual((123, 1920, 1080, False), (probe.duration, probe.width, probe.height,
+                                                    probe.supports_streaming))
+        self.assertEqual({'title': 'Title', 'artist': 'Artist', 'album': 'Album', 'producer': 'Producer'},
+                         probe.tags)
+
+    def test_mkv(self):
+        metadata = MagicMock()
+        metadata.has.side_effect = lambda key: key == 'duration'
+        metadata.get.return_value.seconds = 10
+        groups = metadata._MultipleMetadata__groups
+        groups._key_list = ['audio meta', 'video meta']
+        groups.__getitem__.return_value.has.return_value = True
+        groups.__getitem__.return_value.get.side_effect = lambda key: {'width': 640, 'height': 480}[key]
+        probe = MediaProbe.from_metadata(metadata)
+        groups.__getitem__.assert_called_once_with('video meta')
+        self.assertEqual((10, 640, 480), (probe.duration, probe.width, probe.height))
+        self.assertEqual({}, probe.tags)
+
+    def test_no_metadata(self):
+        self.assertIsNone(MediaProbe.from_metadata(None))
+
+
+class TestProbeMedia(unittest.TestCase):
+    def setUp(self) -> None:
+        _probe_media_file.cache_clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.metadata_cache = MetadataCache(os.path.join(self.directory.name, 'metadata.sqlite3'))
+        patcher = patch('telegram_upload.video.get_metadata_cache', return_value=self.metadata_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.metadata_cache.close()
+        self.directory.cleanup()
+
+    @patch('telegram_upload.video.read_metadata', return_value=(None, True))
+    def test_parsed_once(self, m):
+        probe_media(__file__)
+        probe_media(__file__)
+        m.assert_called_once_with(os.path.abspath(__file__), METADATA_READ_SIZE)
+
+    @patch('telegram_upload.video.read_metadata', return_value=(None, True))
+    def test_metadata_cache(self, m):
+        with patch.object(MediaProbe, 'from_metadata', return_value=MediaProbe(10, 1920, 1080, True, title='Title')):
+            probe_media(__file__)
+        _probe_media_file.cache_clear()
+        probe = probe_media(__file__)
+        m.assert_called_once()
+        self.assertEqual((10, 1920, 1080, True), (probe.duration, probe.width, probe.height,
+                                                  probe.supports_streaming))
+        self.assertEqual({'title': 'Title'}, probe.tags)
+
+    @patch('telegram_upload.video.read_metadata', return_value=(None, True))
+    def test_metadata_cache_not_media(self, m):
+        probe_media(__file__)
+        _probe_media_file.cache_clear()
+        self.assertIsNone(probe_media(__file__))
+        m.assert_called_once()
+
+    @patch('telegram_upload.video.read_metadata', return_value=(None, False))
+    def test_metadata_cache_read_limit(self, m):
+        # The probes of the incomplete parses are saved with the read limit
+        probe_media(__file__)
+        _probe_media_file.cache_clear()
+        probe_media(__file__)
+        m.assert_called_once()
+        with self.subTest("Test greater read limit"), \
+                patch('telegram_upload.video.METADATA_READ_SIZE', METADATA_READ_SIZE + 1):
+            _probe_media_file.cache_clear()
+            probe_media(__file__)
+            self.assertEqual(2, m.call_count)